@@ -0,0 +1,453 @@
+"""
+AI analysis of a paper, cached per DOI in ANALYSIS_CACHE.
+
+Requests for a DOI that is not cached yet are coalesced so only one LLM
+call is made:
+
+- within a worker, concurrent callers await the same task;
+- across workers, the first caller claims the DOI by writing a "pending"
+  row; the others poll the row until the result lands. A claim older
+  than ANALYSIS_PENDING_TIMEOUT is considered abandoned and is taken over.
+
+Papers longer than ANALYSIS_CHUNK_CHARS are analyzed map-reduce style:
+the text is split on section headings (and paragraphs, for sections that
+are still too long), each chunk is summarized by its own LLM call, at most
+ANALYSIS_CONCURRENCY at a time, and a final call merges the chunk notes
+into the summary/quotes schema. Chunk results are cached in
+ANALYSIS_CHUNKS by content hash, so a retry only redoes the chunks that
+failed. They are deleted once the paper's final analysis is cached, or
+after ANALYSIS_CHUNK_RETENTION_DAYS if it never is.
+
+analysis_events() is the streaming view of the same pipeline, used by the
+SSE endpoint. While a listener is attached, the final LLM call is streamed
+and each summary field and quote is announced as soon as the model has
+finished writing it; a cached answer is replayed as the same events.
+
+The OpenAI client is passed in by the caller (see user.openai_client), so
+tests can hand in a stub with a responses.create() method (which also
+needs to accept stream=True for the streaming endpoint).
+"""
+
+import os
+import re
+import json
+import asyncio
+import hashlib
+import datetime
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+
+from db import get_db
+from paper_repository import paper_repo
+
+ANALYSIS_MODEL = os.environ.get("ANALYSIS_MODEL", "gpt-4.1")
+PENDING_TIMEOUT = float(os.environ.get("ANALYSIS_PENDING_TIMEOUT", "300"))
+POLL_INTERVAL = 1.0
+# About 6k tokens of English text per chunk.
+CHUNK_CHARS = int(os.environ.get("ANALYSIS_CHUNK_CHARS", "24000"))
+CONCURRENCY = int(os.environ.get("ANALYSIS_CONCURRENCY", "4"))
+# Chunk notes of an analysis that never completed are kept this long for
+# a retry to reuse.
+CHUNK_RETENTION_DAYS = int(os.environ.get("ANALYSIS_CHUNK_RETENTION_DAYS", "7"))
+
+SUMMARY_FIELDS = ("research_problem", "method", "data_collection", "data_analysis", "methodological_choices")
+_JSON_STRING = r'"((?:[^"\\]|\\.)*)"'
+FIELD_RE = re.compile(r'"(' + "|".join(SUMMARY_FIELDS) + r')"\s*:\s*' + _JSON_STRING)
+QUOTE_RE = re.compile(r'\{\s*"quote"\s*:\s*' + _JSON_STRING + r'\s*,\s*"why_important"\s*:\s*' + _JSON_STRING + r'\s*\}')
+
+# "2. Data", "3.1 Methods", "IV. RESULTS", "Conclusion" on a line of their own.
+SECTION_RE = re.compile(
+	r"\n(?=[ \t]*(?:(?:\d+(?:\.\d+)*|[IVX]+)\.?[ \t]+[A-Z][^\n]{0,80}"
+	r"|(?:abstract|introduction|background|literature review|data|methods?|methodology|results|discussion|conclusions?|references)[ \t]*)\n)",
+	re.IGNORECASE
+)
+
+PROMPT = """
+		You are an academic research assistant. Analyze the following paper text and return ONLY valid JSON with the structure:
+		{{
+		  "summary": {{
+			"research_problem": "...",
+			"method": "...",
+			"data_collection": "...",
+			"data_analysis": "...",
+			"methodological_choices": "..."
+		  }},
+		  "quotes": [
+			{{"quote": "...", "why_important": "..."}}
+		  ]
+		}}
+
+		Paper text:
+		\"\"\"{paper_text}\"\"\"
+		"""
+
+
+CHUNK_PROMPT = """
+		You are an academic research assistant. Below is part {part} of {parts} of a paper. Take notes on this part only and return ONLY valid JSON with the structure:
+		{{
+		  "notes": {{
+			"research_problem": "...",
+			"method": "...",
+			"data_collection": "...",
+			"data_analysis": "...",
+			"methodological_choices": "..."
+		  }},
+		  "quotes": [
+			{{"quote": "...", "why_important": "..."}}
+		  ]
+		}}
+		Leave a field empty when this part says nothing about it. Quotes must be verbatim from this part.
+
+		Paper text:
+		\"\"\"{paper_text}\"\"\"
+		"""
+
+REDUCE_PROMPT = """
+		You are an academic research assistant. The JSON below holds notes and quotes taken from consecutive parts of one paper. Combine them into an analysis of the whole paper and return ONLY valid JSON with the structure:
+		{{
+		  "summary": {{
+			"research_problem": "...",
+			"method": "...",
+			"data_collection": "...",
+			"data_analysis": "...",
+			"methodological_choices": "..."
+		  }},
+		  "quotes": [
+			{{"quote": "...", "why_important": "..."}}
+		  ]
+		}}
+		Keep the most important quotes verbatim.
+
+		Notes:
+		{notes}
+		"""
+
+
+def split_text(text: str, max_chars: int = CHUNK_CHARS) -> list:
+	"""Split on section headings, then pack sections into chunks of at most
+	max_chars; a section longer than that is split on paragraphs (and
+	at a space, as a last resort)."""
+	pieces = []
+	for section in SECTION_RE.split(text):
+		if len(section) <= max_chars:
+			pieces.append(section)
+			continue
+		for para in re.split(r"\n\s*\n", section):
+			while len(para) > max_chars:
+				cut = para.rfind(" ", 0, max_chars)
+				if cut <= 0:
+					cut = max_chars
+				pieces.append(para[:cut])
+				para = para[cut:]
+			pieces.append(para)
+
+	chunks, current = [], ""
+	for piece in pieces:
+		if current and len(current) + len(piece) + 1 > max_chars:
+			chunks.append(current)
+			current = ""
+		current = current + "\n" + piece if current else piece
+	if current.strip():
+		chunks.append(current)
+	return chunks
+
+
+def cached_analysis(doi: str):
+	with get_db() as db:
+		row = db.execute("SELECT ai_response FROM ANALYSIS_CACHE WHERE doi=?", (doi,)).fetchone()
+	if row and row[0]:
+		try:
+			return json.loads(row[0])
+		except Exception:
+			return None
+	return None
+
+
+def _claim(doi: str) -> bool:
+	now = datetime.datetime.now()
+	stale = (now - datetime.timedelta(seconds=PENDING_TIMEOUT)).isoformat()
+	with get_db() as db:
+		cur = db.execute(
+			"""INSERT INTO ANALYSIS_CACHE (doi, status, claimed_at) VALUES (?, 'pending', ?)
+			ON CONFLICT(doi) DO UPDATE SET status='pending', claimed_at=excluded.claimed_at
+			WHERE ANALYSIS_CACHE.status IS NOT 'pending' OR ANALYSIS_CACHE.claimed_at < ?""",
+			(doi, now.isoformat(), stale)
+		)
+		return cur.rowcount == 1
+
+
+def _store(doi: str, parsed: dict):
+	with get_db() as db:
+		db.execute(
+			"""INSERT INTO ANALYSIS_CACHE (doi, ai_response, status, claimed_at) VALUES (?, ?, 'done', NULL)
+			ON CONFLICT(doi) DO UPDATE SET ai_response=excluded.ai_response, status='done', claimed_at=NULL""",
+			(doi, json.dumps(parsed))
+		)
+		# The chunk notes were only kept for retries of this analysis.
+		stale = (datetime.datetime.now() - datetime.timedelta(days=CHUNK_RETENTION_DAYS)).isoformat()
+		db.execute("DELETE FROM ANALYSIS_CHUNKS WHERE doi=? OR created_at<?", (doi, stale))
+
+
+def _release(doi: str):
+	# Drop our claim after a failure so the next request retries at once.
+	with get_db() as db:
+		db.execute("DELETE FROM ANALYSIS_CACHE WHERE doi=? AND status='pending' AND ai_response IS NULL", (doi,))
+		db.execute("UPDATE ANALYSIS_CACHE SET status=NULL, claimed_at=NULL WHERE doi=? AND status='pending'", (doi,))
+
+
+async def _paper_text(doi: str) -> str:
+	try:
+		paper_id = await paper_repo.id_for_doi(doi) or doi
+		paper_data = await paper_repo.get_text(paper_id)
+		paper_text = paper_data.get("text", "")
+	except HTTPException:
+		raise
+	except Exception as e:
+		raise HTTPException(status_code=500, detail=f"Failed to get paper text: {str(e)}")
+	if not paper_text.strip():
+		raise HTTPException(status_code=404, detail="Paper text not found")
+	return paper_text
+
+
+async def _complete(client, prompt: str) -> str:
+	try:
+		response = await run_in_threadpool(client.responses.create, model=ANALYSIS_MODEL, input=prompt, temperature=0)
+	except Exception as e:
+		raise HTTPException(status_code=500, detail=f"OpenAI API call failed: {str(e)}")
+	return response.output_text.strip()
+
+
+async def _complete_streaming(client, prompt: str, on_text) -> str:
+	"""Like _complete, but streams the output and calls on_text with the
+	text received so far after every delta."""
+	loop = asyncio.get_running_loop()
+	deltas = asyncio.Queue()
+
+	def produce():
+		try:
+			stream = client.responses.create(model=ANALYSIS_MODEL, input=prompt, temperature=0, stream=True)
+			for event in stream:
+				if getattr(event, "type", None) == "response.output_text.delta":
+					loop.call_soon_threadsafe(deltas.put_nowait, event.delta)
+		finally:
+			loop.call_soon_threadsafe(deltas.put_nowait, None)
+
+	producer = asyncio.ensure_future(run_in_threadpool(produce))
+	text = ""
+	while True:
+		delta = await deltas.get()
+		if delta is None:
+			break
+		text += delta
+		on_text(text)
+	try:
+		await producer
+	except Exception as e:
+		raise HTTPException(status_code=500, detail=f"OpenAI API call failed: {str(e)}")
+	return text.strip()
+
+
+class _FieldWatcher:
+	"""Announces summary fields and quotes of a partial answer once their
+	JSON strings are closed."""
+
+	def __init__(self, doi: str):
+		self.doi = doi
+		self.fields = set()
+		self.quotes = 0
+
+	def __call__(self, text: str):
+		for m in FIELD_RE.finditer(text):
+			if m.group(1) not in self.fields:
+				self.fields.add(m.group(1))
+				_emit(self.doi, "summary", {"field": m.group(1), "value": _unescape(m.group(2))})
+		quotes = QUOTE_RE.findall(text)
+		for quote, why in quotes[self.quotes:]:
+			_emit(self.doi, "quote", {"index": self.quotes, "quote": _unescape(quote), "why_important": _unescape(why)})
+			self.quotes += 1
+
+
+def _unescape(raw: str) -> str:
+	try:
+		return json.loads(f'"{raw}"')
+	except json.JSONDecodeError:
+		return raw
+
+
+def _parse(output: str) -> dict:
+	try:
+		return json.loads(output)
+	except json.JSONDecodeError:
+		raise HTTPException(status_code=500, detail="Model did not return valid JSON")
+
+
+def _chunk_key(prompt: str) -> str:
+	return hashlib.sha1(f"{ANALYSIS_MODEL}\n{prompt}".encode("utf-8")).hexdigest()
+
+
+def _cached_chunks(keys: list) -> dict:
+	marks = ",".join("?" * len(keys))
+	with get_db() as db:
+		rows = db.execute(f"SELECT chunk_key, result FROM ANALYSIS_CHUNKS WHERE chunk_key IN ({marks})", keys).fetchall()
+	return {k: json.loads(r) for k, r in rows}
+
+
+def _store_chunk(doi: str, key: str, result: dict):
+	with get_db() as db:
+		db.execute(
+			"INSERT OR REPLACE INTO ANALYSIS_CHUNKS (chunk_key, doi, result, created_at) VALUES (?, ?, ?, ?)",
+			(key, doi, json.dumps(result), datetime.datetime.now().isoformat())
+		)
+
+
+async def _map_chunks(doi: str, chunks: list, client) -> list:
+	prompts = [
+		CHUNK_PROMPT.format(part=i + 1, parts=len(chunks), paper_text=chunk)
+		for i, chunk in enumerate(chunks)
+	]
+	keys = [_chunk_key(p) for p in prompts]
+	results = await run_in_threadpool(_cached_chunks, keys)
+	limit = asyncio.Semaphore(CONCURRENCY)
+
+	async def run_chunk(key, prompt):
+		async with limit:
+			result = _parse(await _complete(client, prompt))
+		await run_in_threadpool(_store_chunk, doi, key, result)
+		results[key] = result
+		_emit(doi, "progress", {"chunks": len(keys), "done": len(results)})
+
+	todo = [run_chunk(k, p) for k, p in zip(keys, prompts) if k not in results]
+	_emit(doi, "progress", {"chunks": len(keys), "done": len(keys) - len(todo)})
+	# Every chunk runs to completion (and is cached) even if another fails,
+	# so the retry only pays for the failed ones.
+	for outcome in await asyncio.gather(*todo, return_exceptions=True):
+		if isinstance(outcome, BaseException):
+			raise outcome
+	return [results[k] for k in keys]
+
+
+async def _final(doi: str, client, prompt: str) -> dict:
+	if _listeners.get(doi):
+		return _parse(await _complete_streaming(client, prompt, _FieldWatcher(doi)))
+	return _parse(await _complete(client, prompt))
+
+
+async def _run(doi: str, client) -> dict:
+	paper_text = await _paper_text(doi)
+	chunks = split_text(paper_text)
+	if len(chunks) <= 1:
+		return await _final(doi, client, PROMPT.format(paper_text=paper_text))
+	notes = await _map_chunks(doi, chunks, client)
+	return await _final(doi, client, REDUCE_PROMPT.format(notes=json.dumps(notes, ensure_ascii=False)))
+
+
+async def _analyze_once(doi: str, client) -> dict:
+	while True:
+		parsed = await run_in_threadpool(cached_analysis, doi)
+		if parsed is not None:
+			return parsed
+		if await run_in_threadpool(_claim, doi):
+			break
+		await asyncio.sleep(POLL_INTERVAL)
+
+	try:
+		parsed = await _run(doi, client)
+	except BaseException:
+		# The thread runs to the end even if we are cancelled meanwhile.
+		await run_in_threadpool(_release, doi)
+		raise
+	await run_in_threadpool(_store, doi, parsed)
+	return parsed
+
+
+class SingleFlight:
+	"""Run at most one task per key at a time; other callers share its result."""
+
+	def __init__(self):
+		self._tasks = {}
+
+	async def do(self, key, make_coro):
+		task = self._tasks.get(key)
+		if task is None:
+			task = asyncio.ensure_future(make_coro())
+			self._tasks[key] = task
+			task.add_done_callback(lambda _: self._tasks.pop(key, None))
+		# A caller that disconnects must not cancel the others' analysis.
+		return await asyncio.shield(task)
+
+
+_flights = SingleFlight()
+# doi -> queues of the streams currently waiting on that analysis.
+_listeners = {}
+
+
+def _emit(doi: str, event: str, data: dict):
+	for queue in _listeners.get(doi, ()):
+		queue.put_nowait((event, data))
+
+
+async def analyze(doi: str, client) -> dict:
+	parsed = await run_in_threadpool(cached_analysis, doi)
+	if parsed is not None:
+		return parsed
+	return await _flights.do(doi, lambda: _analyze_once(doi, client))
+
+
+def _replay(parsed: dict):
+	summary = parsed.get("summary") if isinstance(parsed, dict) else None
+	if isinstance(summary, dict):
+		for field, value in summary.items():
+			yield "summary", {"field": field, "value": value}
+	quotes = parsed.get("quotes") if isinstance(parsed, dict) else None
+	if isinstance(quotes, list):
+		for i, quote in enumerate(quotes):
+			if isinstance(quote, dict):
+				yield "quote", {"index": i, **quote}
+
+
+async def analysis_events(doi: str, client):
+	"""Yield (event, data) pairs for the analysis of doi.
+
+	"progress", "summary" and "quote" events are previews; the closing
+	"done" event carries the full validated JSON, or "error" carries
+	{"status", "detail"}. A cached answer is replayed as summary and quote
+	events followed by done.
+	"""
+	parsed = await run_in_threadpool(cached_analysis, doi)
+	if parsed is not None:
+		for event in _replay(parsed):
+			yield event
+		yield "done", parsed
+		return
+
+	queue = asyncio.Queue()
+	_listeners.setdefault(doi, set()).add(queue)
+	result = asyncio.ensure_future(analyze(doi, client))
+	try:
+		while not result.done():
+			getter = asyncio.ensure_future(queue.get())
+			await asyncio.wait({getter, result}, return_when=asyncio.FIRST_COMPLETED)
+			if getter.done():
+				yield getter.result()
+			else:
+				getter.cancel()
+		while not queue.empty():
+			yield queue.get_nowait()
+		try:
+			parsed = result.result()
+		except HTTPException as e:
+			yield "error", {"status": e.status_code, "detail": e.detail}
+			return
+		except Exception as e:
+			yield "error", {"status": 500, "detail": str(e)}
+			return
+		yield "done", parsed
+	finally:
+		# The analysis itself is shielded and keeps running for others.
+		result.cancel()
+		queue_set = _listeners.get(doi)
+		if queue_set is not None:
+			queue_set.discard(queue)
+			if not queue_set:
+				del _listeners[doi]
@@ -0,0 +1,20 @@
+"""
+The "card" form of a paper: what a result row or recommendation shows.
+
+Search results (main.py), the cold-start set and the similar-papers table
+all build cards here, so they carry the same fields and snippet. The
+snippet is cut from the abstract rather than highlighted from
+paperContent, which would make ES load and re-analyze every hit's full
+body in the fetch phase.
+"""
+
+CARD_FIELDS = ["ID", "DOI", "Title", "Author", "Year", "Journal"]
+SNIPPET_CHARS = 300
+# The _source fields to fetch for a card.
+CARD_SOURCE = CARD_FIELDS + ["Abstract"]
+
+
+def card(src: dict) -> dict:
+	out = {f: src.get(f) for f in CARD_FIELDS}
+	out["snippet"] = (src.get("Abstract") or "")[:SNIPPET_CHARS]
+	return out
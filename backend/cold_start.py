@@ -0,0 +1,66 @@
+"""
+Home-page recommendations for users without collections.
+
+The paper IDs live in COLD_START_FILE. They are fetched with a single mget
+at startup, kept in memory and refreshed in the background, so serving a
+new user's home page does not touch ES.
+"""
+
+import os
+import json
+import asyncio
+import logging
+
+from cards import CARD_SOURCE, card
+
+COLD_START_FILE = os.environ.get("COLD_START_FILE", "cold_start.json")
+COLD_START_REFRESH_SECONDS = int(os.environ.get("COLD_START_REFRESH_SECONDS", "3600"))
+
+logger = logging.getLogger("cold_start")
+
+
+class ColdStartSet:
+	def __init__(self, path: str = COLD_START_FILE):
+		self.path = path
+		self.items = []
+		self.loaded = False
+		self._lock = asyncio.Lock()
+
+	def paper_ids(self) -> list:
+		try:
+			with open(self.path, "r", encoding="utf-8") as f:
+				return [str(pid) for pid in json.load(f)]
+		except FileNotFoundError:
+			return []
+
+	def save_paper_ids(self, paper_ids: list):
+		tmp = self.path + ".tmp"
+		with open(tmp, "w", encoding="utf-8") as f:
+			json.dump([str(pid) for pid in paper_ids], f)
+		os.replace(tmp, self.path)
+
+	async def refresh(self, es, index: str):
+		async with self._lock:
+			ids = self.paper_ids()
+			items = []
+			if ids:
+				res = await es.mget(index=index, ids=ids, source=CARD_SOURCE)
+				for doc in res.get("docs", []):
+					if doc.get("found"):
+						items.append(card(doc.get("_source") or {}))
+			self.items = items
+			self.loaded = True
+			return items
+
+	async def get(self, es, index: str) -> list:
+		if not self.loaded:
+			await self.refresh(es, index)
+		return self.items
+
+	async def refresh_forever(self, es, index: str):
+		while True:
+			try:
+				await self.refresh(es, index)
+			except Exception:
+				logger.exception("Cold-start refresh failed")
+			await asyncio.sleep(COLD_START_REFRESH_SECONDS)
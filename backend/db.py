@@ -0,0 +1,112 @@
+"""
+Connection handling for app.db.
+
+Every thread keeps one open connection and reuses it, so a request no
+longer pays for a new sqlite3.connect() in auth_user and again in the
+handler. The database runs in WAL mode, where readers and the single
+writer do not block each other, and busy_timeout makes a writer wait for
+the lock instead of failing with "database is locked" when several
+uvicorn workers write at once.
+
+    with get_db() as db:
+        db.execute(...)
+
+commits on exit (rolls back on error) but leaves the connection open.
+Database work belongs in sync code: plain `def` endpoints, which FastAPI
+runs in its threadpool, or helpers that async code calls through
+run_in_threadpool. Coroutines all run on the event loop thread and would
+share its connection, so one awaiting inside a `with get_db()` block
+would let another commit or roll back its half-done transaction. A
+thread therefore gets one block at a time: entering get_db() again
+before the first block exits, nested or from another coroutine, raises
+RuntimeError instead.
+"""
+
+import os
+import sqlite3
+import threading
+import contextlib
+
+DB_NAME = os.environ.get("APP_DB", "app.db")
+BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+# Page cache per connection, in KiB.
+CACHE_SIZE_KB = int(os.environ.get("SQLITE_CACHE_SIZE_KB", "16384"))
+STATEMENT_CACHE_SIZE = 256
+
+_local = threading.local()
+
+
+def _connect() -> sqlite3.Connection:
+	db = sqlite3.connect(
+		DB_NAME,
+		timeout=BUSY_TIMEOUT_MS / 1000,
+		cached_statements=STATEMENT_CACHE_SIZE,
+	)
+	db.execute("PRAGMA journal_mode=WAL")
+	db.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+	# NORMAL is durable in WAL mode except for the last commits before a
+	# power loss; it skips the fsync on every transaction.
+	db.execute("PRAGMA synchronous=NORMAL")
+	db.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+	db.execute("PRAGMA temp_store=MEMORY")
+	return db
+
+
+def _connection() -> sqlite3.Connection:
+	db = getattr(_local, "db", None)
+	# A connection must not cross a fork, e.g. into a uvicorn worker.
+	if db is None or _local.pid != os.getpid():
+		db = _connect()
+		_local.db = db
+		_local.pid = os.getpid()
+		_local.in_use = False
+	return db
+
+
+@contextlib.contextmanager
+def get_db():
+	db = _connection()
+	if _local.in_use:
+		raise RuntimeError("app.db connection already in use on this thread (nested or interleaved get_db())")
+	_local.in_use = True
+	try:
+		with db:
+			yield db
+	finally:
+		_local.in_use = False
+
+
+def close_db():
+	db = getattr(_local, "db", None)
+	if db is not None:
+		db.close()
+		_local.db = None
+
+
+def migrate(db: sqlite3.Connection, steps: list) -> int:
+	"""Bring the schema up to date.
+
+	steps is an append-only list of SQL statements or callables taking the
+	connection; PRAGMA user_version records how many have been applied.
+	Each step runs in its own IMMEDIATE transaction, so concurrent workers
+	starting together apply it once.
+	"""
+	applied = 0
+	while True:
+		db.execute("BEGIN IMMEDIATE")
+		try:
+			version = db.execute("PRAGMA user_version").fetchone()[0]
+			if version >= len(steps):
+				db.rollback()
+				return applied
+			step = steps[version]
+			if callable(step):
+				step(db)
+			else:
+				db.execute(step)
+			db.execute(f"PRAGMA user_version={version + 1}")
+			db.commit()
+		except Exception:
+			db.rollback()
+			raise
+		applied += 1
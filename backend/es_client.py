@@ -0,0 +1,24 @@
+import os
+from elasticsearch import AsyncElasticsearch
+
+ES_HOST = os.environ.get("ES_HOST", "http://paperion-elasticsearch:9200")
+# Size of the keep-alive pool per ES node; this bounds how many searches a
+# single worker can have in flight at once.
+ES_CONNECTIONS_PER_NODE = int(os.environ.get("ES_CONNECTIONS_PER_NODE", "256"))
+ES_REQUEST_TIMEOUT = float(os.environ.get("ES_REQUEST_TIMEOUT", "30"))
+ES_MAX_RETRIES = int(os.environ.get("ES_MAX_RETRIES", "2"))
+ES_FAKE_DATA = os.environ.get("ES_FAKE_DATA")
+
+
+def make_async_es() -> AsyncElasticsearch:
+	kwargs = {
+		"connections_per_node": ES_CONNECTIONS_PER_NODE,
+		"request_timeout": ES_REQUEST_TIMEOUT,
+		"max_retries": ES_MAX_RETRIES,
+		"retry_on_timeout": True,
+	}
+	if ES_FAKE_DATA:
+		from fake_es import FakeNode, load_documents
+		load_documents(ES_FAKE_DATA)
+		kwargs["node_class"] = FakeNode
+	return AsyncElasticsearch(ES_HOST, **kwargs)
@@ -0,0 +1,362 @@
+"""
+In-memory Elasticsearch node used to run the backend without a cluster.
+
+Set ES_FAKE_DATA to a JSON file holding a list of paper documents (the
+`_source` of each hit, keyed by "ID") and the async client is wired to
+this node instead of the network. Only the query shapes used by the API
+are understood; anything else matches every document.
+"""
+
+import json
+import random
+import re
+import time
+import uuid
+from urllib.parse import urlsplit, parse_qs, unquote
+
+from elastic_transport import ApiResponseMeta, BaseAsyncNode, HttpHeaders
+from elastic_transport._node import NodeApiResponse
+
+TOKEN_RE = re.compile(r"\w+")
+
+DOCUMENTS: dict = {}
+POINTS_IN_TIME: dict = {}
+
+
+def load_documents(path: str, index: str = "papers"):
+	with open(path, "r", encoding="utf-8") as f:
+		data = json.load(f)
+	if isinstance(data, dict):
+		data = list(data.values())
+	store = DOCUMENTS.setdefault(index, {})
+	for src in data:
+		store[str(src.get("ID"))] = src
+	return len(data)
+
+
+def _tokens(value) -> list:
+	if value is None:
+		return []
+	if isinstance(value, (list, tuple)):
+		out = []
+		for v in value:
+			out.extend(_tokens(v))
+		return out
+	return TOKEN_RE.findall(str(value).lower())
+
+
+def _field(src: dict, name: str):
+	if name.endswith(".keyword"):
+		name = name[: -len(".keyword")]
+	return src.get(name)
+
+
+def _as_number(value):
+	try:
+		return float(value)
+	except (TypeError, ValueError):
+		return None
+
+
+def _score(query: dict, doc_id: str, src: dict, index: str):
+	if not query:
+		return 1.0
+	kind, spec = next(iter(query.items()))
+
+	if kind == "match_all":
+		return 1.0
+
+	if kind == "ids":
+		return 1.0 if doc_id in map(str, spec.get("values", [])) else None
+
+	if kind in ("term", "terms"):
+		field, value = next(iter(spec.items()))
+		if isinstance(value, dict):
+			value = value.get("value")
+		values = value if kind == "terms" else [value]
+		actual = _field(src, field)
+		return 1.0 if actual is not None and str(actual) in map(str, values) else None
+
+	if kind == "exists":
+		return 1.0 if _field(src, spec["field"]) not in (None, "") else None
+
+	if kind == "range":
+		field, bounds = next(iter(spec.items()))
+		actual = _as_number(_field(src, field))
+		if actual is None:
+			return None
+		for op, limit in bounds.items():
+			limit = _as_number(limit)
+			if limit is None:
+				continue
+			if op == "gt" and not actual > limit:
+				return None
+			if op == "gte" and not actual >= limit:
+				return None
+			if op == "lt" and not actual < limit:
+				return None
+			if op == "lte" and not actual <= limit:
+				return None
+		return 1.0
+
+	if kind == "match":
+		field, value = next(iter(spec.items()))
+		operator = "or"
+		if isinstance(value, dict):
+			operator = value.get("operator", "or").lower()
+			value = value.get("query")
+		wanted = set(_tokens(value))
+		have = set(_tokens(_field(src, field)))
+		hits = wanted & have
+		if not wanted or not hits or (operator == "and" and hits != wanted):
+			return None
+		return float(len(hits))
+
+	if kind == "match_phrase":
+		field, value = next(iter(spec.items()))
+		if isinstance(value, dict):
+			value = value.get("query")
+		wanted = " ".join(_tokens(value))
+		have = " ".join(_tokens(_field(src, field)))
+		return 1.0 if wanted and f" {wanted} " in f" {have} " else None
+
+	if kind == "more_like_this":
+		like = spec.get("like")
+		like = like if isinstance(like, list) else [like]
+		wanted = set()
+		for item in like:
+			if isinstance(item, dict):
+				ref = DOCUMENTS.get(item.get("_index", index), {}).get(str(item.get("_id")))
+				if str(item.get("_id")) == doc_id:
+					return None
+				for field in spec.get("fields", []):
+					wanted.update(_tokens(_field(ref or {}, field)))
+			else:
+				wanted.update(_tokens(item))
+		have = set()
+		for field in spec.get("fields", []):
+			have.update(_tokens(_field(src, field)))
+		hits = wanted & have
+		return float(len(hits)) if hits else None
+
+	if kind == "bool":
+		total = 0.0
+		for clause in _as_list(spec.get("must")):
+			s = _score(clause, doc_id, src, index)
+			if s is None:
+				return None
+			total += s
+		for clause in _as_list(spec.get("filter")):
+			if _score(clause, doc_id, src, index) is None:
+				return None
+		for clause in _as_list(spec.get("must_not")):
+			if _score(clause, doc_id, src, index) is not None:
+				return None
+		should = _as_list(spec.get("should"))
+		matched = 0
+		for clause in should:
+			s = _score(clause, doc_id, src, index)
+			if s is not None:
+				matched += 1
+				total += s
+		required = spec.get("minimum_should_match")
+		if required is None:
+			required = 0 if (spec.get("must") or spec.get("filter")) else (1 if should else 0)
+		if matched < int(required):
+			return None
+		return total or 1.0
+
+	if kind == "function_score":
+		base = _score(spec.get("query", {"match_all": {}}), doc_id, src, index)
+		if base is None:
+			return None
+		for fn in spec.get("functions", []) or [spec]:
+			if "random_score" in fn:
+				seed = fn["random_score"].get("seed", 0)
+				base = random.Random(f"{seed}:{doc_id}").random()
+		return base
+
+	return 1.0
+
+
+def _as_list(value) -> list:
+	if value is None:
+		return []
+	return value if isinstance(value, list) else [value]
+
+
+def _filter_source(src: dict, source_spec, params: dict):
+	if source_spec is None and "_source" in params:
+		# The client sends source= as a query parameter: true, false or a
+		# comma-separated field list.
+		source_spec = {"true": True, "false": False}.get(params["_source"], params["_source"].split(","))
+	includes = params.get("_source_includes")
+	excludes = params.get("_source_excludes")
+	includes = includes.split(",") if includes else None
+	excludes = excludes.split(",") if excludes else []
+	if source_spec is False:
+		return None
+	if isinstance(source_spec, str):
+		includes = [source_spec]
+	elif isinstance(source_spec, list):
+		includes = source_spec
+	elif isinstance(source_spec, dict):
+		includes = source_spec.get("includes") or source_spec.get("include") or includes
+		excludes = source_spec.get("excludes") or source_spec.get("exclude") or excludes
+	out = dict(src)
+	if includes:
+		out = {k: v for k, v in out.items() if k in includes}
+	for k in excludes:
+		out.pop(k, None)
+	return out
+
+
+def _sort_key(sort_spec, hit):
+	key = []
+	for entry in sort_spec:
+		field, order = (entry, "asc") if isinstance(entry, str) else next(iter(entry.items()))
+		if isinstance(order, dict):
+			order = order.get("order", "asc")
+		if field == "_score":
+			value = hit["_score"]
+		elif field in ("_doc", "_shard_doc"):
+			value = _as_number(hit["_id"]) or 0.0
+		else:
+			value = _field(hit["_full"], field)
+			value = _as_number(value) if _as_number(value) is not None else (value or "")
+		key.append((value, order))
+	return key
+
+
+class FakeNode(BaseAsyncNode):
+	_CLIENT_META_HTTP_CLIENT = ("fake", "1")
+
+	async def perform_request(self, method, target, body=None, headers=None, request_timeout=None):
+		start = time.time()
+		parts = urlsplit(target)
+		params = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+		path = [unquote(p) for p in parts.path.strip("/").split("/") if p]
+		status, payload = self._route(method, path, params, body)
+		meta = ApiResponseMeta(
+			status=status,
+			http_version="1.1",
+			headers=HttpHeaders({"content-type": "application/json", "x-elastic-product": "Elasticsearch"}),
+			duration=time.time() - start,
+			node=self.config,
+		)
+		return NodeApiResponse(meta, json.dumps(payload).encode("utf-8"))
+
+	async def close(self):
+		pass
+
+	def _route(self, method, path, params, body):
+		if not path:
+			return 200, {"version": {"number": "8.15.1"}, "tagline": "You Know, for Search"}
+		if path[-1] == "_msearch":
+			return 200, self._msearch(path[0] if len(path) > 1 else None, body)
+		data = json.loads(body) if body else {}
+		if path[-1] == "_search":
+			return self._search(path[0] if len(path) > 1 else None, data, params)
+		if path[-1] == "_mget":
+			return 200, self._mget(path[0] if len(path) > 1 else None, data, params)
+		if path[-1] == "_pit":
+			if method == "DELETE":
+				POINTS_IN_TIME.pop(data.get("id"), None)
+				return 200, {"succeeded": True, "num_freed": 1}
+			pit_id = uuid.uuid4().hex
+			POINTS_IN_TIME[pit_id] = path[0]
+			return 200, {"id": pit_id}
+		if len(path) == 3 and path[1] == "_doc":
+			index, doc_id = path[0], path[2]
+			if method in ("PUT", "POST"):
+				DOCUMENTS.setdefault(index, {})[doc_id] = data
+				return 200, {"_index": index, "_id": doc_id, "result": "updated"}
+			src = DOCUMENTS.get(index, {}).get(doc_id)
+			if src is None:
+				return 404, {"_index": index, "_id": doc_id, "found": False}
+			return 200, {"_index": index, "_id": doc_id, "found": True,
+						 "_source": _filter_source(src, None, params)}
+		if len(path) == 3 and path[1] == "_update":
+			index, doc_id = path[0], path[2]
+			store = DOCUMENTS.setdefault(index, {})
+			if doc_id not in store and not data.get("doc_as_upsert"):
+				return 404, {"error": {"type": "document_missing_exception"}, "status": 404}
+			store.setdefault(doc_id, {}).update(data.get("doc", {}))
+			return 200, {"_index": index, "_id": doc_id, "result": "updated"}
+		return 400, {"error": {"type": "unsupported_fake_request", "reason": "/".join(path)}, "status": 400}
+
+	def _search(self, index, data, params):
+		pit = data.get("pit")
+		if pit:
+			index = POINTS_IN_TIME.get(pit.get("id"))
+			if index is None:
+				return 404, {"error": {"type": "search_context_missing_exception"}, "status": 404}
+		store = DOCUMENTS.get(index, {})
+		query = data.get("query", {"match_all": {}})
+		hits = []
+		for doc_id, src in store.items():
+			score = _score(query, doc_id, src, index)
+			if score is not None:
+				hits.append({"_index": index, "_id": doc_id, "_score": score, "_full": src})
+
+		sort_spec = data.get("sort") or [{"_score": "desc"}]
+		for entry in reversed(sort_spec):
+			field, order = (entry, "asc") if isinstance(entry, str) else next(iter(entry.items()))
+			if isinstance(order, dict):
+				order = order.get("order", "asc")
+			hits.sort(key=lambda h, e=entry: _sort_key([e], h)[0][0], reverse=(order == "desc"))
+		for h in hits:
+			h["sort"] = [k for k, _ in _sort_key(sort_spec, h)]
+
+		search_after = data.get("search_after")
+		if search_after is not None:
+			for i, h in enumerate(hits):
+				if h["sort"] == search_after:
+					hits = hits[i + 1:]
+					break
+
+		total = len(hits)
+		start = int(data.get("from", params.get("from", 0)))
+		size = int(data.get("size", params.get("size", 10)))
+		page = hits[start:start + size]
+		for h in page:
+			src = h.pop("_full")
+			filtered = _filter_source(src, data.get("_source"), params)
+			if filtered is not None:
+				h["_source"] = filtered
+			if not data.get("sort"):
+				h.pop("sort")
+		out = {
+			"took": 0,
+			"timed_out": False,
+			"hits": {"total": {"value": total, "relation": "eq"}, "max_score": None, "hits": page},
+		}
+		if pit:
+			out["pit_id"] = pit.get("id")
+		return 200, out
+
+	def _mget(self, index, data, params):
+		docs = data.get("docs") or [{"_id": i} for i in data.get("ids", [])]
+		out = []
+		for d in docs:
+			idx = d.get("_index", index)
+			doc_id = str(d.get("_id"))
+			src = DOCUMENTS.get(idx, {}).get(doc_id)
+			if src is None:
+				out.append({"_index": idx, "_id": doc_id, "found": False})
+				continue
+			filtered = _filter_source(src, d.get("_source"), params)
+			entry = {"_index": idx, "_id": doc_id, "found": True}
+			if filtered is not None:
+				entry["_source"] = filtered
+			out.append(entry)
+		return {"docs": out}
+
+	def _msearch(self, index, body):
+		lines = [json.loads(line) for line in (body or b"").decode("utf-8").splitlines() if line.strip()]
+		responses = []
+		for header, data in zip(lines[0::2], lines[1::2]):
+			status, res = self._search(header.get("index", index), data, {})
+			res["status"] = status
+			responses.append(res)
+		return {"took": 0, "responses": responses}
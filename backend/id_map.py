@@ -0,0 +1,127 @@
+"""
+Local paper ID <-> DOI mapping.
+
+A SQLite file with one row per paper, keyed on ID and indexed on the
+normalized DOI, so both directions are a B-tree lookup instead of an ES
+search. The API reads it through PaperRepository (falling back to ES for
+papers it does not know yet and remembering the answer); the dataOps
+scripts import it directly and add the papers they ingest.
+
+	python id_map.py build [--es URL] [--index papers] [--batch 5000]
+
+fills it from the papers index. This module only depends on the standard
+library so the dataOps scripts can import it without the API's packages.
+"""
+
+import os
+import sqlite3
+import argparse
+import threading
+
+ID_MAP_DB = os.environ.get("ID_MAP_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "id_map.db"))
+MMAP_SIZE = 256 * 1024 * 1024
+DOI_PREFIXES = ("https://doi.org/", "http://doi.org/", "https://dx.doi.org/", "http://dx.doi.org/", "doi:")
+
+_local = threading.local()
+
+
+def normalize_doi(doi: str) -> str:
+	doi = (doi or "").strip()
+	lowered = doi.lower()
+	for prefix in DOI_PREFIXES:
+		if lowered.startswith(prefix):
+			doi = doi[len(prefix):]
+			break
+	return doi.strip().lower()
+
+
+def _db() -> sqlite3.Connection:
+	db = getattr(_local, "db", None)
+	if db is None or _local.pid != os.getpid():
+		db = sqlite3.connect(ID_MAP_DB, timeout=30)
+		db.execute("PRAGMA journal_mode=WAL")
+		db.execute("PRAGMA synchronous=NORMAL")
+		db.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+		db.execute('''CREATE TABLE IF NOT EXISTS PAPER_IDS (
+			id TEXT PRIMARY KEY,
+			doi TEXT NOT NULL,
+			doi_norm TEXT NOT NULL
+		) WITHOUT ROWID''')
+		db.execute("CREATE INDEX IF NOT EXISTS idx_paper_ids_doi ON PAPER_IDS(doi_norm)")
+		db.commit()
+		_local.db = db
+		_local.pid = os.getpid()
+	return db
+
+
+def doi_for_id(paper_id) -> str | None:
+	row = _db().execute("SELECT doi FROM PAPER_IDS WHERE id=?", (str(paper_id).strip(),)).fetchone()
+	return row[0] if row else None
+
+
+def dois_for_ids(paper_ids) -> dict:
+	"""Known DOIs for the given IDs; unknown IDs are left out."""
+	ids = list(dict.fromkeys(str(p).strip() for p in paper_ids))
+	out = {}
+	db = _db()
+	# Stay under SQLite's bound-parameter limit.
+	for i in range(0, len(ids), 500):
+		chunk = ids[i:i + 500]
+		marks = ",".join("?" * len(chunk))
+		out.update(db.execute(f"SELECT id, doi FROM PAPER_IDS WHERE id IN ({marks})", chunk).fetchall())
+	return out
+
+
+def id_for_doi(doi: str) -> str | None:
+	row = _db().execute("SELECT id FROM PAPER_IDS WHERE doi_norm=? LIMIT 1", (normalize_doi(doi),)).fetchone()
+	return row[0] if row else None
+
+
+def store_many(pairs) -> int:
+	"""Add or update (paper_id, doi) pairs; pairs without a DOI are skipped."""
+	rows = [
+		(str(pid).strip(), doi.strip(), normalize_doi(doi))
+		for pid, doi in pairs
+		if pid and isinstance(doi, str) and doi.strip()
+	]
+	db = _db()
+	with db:
+		db.executemany("INSERT OR REPLACE INTO PAPER_IDS (id, doi, doi_norm) VALUES (?, ?, ?)", rows)
+	return len(rows)
+
+
+def store(paper_id, doi: str):
+	store_many([(paper_id, doi)])
+
+
+def build(es, index: str, batch: int):
+	after = None
+	total = 0
+	while True:
+		body = {
+			"query": {"exists": {"field": "DOI"}},
+			"_source": ["ID", "DOI"],
+			"sort": [{"ID": "asc"}],
+			"size": batch,
+		}
+		if after is not None:
+			body["search_after"] = after
+		hits = es.search(index=index, body=body)["hits"]["hits"]
+		if not hits:
+			break
+		after = hits[-1]["sort"]
+		total += store_many((h["_source"].get("ID") or h["_id"], h["_source"].get("DOI")) for h in hits)
+		print(f"{total} papers mapped")
+	print(f"Done. {total} papers in {ID_MAP_DB}")
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Build the local ID <-> DOI map")
+	parser.add_argument("command", choices=["build"])
+	parser.add_argument("--es", default=os.environ.get("ES_HOST", "http://localhost:9200"))
+	parser.add_argument("--index", default="papers")
+	parser.add_argument("--batch", type=int, default=5000)
+	args = parser.parse_args()
+
+	from elasticsearch import Elasticsearch
+	build(Elasticsearch(args.es, request_timeout=600), args.index, args.batch)
@@ -1,17 +1,23 @@
-from fastapi import FastAPI, Query
+from fastapi import FastAPI, Depends, Query
 from fastapi import HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from elasticsearch import Elasticsearch
+from fastapi.concurrency import run_in_threadpool
+from elasticsearch import NotFoundError
 from typing import Optional
-from scihub import SciHub
-import requests
+from paper_repository import paper_repo, BODY_FIELDS
+from query_compiler import compile_search
+import similar_papers
+from cold_start import ColdStartSet
+from cards import CARD_SOURCE, card
+import asyncio
 import os
 from user import app as user_app
 from fastapi.responses import JSONResponse
-import json, random
-from user import get_db, auth_user
+import json, random, base64, time, zlib, hmac, hashlib, secrets
+from user import get_db, ensure_schema, user_paper_ids
+from sessions import current_user
+import tasks
 from fastapi.staticfiles import StaticFiles
-import fitz
 
 app = FastAPI()
 
@@ -49,110 +55,194 @@ async def main():
 	
 	
 app.mount("/user", user_app) 
-sh = SciHub()
-es = Elasticsearch("http://paperion-elasticsearch:9200")
-INDEX = "papers"
-
-EXCLUDE_FIELDS = ["paperContent", "paper_content"]
+es = paper_repo.es
+search_cache = paper_repo.cache
+INDEX = paper_repo.index
+
+EXCLUDE_FIELDS = BODY_FIELDS
+
+# Result-list projections. "card" (see cards.py) is what a search result
+# row needs; "full" keeps the old unfiltered hits.
+def _projection(fields: Optional[str]) -> dict:
+	fields = (fields or "card").strip()
+	if fields == "full":
+		return {}
+	if fields == "card":
+		return {"_source": CARD_SOURCE}
+	return {"_source": [f.strip() for f in fields.split(",") if f.strip()]}
+
+def _project_hits(hits: list, fields: Optional[str]) -> list:
+	if (fields or "card").strip() != "card":
+		return hits
+	for h in hits:
+		h["_source"] = card(h.get("_source") or {})
+	return hits
+
+cold_start = ColdStartSet()
+
+@app.on_event("startup")
+def prepare_app_db():
+	ensure_schema()
+
+@app.on_event("startup")
+async def start_cold_start_refresh():
+	app.state.cold_start_task = asyncio.create_task(cold_start.refresh_forever(es, INDEX))
+
+@app.on_event("startup")
+async def start_task_workers():
+	app.state.task_workers = tasks.start_workers()
+
+@app.on_event("shutdown")
+async def close_es():
+	app.state.cold_start_task.cancel()
+	for worker in app.state.task_workers:
+		worker.cancel()
+	await es.close()
+
+ADMIN_TOKEN = os.environ.get("PAPERION_ADMIN_TOKEN")
+
+def _require_admin(admin_token: Optional[str]):
+	if not ADMIN_TOKEN or admin_token != ADMIN_TOKEN:
+		raise HTTPException(status_code=403, detail="Forbidden")
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+	return search_cache.info()
+
+@app.post("/cache/invalidate")
+async def invalidate_cache(admin_token: str = Query(...), endpoint: Optional[str] = None):
+	# Clears this worker's cache now; the other workers sharing
+	# SEARCH_CACHE_SHARED_DIR follow within SEARCH_CACHE_SYNC_SECONDS. The
+	# count is this worker's only.
+	_require_admin(admin_token)
+	try:
+		return {"invalidated": search_cache.invalidate(endpoint)}
+	except ValueError as e:
+		raise HTTPException(status_code=400, detail=str(e))
 
-@app.get("/getPaper")
-def get_paper(title: Optional[str] = None, author: Optional[str] = None, description: Optional[str] = None,
-			  doi: Optional[str] = None):
+def _paper_query(title: Optional[str], author: Optional[str], description: Optional[str], doi: Optional[str]) -> dict:
 	if doi or (title and title.lower().startswith("10.")):
 		doi_query = doi or title
-		q = {"query": {"term": {"DOI": doi_query}}}
-		res = es.search(index=INDEX, body=q, size=50)
-		return res["hits"]["hits"]
-
-	must = []
-	sort = [{"_score": "desc"}]
-
-	if title and "--" in title:
-		parts = [p.strip() for p in title.split("--")]
-
-		if len(parts) > 0 and parts[0]:
-			must.append({"match": {"Title": {"query": parts[0], "operator": "or"}}})
-
-		if len(parts) > 1 and parts[1]:
-			must.append({"match": {"Author": {"query": parts[1], "operator": "or"}}})
-
-		if len(parts) > 2 and parts[2]:
-			year_sort_tokens = parts[2].split()
-			if len(year_sort_tokens) > 1 and year_sort_tokens[-1].lower() in ["asc", "des", "desc"]:
-				sort_dir = year_sort_tokens[-1].lower()
-				if sort_dir == "asc":
-					sort = [{"Year.keyword": "asc"}]
-				elif sort_dir in ["des", "desc"]:
-					sort = [{"Year.keyword": "desc"}]
-				year_part = " ".join(year_sort_tokens[:-1])
-			else:
-				year_part = " ".join(year_sort_tokens)
-
-			import re
-			m = re.match(r'(<=|>=|<|>|=)?\s*(\d{4})$', year_part.strip())
-			if m:
-				op, year_val = m.groups()
-				op = op or "="
-				if op == "=":
-					must.append({"term": {"Year": year_val}})
-				else:
-					must.append({"range": {"Year": {
-						{"<": "lt", "<=": "lte", ">": "gt", ">=": "gte"}[op]: year_val
-					}}})
+		return {"query": {"term": {"DOI": doi_query}}}
+	return compile_search(title, author=author, abstract=description)
+
+# Cursor paging: the first page opens a point-in-time and every later page
+# resumes from the previous page's last sort values, so page N costs the
+# same as page 1. The cursor carries the whole state, including the ES
+# request body, so it is signed: a client cannot edit it into another query.
+# Set CURSOR_SECRET when running several workers, so that a cursor from one
+# is accepted by the others.
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+PIT_KEEP_ALIVE = "2m"
+CURSOR_SECRET = (os.environ.get("CURSOR_SECRET") or secrets.token_hex(32)).encode()
+
+def _cursor_signature(payload: bytes) -> str:
+	digest = hmac.new(CURSOR_SECRET, payload, hashlib.sha256).digest()
+	return base64.urlsafe_b64encode(digest).decode().rstrip("=")
+
+def _encode_cursor(state: dict) -> str:
+	payload = base64.urlsafe_b64encode(json.dumps(state, separators=(",", ":")).encode())
+	return f"{payload.decode()}.{_cursor_signature(payload)}"
+
+def _decode_cursor(cursor: str) -> dict:
+	try:
+		payload, signature = cursor.encode().rsplit(b".", 1)
+		if not hmac.compare_digest(signature.decode(), _cursor_signature(payload)):
+			raise ValueError
+		state = json.loads(base64.urlsafe_b64decode(payload))
+		if not isinstance(state, dict) or not state.get("pit") or not isinstance(state.get("body"), dict):
+			raise ValueError
+		if state.get("fields") is not None and not isinstance(state["fields"], str):
+			raise ValueError
+		state["size"] = max(1, min(int(state.get("size") or PAGE_SIZE), MAX_PAGE_SIZE))
+		return state
+	except Exception:
+		raise HTTPException(status_code=400, detail="Invalid cursor")
 
+async def _get_paper_page(query_body: dict, fields: Optional[str], cursor: Optional[str], page_size: Optional[int]):
+	if cursor:
+		state = _decode_cursor(cursor)
 	else:
-		if title:
-			must.append({"match": {"Title": {"query": title, "operator": "or"}}})
-		if author:
-			must.append({"match": {"Author": {"query": author, "operator": "or"}}})
-
-	if description:
-		must.append({"match": {"Abstract": {"query": description, "operator": "or"}}})
+		query_body["sort"] = query_body.get("sort", [{"_score": "desc"}]) + [{"_shard_doc": "asc"}]
+		pit = await es.open_point_in_time(index=INDEX, keep_alive=PIT_KEEP_ALIVE)
+		state = {
+			"pit": pit["id"],
+			"after": None,
+			"body": query_body,
+			"fields": fields,
+			"size": max(1, min(page_size or PAGE_SIZE, MAX_PAGE_SIZE)),
+		}
 
 	q = {
-		"query": {"bool": {"must": must}},
-		"sort": sort
+		**state["body"],
+		**_projection(state["fields"]),
+		"size": state["size"],
+		"pit": {"id": state["pit"], "keep_alive": PIT_KEEP_ALIVE},
 	}
-	res = es.search(index=INDEX, body=q, size=50)
-	return res["hits"]["hits"]
+	if state["after"] is not None:
+		q["search_after"] = state["after"]
+	try:
+		res = await es.search(body=q)
+	except NotFoundError:
+		raise HTTPException(status_code=410, detail="Cursor expired")
+
+	hits = res["hits"]["hits"]
+	pit_id = res.get("pit_id") or state["pit"]
+	next_cursor = None
+	if len(hits) == state["size"]:
+		next_cursor = _encode_cursor({**state, "pit": pit_id, "after": hits[-1]["sort"]})
+	else:
+		try:
+			await es.close_point_in_time(id=pit_id)
+		except Exception:
+			pass
+	return {"hits": _project_hits(hits, state["fields"]), "next_cursor": next_cursor}
+
+@app.get("/getPaper")
+async def get_paper(title: Optional[str] = None, author: Optional[str] = None, description: Optional[str] = None,
+			  doi: Optional[str] = None, fields: Optional[str] = None,
+			  cursor: Optional[str] = None, page_size: Optional[int] = None):
+	if cursor or page_size:
+		body = None if cursor else _paper_query(title, author, description, doi)
+		return await _get_paper_page(body, fields, cursor, page_size)
+
+	q = {**_paper_query(title, author, description, doi), **_projection(fields)}
+	res = await search_cache.search(es, "getPaper", index=INDEX, body=q, size=50)
+	return _project_hits(res["hits"]["hits"], fields)
+
 
 @app.get("/getPaperById")
-def get_paper_by_id(id: str):
-	query = {
-		"query": {
-			"term": {
-				"ID": str(id)
-			}
-		}
-	}
-	res = es.search(index=INDEX, body=query, size=1)
-	hits = res.get("hits", {}).get("hits", [])
-	if not hits:
+async def get_paper_by_id(id: str):
+	# The paper page and collection lists fall back to paperContent when
+	# there is no abstract, so this one returns the body (uncached).
+	hit = await paper_repo.get_by_id(id, full=True)
+	if not hit:
 		raise HTTPException(status_code=404, detail="Paper not found")
-	return hits[0]
+	return hit
 		
 @app.get("/getRecommendation_sameAuthor")
-def get_same_author(doi: str):
-	doc = es.search(index=INDEX, body={"query": {"term": {"DOI": doi}}})
+async def get_same_author(doi: str):
+	doc = await search_cache.search(es, "sameAuthor", index=INDEX, body={"query": {"term": {"DOI": doi}}, "_source": ["Author"]})
 	if not doc["hits"]["hits"]:
 		return []
 	author = doc["hits"]["hits"][0]["_source"].get("Author", "")
-	q = {"query": {"match": {"Author": author}}}
-	res = es.search(index=INDEX, body=q, _source={"excludes": EXCLUDE_FIELDS}, size=20)
+	q = {"query": {"match": {"Author": author}}, "_source": {"excludes": EXCLUDE_FIELDS}}
+	res = await search_cache.search(es, "sameAuthor", index=INDEX, body=q, size=20)
 	return res["hits"]["hits"]
 
 @app.get("/getRecommendation_sameJournal")
-def get_same_journal(doi: str):
-	doc = es.search(index=INDEX, body={"query": {"term": {"DOI": doi}}})
+async def get_same_journal(doi: str):
+	doc = await search_cache.search(es, "sameJournal", index=INDEX, body={"query": {"term": {"DOI": doi}}, "_source": ["Journal"]})
 	if not doc["hits"]["hits"]:
 		return []
 	journal = doc["hits"]["hits"][0]["_source"].get("Journal", "")
-	q = {"query": {"match": {"Journal": journal}}}
-	res = es.search(index=INDEX, body=q, _source={"excludes": EXCLUDE_FIELDS}, size=20)
+	q = {"query": {"match": {"Journal": journal}}, "_source": {"excludes": EXCLUDE_FIELDS}}
+	res = await search_cache.search(es, "sameJournal", index=INDEX, body=q, size=20)
 	return res["hits"]["hits"]
 
 @app.get("/SearchbyContent")
-def search_by_content(query: str):
+async def search_by_content(query: str, fields: Optional[str] = None):
 	if not query.strip():
 		raise HTTPException(status_code=400, detail="Empty query")
 
@@ -166,20 +256,21 @@ def search_by_content(query: str):
 				"minimum_should_match": "60%"
 			}
 		},
-		"size": 50
+		"size": 50,
+		**_projection(fields)
 	}
 
-	res = es.search(index=INDEX, body=search_query)
+	res = await search_cache.search(es, "SearchbyContent", index=INDEX, body=search_query)
 	if not res.get("hits", {}).get("hits"):
 		# fallback to Title if no results
 		search_query["query"]["more_like_this"]["fields"] = ["Title"]
-		res = es.search(index=INDEX, body=search_query)
+		res = await search_cache.search(es, "SearchbyContent", index=INDEX, body=search_query)
 
-	return res["hits"]["hits"]
+	return _project_hits(res["hits"]["hits"], fields)
 
 
 @app.get("/getPaperContent")
-def get_paper_content(doi: str):
+async def get_paper_content(doi: str):
 	query = {
 		"_source": ["paperContent", "Title"],
 		"query": {
@@ -188,7 +279,7 @@ def get_paper_content(doi: str):
 			}
 		}
 	}
-	res = es.search(index=INDEX, body=query)  # use "papers"
+	res = await es.search(index=INDEX, body=query)  # use "papers"
 	hits = res.get("hits", {}).get("hits", [])
 	if not hits:
 		raise HTTPException(status_code=404, detail="Paper not found")
@@ -196,105 +287,95 @@ def get_paper_content(doi: str):
 
 		
 @app.get("/getRecommendation_similarPaper")
-def get_similar_paper(doi: str):
-	src = get_paper_content(doi)
-	query_content = src.get("paperContent")
-	fields = ["paperContent"]
+async def get_similar_paper(doi: str):
+	cached = await run_in_threadpool(similar_papers.lookup, doi)
+	if cached is not None:
+		return cached
+
+	# Not precomputed yet: run the MLT live, referencing the paper by _id so
+	# its body stays inside ES, and keep the result for next time.
+	doc = await es.search(index=INDEX, body={"query": {"term": {"DOI": doi}}, "_source": ["Title"], "size": 1})
+	hits = doc.get("hits", {}).get("hits", [])
+	if not hits:
+		raise HTTPException(status_code=404, detail="Paper not found")
 
-	# fallback to Title if no paperContent
-	if not query_content:
-		query_content = src.get("Title")
-		fields = ["Title"]
+	res = await es.search(index=INDEX, body=similar_papers.mlt_body(INDEX, doc_id=hits[0]["_id"]))
+	neighbours = res.get("hits", {}).get("hits", [])
+	if not neighbours:
+		# fallback to Title if no paperContent
+		title = hits[0].get("_source", {}).get("Title")
+		if not title:
+			return []
+		res = await es.search(index=INDEX, body=similar_papers.mlt_body(INDEX, title=title))
+		neighbours = res.get("hits", {}).get("hits", [])
 
-	if not query_content:
-		return []
+	result = [similar_papers.neighbour(h) for h in neighbours]
+	await run_in_threadpool(similar_papers.store, doi, result)
+	return result
 
-	# parameters based on field
-	if fields == ["paperContent"]:
-		more_like_this = {
-			"fields": fields,
-			"like": query_content,
-			"min_term_freq": 1,
-			"min_doc_freq": 1,
-			"minimum_should_match": "60%",
-		}
-	else:  # Title fallback
-		more_like_this = {
-			"fields": fields,
-			"like": query_content,
-			"min_term_freq": 1,
-			"min_doc_freq": 1,
-		}
+	
+def _rec_item(src: dict, seed) -> dict:
+	return {
+		"Title": src.get("Title"),
+		"DOI": src.get("DOI"),
+		"Author": src.get("Author"),
+		"Year": src.get("Year"),
+		"ID": src.get("ID"),
+		"Journal": src.get("Journal"),
+		"snippet": src.get("snippet", ""),
+		"_seed": seed
+	}
 
-	query = {"query": {"more_like_this": more_like_this}, "size": 20}
+# Seeds considered per request; keeps the msearch (and latency) bounded no
+# matter how many papers a user has collected.
+MAX_REC_SEEDS = 30
 
-	res = es.search(index=INDEX, body=query)
-	hits = res.get("hits", {}).get("hits", [])
-	return [
-		{
-			"Title": h["_source"].get("Title"),
-			"DOI": h["_source"].get("DOI"),
-			"Author": h["_source"].get("Author"),
-			"Year": h["_source"].get("Year"),
-			"ID": h["_source"].get("ID"),
-			"Journal": h["_source"].get("Journal"),
-			"paperContent": h["_source"].get("paperContent")
-			or h["_source"].get("Title", ""),
-		}
-		for h in hits
-	]
+@app.get("/recommendations/cold_start")
+async def get_cold_start_set():
+	return {"paper_ids": cold_start.paper_ids(), "loaded": len(cold_start.items)}
 
-	
-def _get_paper_content_by_id(pid: str) -> Optional[str]:
-	q = {"query": {"term": {"ID": str(pid)}}}  
-	res = es.search(index=INDEX, body=q, size=1)
-	hits = res.get("hits", {}).get("hits", [])
-	if not hits:
-		return None
-	src = hits[0]["_source"]
-	return src.get("paperContent") or src.get("Title")
+@app.put("/recommendations/cold_start")
+async def update_cold_start_set(paper_ids: list[str], admin_token: str = Query(...)):
+	_require_admin(admin_token)
+	cold_start.save_paper_ids(paper_ids)
+	items = await cold_start.refresh(es, INDEX)
+	return {"paper_ids": cold_start.paper_ids(), "loaded": len(items)}
 
+# The discovery sample is reshuffled for each user every rotation period.
+DISCOVERY_ROTATION_SECONDS = 3600
+
+async def _discovery_sample(user_id, exclude_ids: set, size: int) -> list:
+	seed = zlib.crc32(f"{user_id}:{int(time.time() // DISCOVERY_ROTATION_SECONDS)}".encode())
+	body = {
+		"query": {
+			"function_score": {
+				"query": {"bool": {"must_not": [{"ids": {"values": sorted(exclude_ids)}}]}},
+				"random_score": {"seed": seed, "field": "_seq_no"},
+				"boost_mode": "replace"
+			}
+		},
+		"size": size,
+		**_projection("card")
+	}
+	res = await es.search(index=INDEX, body=body)
+	return [h.get("_source", {}) for h in _project_hits(res.get("hits", {}).get("hits", []), "card")]
 
-@app.get("/recommendations/from_collections")
-def recommend_from_user_collections(token: str = Query(...)):
-	user_id = auth_user(token)
-	if not user_id:
-		raise HTTPException(status_code=401, detail="Unauthorized")
 
+def _collection_paper_ids(user_id) -> list:
 	with get_db() as db:
-		cur = db.execute("SELECT papers_id FROM COLLECTIONS WHERE user_id=?", (user_id,))
-		rows = cur.fetchall()
+		return user_paper_ids(db, user_id)
 
-	seed_ids: list[str] = []
-	for row in rows:
-		try:
-			arr = json.loads(row[0]) if row and row[0] else []
-			if isinstance(arr, list):
-				seed_ids.extend(map(str, arr))
-		except Exception:
-			continue
-	seed_ids = list(dict.fromkeys(seed_ids))
+
+@app.get("/recommendations/from_collections")
+async def recommend_from_user_collections(user_id: int = Depends(current_user)):
+	seed_ids = await run_in_threadpool(_collection_paper_ids, user_id)
 
 	if not seed_ids:
-		paper_ids = [20919906, 37133723, 11447754, 21704052, 77082338, 76330020, 75393442, 79628753, 52198442, 21178154]
-		results = []
-		for pid in paper_ids:
-			q = {"query": {"term": {"ID": str(pid)}}}
-			res = es.search(index=INDEX, body=q, size=1)
-			hits = res.get("hits", {}).get("hits", [])
-			if hits:
-				src = hits[0]["_source"]
-				results.append({
-					"Title": src.get("Title"),
-					"DOI": src.get("DOI"),
-					"Author": src.get("Author"),
-					"Year": src.get("Year"),
-					"ID": src.get("ID"),
-					"Journal": src.get("Journal"),
-					"paperContent": src.get("paperContent", ""),
-					"_seed": None
-				})
-		return results
+		try:
+			items = await cold_start.get(es, INDEX)
+		except Exception:
+			items = []
+		return [_rec_item(src, None) for src in items]
 
 	random.shuffle(seed_ids)
 	results = []
@@ -302,63 +383,58 @@ def recommend_from_user_collections(token: str = Query(...)):
 	seen_rec_ids = set()
 	TARGET = 40
 
-	for pid in seed_ids:
-		content = _get_paper_content_by_id(pid)
-		if not content:
+	# One mget for the seeds (metadata only), then one msearch with a
+	# more_like_this per seed. Seeds are referenced by _id so paper bodies
+	# never travel over the wire; the title is added for seeds without content.
+	seeds = seed_ids[:MAX_REC_SEEDS]
+	found = await es.mget(index=INDEX, ids=seeds, source=["Title"])
+	searches = []
+	live_seeds = []
+	for doc in found.get("docs", []):
+		if not doc.get("found"):
 			continue
-		k = random.randint(2, 6)
-		query = {
+		like = [{"_index": INDEX, "_id": doc["_id"]}]
+		title = (doc.get("_source") or {}).get("Title")
+		if title:
+			like.append(title)
+		searches.append({"index": INDEX})
+		searches.append({
 			"query": {
 				"more_like_this": {
 					"fields": ["paperContent"],
-					"like": content,
+					"like": like,
 					"min_term_freq": 1,
 					"min_doc_freq": 1,
 					"minimum_should_match": "60%"
 				}
 			},
-			"size": k
-		}
-		res = es.search(index=INDEX, body=query)
-		for h in res.get("hits", {}).get("hits", []):
+			"size": random.randint(2, 6),
+			**_projection("card")
+		})
+		live_seeds.append(doc["_id"])
+
+	responses = (await es.msearch(searches=searches)).get("responses", []) if searches else []
+	for pid, res in zip(live_seeds, responses):
+		for h in _project_hits(res.get("hits", {}).get("hits", []), "card"):
 			src = h.get("_source", {})
 			rec_id = str(src.get("ID") or "")
 			if not rec_id or rec_id in seed_set or rec_id in seen_rec_ids:
 				continue
 			seen_rec_ids.add(rec_id)
-			results.append({
-				"Title": src.get("Title"),
-				"DOI": src.get("DOI"),
-				"Author": src.get("Author"),
-				"Year": src.get("Year"),
-				"ID": src.get("ID"),
-				"Journal": src.get("Journal"),
-				"paperContent": src.get("paperContent", ""),
-				"_seed": pid
-			})
+			results.append(_rec_item(src, pid))
 			if len(results) >= TARGET:
 				break
 		if len(results) >= TARGET:
 			break
 
 	if len(results) < TARGET:
-		fallback = es.search(index=INDEX, body={"query": {"match_all": {}}, "size": TARGET * 3})
-		for h in fallback.get("hits", {}).get("hits", []):
-			src = h.get("_source", {})
+		sample = await _discovery_sample(user_id, seed_set | seen_rec_ids, TARGET - len(results))
+		for src in sample:
 			rec_id = str(src.get("ID") or "")
 			if not rec_id or rec_id in seed_set or rec_id in seen_rec_ids:
 				continue
 			seen_rec_ids.add(rec_id)
-			results.append({
-				"Title": src.get("Title"),
-				"DOI": src.get("DOI"),
-				"Author": src.get("Author"),
-				"Year": src.get("Year"),
-				"ID": src.get("ID"),
-				"Journal": src.get("Journal"),
-				"paperContent": src.get("paperContent", ""),
-				"_seed": None
-			})
+			results.append(_rec_item(src, None))
 			if len(results) >= TARGET:
 				break
 
@@ -368,62 +444,19 @@ def recommend_from_user_collections(token: str = Query(...)):
 
 @app.get("/download_paper")
 def download_paper_pdf(doi: str):
-	bban_url = f"https://sci.bban.top/pdf/{doi}.pdf#view=FitH"
-	try:
-		resp = requests.get(bban_url, stream=True, allow_redirects=False, timeout=3)
-		if resp.status_code == 200:
-			return {"doi": doi, "pdf_url": bban_url}
-	except requests.RequestException:
-		pass
-
-	sh = SciHub()
-	try:
-		result = sh.fetch(doi)
-		if "url" in result:
-			return {"doi": doi, "pdf_url": result["url"]}
-		raise HTTPException(status_code=404, detail="PDF URL not found")
-	except Exception:
-		raise HTTPException(status_code=500, detail="Failed to retrieve PDF URL")
+	return paper_repo.pdf_url(doi)
 		
 @app.get("/save_paper")
 def save_paper(doi: str):
-	res = download_paper_pdf(doi)
-	if "pdf_url" not in res:
-		raise HTTPException(status_code=404, detail="PDF URL not found")
-	url = res["pdf_url"]
-
-	download_dir = "downloads"
-	os.makedirs(download_dir, exist_ok=True)
-	filename = f"{doi.replace('/', '_')}.pdf"
-	filepath = os.path.join(download_dir, filename)
-
-	try:
-		pdf_resp = requests.get(url, stream=True, headers={"User-Agent": "Mozilla/5.0"})
-		if pdf_resp.status_code == 200:
-			with open(filepath, "wb") as f:
-				for chunk in pdf_resp.iter_content(chunk_size=8192):
-					if chunk:
-						f.write(chunk)
-			return {"doi": doi, "file_path": filepath}
-	except Exception:
-		pass
-	raise HTTPException(status_code=500, detail="Failed to download and save PDF")
+	return paper_repo.save_pdf(doi)
 
 @app.get("/apa_citation")
-def get_apa_citation(paper_id: str):
-	query = {
-		"query": {
-			"term": {
-				"ID": paper_id
-			}
-		}
-	}
-	res = es.search(index=INDEX, body=query, size=1)
-	hits = res.get("hits", {}).get("hits", [])
-	if not hits:
+async def get_apa_citation(paper_id: str):
+	hit = await paper_repo.get_by_id(paper_id)
+	if not hit:
 		raise HTTPException(status_code=404, detail="Paper not found")
 
-	src = hits[0]["_source"]
+	src = hit["_source"]
 	author = src.get("Author", "").strip()
 	year = src.get("Year", "").strip()
 	title = src.get("Title", "").strip()
@@ -437,38 +470,22 @@ def get_apa_citation(paper_id: str):
 	return {"apa_citation": citation}
 
 @app.get("/get_text_by_paper_id")
-def get_text_by_paper_id(paper_id: str):
-	query = {
-		"_source": ["paperContent", "DOI"],
-		"query": {"term": {"ID.keyword": paper_id}}
-	}
-	res = es.search(index=INDEX, body=query, size=1)
-	hits = res.get("hits", {}).get("hits", [])
-	if not hits:
-		raise HTTPException(status_code=404, detail="Paper not found in index")
-	
-	src = hits[0]["_source"]
-	content = src.get("paperContent")
-	doi = src.get("DOI")
-	
-	if content and content.strip():
-		return {"paper_id": paper_id, "text": content}
-	
-	pdf_info = save_paper(doi)
-	pdf_path = pdf_info.get("file_path")
-	if not os.path.exists(pdf_path):
-		raise HTTPException(status_code=500, detail="Failed to retrieve PDF")
-	
-	try:
-		doc = fitz.open(pdf_path)
-		extracted_text = ""
-		for page in doc:
-			extracted_text += page.get_text()
-		doc.close()
-	except Exception as e:
-		raise HTTPException(status_code=500, detail=f"PDF extraction failed: {str(e)}")
-	
-	return {"paper_id": paper_id, "text": extracted_text}
+async def get_text_by_paper_id(paper_id: str):
+	return await paper_repo.get_text(paper_id)
+
+MAX_PAGES_PER_REQUEST = 50
+
+@app.get("/get_text_pages")
+async def get_text_pages(
+	paper_id: str,
+	start: int = Query(1, ge=1),
+	end: Optional[int] = Query(None, ge=1)
+):
+	# Pages are 1-based, like the reader's highlights; end defaults to start.
+	end = start if end is None else end
+	if end < start or end - start + 1 > MAX_PAGES_PER_REQUEST:
+		raise HTTPException(status_code=400, detail=f"Ask for 1 to {MAX_PAGES_PER_REQUEST} pages, start <= end")
+	return await paper_repo.get_pages(paper_id, start, end)
 		
 if __name__ == "__main__":
 	uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
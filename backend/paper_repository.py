@@ -0,0 +1,272 @@
+"""
+In-process access to papers for main.py and user.py.
+
+Both apps call PaperRepository directly instead of going through HTTP to
+the main app; the public endpoints in main.py are thin wrappers over it.
+"""
+
+import os
+import tempfile
+from typing import Optional
+
+import fitz
+import requests
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+
+import id_map
+import tasks
+import text_cache
+from db import get_db
+from es_client import make_async_es
+from search_cache import SearchCache
+from scihub import SciHub
+
+INDEX = "papers"
+DOWNLOAD_DIR = "downloads"
+# Full text and its page index; kept out of cached metadata lookups.
+BODY_FIELDS = ["paperContent", "paper_content", "pageOffsets"]
+# (connect, read) seconds for fetching a PDF; the read timeout applies
+# between chunks, not to the whole download.
+PDF_DOWNLOAD_TIMEOUT = (10, 60)
+# Store newly extracted text as the paper's paperContent in ES, so search
+# covers it and later reads skip the PDF altogether.
+TEXT_WRITEBACK = os.environ.get("TEXT_WRITEBACK", "1") == "1"
+
+
+def _enqueue_index_text(es_id: str, doi: str):
+	with get_db() as db:
+		tasks.enqueue(db, "index_text", {"es_id": es_id, "doi": doi})
+	tasks.notify()
+
+
+def _extract_pdf_pages(pdf_path: str) -> tuple:
+	"""The PDF's text and the offset in it where each page starts."""
+	with fitz.open(pdf_path) as doc:
+		pages = [page.get_text() for page in doc]
+	offsets = []
+	pos = 0
+	for page in pages:
+		offsets.append(pos)
+		pos += len(page)
+	return "".join(pages), offsets
+
+
+class PaperRepository:
+	def __init__(self, es, cache: SearchCache, index: str = INDEX):
+		self.es = es
+		self.cache = cache
+		self.index = index
+
+	async def get_by_id(self, paper_id: str, full: bool = False) -> Optional[dict]:
+		"""The paper's hit, without its body unless full is set.
+
+		Only the metadata lookup is cached; with full=True (paperContent
+		included) the hit comes from ES every time.
+		"""
+		query = {"query": {"term": {"ID": str(paper_id)}}}
+		if full:
+			query["_source"] = {"excludes": ["pageOffsets"]}
+			res = await self.es.search(index=self.index, body=query, size=1)
+		else:
+			query["_source"] = {"excludes": BODY_FIELDS}
+			res = await self.cache.search(self.es, "getPaperById", index=self.index, body=query, size=1)
+		hits = res.get("hits", {}).get("hits", [])
+		return hits[0] if hits else None
+
+	async def doi_for_id(self, paper_id: str) -> Optional[str]:
+		pid = (paper_id or "").strip()
+		if not pid:
+			return None
+		# If it's already a DOI, return it directly
+		if pid.startswith("10.") and "/" in pid:
+			return pid
+		doi = await run_in_threadpool(id_map.doi_for_id, pid)
+		if doi:
+			return doi
+		query = {"query": {"term": {"ID": pid}}, "_source": ["DOI"]}
+		res = await self.cache.search(self.es, "doiForId", index=self.index, body=query, size=1)
+		hits = res.get("hits", {}).get("hits", [])
+		doi = hits[0].get("_source", {}).get("DOI") if hits else None
+		if not (isinstance(doi, str) and doi.strip()):
+			return None
+		await run_in_threadpool(id_map.store, pid, doi)
+		return doi.strip()
+
+	async def dois_for_ids(self, paper_ids) -> dict:
+		"""Map each paper ID to its DOI with one mget (the ES _id is the
+		paper ID). IDs that are already DOIs map to themselves; IDs that
+		are not indexed or have no DOI map to None."""
+		out = {}
+		lookup = []
+		for pid in dict.fromkeys(str(p).strip() for p in paper_ids if p):
+			if pid.startswith("10.") and "/" in pid:
+				out[pid] = pid
+			else:
+				out[pid] = None
+				lookup.append(pid)
+		if lookup:
+			known = await run_in_threadpool(id_map.dois_for_ids, lookup)
+			out.update(known)
+			lookup = [pid for pid in lookup if pid not in known]
+		if lookup:
+			res = await self.es.mget(index=self.index, ids=lookup, source=["DOI"])
+			found = []
+			for doc in res.get("docs", []):
+				doi = (doc.get("_source") or {}).get("DOI") if doc.get("found") else None
+				if isinstance(doi, str) and doi.strip():
+					out[str(doc["_id"])] = doi.strip()
+					found.append((doc["_id"], doi))
+			if found:
+				await run_in_threadpool(id_map.store_many, found)
+		return out
+
+	async def id_for_doi(self, doi: str) -> str:
+		paper_id = await run_in_threadpool(id_map.id_for_doi, doi)
+		if paper_id:
+			return paper_id
+		query = {"query": {"term": {"DOI": doi}}, "_source": ["ID"]}
+		res = await self.cache.search(self.es, "idForDoi", index=self.index, body=query, size=1)
+		hits = res.get("hits", {}).get("hits", [])
+		paper_id = str(hits[0].get("_source", {}).get("ID") or "") if hits else ""
+		if paper_id:
+			await run_in_threadpool(id_map.store, paper_id, doi)
+		return paper_id
+
+	def pdf_url(self, doi: str) -> dict:
+		bban_url = f"https://sci.bban.top/pdf/{doi}.pdf#view=FitH"
+		try:
+			resp = requests.get(bban_url, stream=True, allow_redirects=False, timeout=3)
+			if resp.status_code == 200:
+				return {"doi": doi, "pdf_url": bban_url}
+		except requests.RequestException:
+			pass
+
+		sh = SciHub()
+		try:
+			result = sh.fetch(doi)
+			if "url" in result:
+				return {"doi": doi, "pdf_url": result["url"]}
+			raise HTTPException(status_code=404, detail="PDF URL not found")
+		except Exception:
+			raise HTTPException(status_code=500, detail="Failed to retrieve PDF URL")
+
+	def pdf_path(self, doi: str) -> str:
+		return os.path.join(DOWNLOAD_DIR, f"{doi.replace('/', '_')}.pdf")
+
+	def save_pdf(self, doi: str) -> dict:
+		res = self.pdf_url(doi)
+		if "pdf_url" not in res:
+			raise HTTPException(status_code=404, detail="PDF URL not found")
+		url = res["pdf_url"]
+
+		os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+		filepath = self.pdf_path(doi)
+		try:
+			pdf_resp = requests.get(
+				url, stream=True, headers={"User-Agent": "Mozilla/5.0"}, timeout=PDF_DOWNLOAD_TIMEOUT
+			)
+			if pdf_resp.status_code == 200:
+				# Write under a unique temporary name so readers of downloads/
+				# never see a partial file, and concurrent downloads of the same
+				# DOI (task workers, request threads) never share one.
+				fd, tmp_path = tempfile.mkstemp(dir=DOWNLOAD_DIR, suffix=".part")
+				try:
+					with os.fdopen(fd, "wb") as f:
+						for chunk in pdf_resp.iter_content(chunk_size=8192):
+							if chunk:
+								f.write(chunk)
+					# mkstemp creates the file 0600; downloads/ is served as static files.
+					os.chmod(tmp_path, 0o644)
+					os.replace(tmp_path, filepath)
+				except BaseException:
+					os.unlink(tmp_path)
+					raise
+				return {"doi": doi, "file_path": filepath}
+		except Exception:
+			pass
+		raise HTTPException(status_code=500, detail="Failed to download and save PDF")
+
+	async def _pdf_text(self, es_id: str, doi: str) -> tuple:
+		"""(text, page_offsets) of the paper's PDF, extracting it at most once."""
+		pdf_path = self.pdf_path(doi)
+		cached = await run_in_threadpool(text_cache.get, doi, pdf_path)
+		if cached is not None:
+			return cached
+
+		# Reuse a PDF downloaded earlier (e.g. by the save_pdf task).
+		if not os.path.exists(pdf_path):
+			pdf_path = (await run_in_threadpool(self.save_pdf, doi)).get("file_path")
+		if not pdf_path or not os.path.exists(pdf_path):
+			raise HTTPException(status_code=500, detail="Failed to retrieve PDF")
+
+		try:
+			text, offsets = await run_in_threadpool(_extract_pdf_pages, pdf_path)
+		except Exception as e:
+			raise HTTPException(status_code=500, detail=f"PDF extraction failed: {str(e)}")
+
+		await run_in_threadpool(text_cache.put, doi, pdf_path, text, offsets)
+		if TEXT_WRITEBACK and text.strip():
+			await run_in_threadpool(_enqueue_index_text, es_id, doi)
+		return text, offsets
+
+	async def _text_and_pages(self, paper_id: str, need_pages: bool) -> tuple:
+		query = {
+			"_source": ["paperContent", "pageOffsets", "DOI"],
+			"query": {"term": {"ID": str(paper_id)}}
+		}
+		res = await self.es.search(index=self.index, body=query, size=1)
+		hits = res.get("hits", {}).get("hits", [])
+		if not hits:
+			raise HTTPException(status_code=404, detail="Paper not found in index")
+
+		src = hits[0]["_source"]
+		content = src.get("paperContent")
+		offsets = src.get("pageOffsets")
+		doi = src.get("DOI")
+
+		# Content indexed before page offsets existed is re-extracted from
+		# the PDF when pages are asked for; the write-back then stores the
+		# two together.
+		if content and content.strip() and (offsets or not need_pages or not doi):
+			return content, offsets
+		if not doi:
+			raise HTTPException(status_code=404, detail="Paper has no content or DOI")
+		return await self._pdf_text(hits[0]["_id"], doi)
+
+	async def get_text(self, paper_id: str) -> dict:
+		text, offsets = await self._text_and_pages(paper_id, need_pages=False)
+		return {"paper_id": paper_id, "text": text, "page_offsets": offsets}
+
+	async def get_pages(self, paper_id: str, start: int, end: int) -> dict:
+		"""Pages start..end (1-based, inclusive) of the paper's text."""
+		text, offsets = await self._text_and_pages(paper_id, need_pages=True)
+		if not offsets:
+			raise HTTPException(status_code=404, detail="Page index not available for this paper")
+		bounds = list(offsets) + [len(text)]
+		last = min(end, len(offsets))
+		return {
+			"paper_id": paper_id,
+			"page_count": len(offsets),
+			"pages": [
+				{"page": n, "text": text[bounds[n - 1]:bounds[n]]}
+				for n in range(start, last + 1)
+			]
+		}
+
+
+@tasks.handler("index_text")
+async def index_text_task(payload: dict):
+	cached = await run_in_threadpool(text_cache.get, payload["doi"])
+	if cached is None:
+		raise tasks.PermanentTaskError(f"No cached text for {payload['doi']}")
+	text, offsets = cached
+	await paper_repo.es.update(
+		index=paper_repo.index,
+		id=payload["es_id"],
+		doc={"paperContent": text, "pageOffsets": offsets}
+	)
+	return {"es_id": payload["es_id"], "chars": len(text), "pages": len(offsets)}
+
+
+paper_repo = PaperRepository(make_async_es(), SearchCache())
@@ -0,0 +1,396 @@
+"""
+Compiler for the /getPaper search box.
+
+Two syntaxes are accepted:
+
+	title -- author -- year [asc|desc]        (the original "--" form)
+	monetary policy author:smith year:>=2000 -journal:"finance" sort:year:desc
+
+The structured form understands field:value terms (quoted values become
+phrases), ranges (year:>2000, year:2000..2010), AND / OR / NOT (or a
+leading "-"), parentheses and sort:field[:asc|desc]. Operators must be
+upper case, so "not" or "or" in ordinary text is searched for like any
+other word. Bare words search the title.
+
+Text is parsed into a small AST and compiled into an ES request body.
+Scored fields (Title, Author, Abstract) go into bool.must; exact
+constraints (Year, Journal, DOI, ID) go into bool.filter so ES can serve
+them from its filter cache. Compiled plans are memoized per input;
+text that does not parse falls back to a plain title search.
+"""
+
+import re
+import json
+from functools import lru_cache
+from typing import NamedTuple, Optional
+
+FIELDS = {
+	"title": "Title", "ti": "Title",
+	"author": "Author", "au": "Author",
+	"abstract": "Abstract", "abs": "Abstract",
+	"journal": "Journal", "jo": "Journal",
+	"year": "Year", "yr": "Year",
+	"doi": "DOI",
+	"id": "ID",
+}
+SCORED_FIELDS = {"Title", "Author", "Abstract"}
+# Title is analyzed text with no keyword subfield, so it cannot be sorted on.
+SORT_FIELDS = {"Year", "ID"}
+NUMERIC_FIELDS = {"Year", "ID"}
+DEFAULT_FIELD = "Title"
+DEFAULT_SORT = [{"_score": "desc"}]
+
+RANGE_RE = re.compile(r"^(<=|>=|<|>|=)?\s*(\S+)$")
+BETWEEN_RE = re.compile(r"^(\S+?)\.\.(\S+)$")
+RANGE_OPS = {"<": "lt", "<=": "lte", ">": "gt", ">=": "gte"}
+NUMBER_RE = re.compile(r"^\d+$")
+
+
+class QuerySyntaxError(ValueError):
+	pass
+
+
+class Term(NamedTuple):
+	field: str
+	value: str
+	phrase: bool = False
+
+
+class Range(NamedTuple):
+	field: str
+	bounds: tuple  # ((op, value), ...)
+
+
+class Sort(NamedTuple):
+	field: str
+	order: str
+
+
+class And(NamedTuple):
+	children: tuple
+	explicit: bool = False  # written with AND, so words are not merged
+
+
+class Or(NamedTuple):
+	children: tuple
+
+
+class Not(NamedTuple):
+	child: object
+
+
+# Lexer -----------------------------------------------------------------
+
+def tokenize(text: str) -> list:
+	tokens = []
+	i, n = 0, len(text)
+	while i < n:
+		c = text[i]
+		if c.isspace():
+			i += 1
+			continue
+		if c in "()":
+			tokens.append((c, None))
+			i += 1
+			continue
+		if c == "-" and i + 1 < n and not text[i + 1].isspace():
+			tokens.append(("NOT", None))
+			i += 1
+			continue
+		if c == '"':
+			value, i = _read_quoted(text, i)
+			tokens.append(("TERM", (None, value, True)))
+			continue
+
+		start = i
+		j = i
+		while j < n and not text[j].isspace() and text[j] not in "()":
+			j += 1
+		word = text[i:j]
+		i = j
+
+		if word in ("AND", "&&"):
+			tokens.append(("AND", None))
+			continue
+		if word in ("OR", "||"):
+			tokens.append(("OR", None))
+			continue
+		if word == "NOT":
+			tokens.append(("NOT", None))
+			continue
+
+		name, sep, value = word.partition(":")
+		key = name.lower()
+		if sep and (key in FIELDS or key == "sort"):
+			if value.startswith('"'):
+				value, i = _read_quoted(text, start + len(name) + 1)
+				tokens.append(("TERM", (key, value, True)))
+				continue
+			tokens.append(("TERM", (key, value, False)))
+			continue
+		tokens.append(("TERM", (None, word, False)))
+	return tokens
+
+
+def _read_quoted(text: str, i: int):
+	end = text.find('"', i + 1)
+	if end == -1:
+		return text[i + 1:], len(text)
+	return text[i + 1:end], end + 1
+
+
+# Parser ----------------------------------------------------------------
+#
+#   expr  := conj (OR conj)*
+#   conj  := unary ([AND] unary)*
+#   unary := NOT unary | '(' expr ')' | TERM
+
+class _Parser:
+	def __init__(self, tokens: list):
+		self.tokens = tokens
+		self.pos = 0
+		self.sort = []
+
+	def peek(self):
+		return self.tokens[self.pos][0] if self.pos < len(self.tokens) else None
+
+	def take(self):
+		tok = self.tokens[self.pos]
+		self.pos += 1
+		return tok
+
+	def parse(self):
+		if self.peek() is None:
+			return And(())
+		node = self.expr()
+		if self.peek() is not None:
+			raise QuerySyntaxError(f"Unexpected '{self.peek()}'")
+		return node
+
+	def expr(self):
+		children = [self.conj()]
+		while self.peek() == "OR":
+			self.take()
+			children.append(self.conj())
+		return children[0] if len(children) == 1 else Or(tuple(children))
+
+	def conj(self):
+		children = [self.unary()]
+		explicit = False
+		while self.peek() not in (None, "OR", ")"):
+			if self.peek() == "AND":
+				self.take()
+				explicit = True
+			children.append(self.unary())
+		children = [c for c in children if c is not None]
+		return children[0] if len(children) == 1 else And(tuple(children), explicit)
+
+	def unary(self):
+		kind = self.peek()
+		if kind is None:
+			raise QuerySyntaxError("Unexpected end of query")
+		if kind == "NOT":
+			self.take()
+			return Not(self.unary())
+		if kind == "(":
+			self.take()
+			node = self.expr()
+			if self.peek() != ")":
+				raise QuerySyntaxError("Missing ')'")
+			self.take()
+			return node
+		if kind == "TERM":
+			return self.term(*self.take()[1])
+		raise QuerySyntaxError(f"Unexpected '{kind}'")
+
+	def term(self, key: Optional[str], value: str, phrase: bool):
+		if key == "sort":
+			self.sort.append(_parse_sort(value))
+			return None
+		field = FIELDS[key] if key else DEFAULT_FIELD
+		if not value:
+			raise QuerySyntaxError(f"Missing value for '{key}'")
+		if field in SCORED_FIELDS or field in ("Journal", "DOI") or phrase:
+			return Term(field, value, phrase)
+		return _parse_range(field, value)
+
+
+def _parse_sort(value: str) -> Sort:
+	order = "asc"
+	if value.startswith("-"):
+		value, order = value[1:], "desc"
+	name, _, direction = value.partition(":")
+	field = FIELDS.get(name.lower())
+	if field not in SORT_FIELDS:
+		raise QuerySyntaxError(f"Cannot sort by '{name}'")
+	if direction:
+		direction = direction.lower()
+		if direction not in ("asc", "des", "desc"):
+			raise QuerySyntaxError(f"Unknown sort order '{direction}'")
+		order = "asc" if direction == "asc" else "desc"
+	return Sort(field, order)
+
+
+def _check_number(field: str, value: str) -> str:
+	if field in NUMERIC_FIELDS and not NUMBER_RE.match(value):
+		raise QuerySyntaxError(f"{field} must be a number, not '{value}'")
+	return value
+
+
+def _parse_range(field: str, value: str):
+	m = BETWEEN_RE.match(value)
+	if m:
+		low, high = (_check_number(field, v) for v in m.groups())
+		return Range(field, (("gte", low), ("lte", high)))
+	m = RANGE_RE.match(value)
+	if not m:
+		raise QuerySyntaxError(f"Invalid value for {field}: '{value}'")
+	op, val = m.groups()
+	_check_number(field, val)
+	if not op or op == "=":
+		return Term(field, val)
+	return Range(field, ((RANGE_OPS[op], val),))
+
+
+def parse(text: str):
+	parser = _Parser(tokenize(text))
+	node = parser.parse()
+	return node, tuple(parser.sort)
+
+
+def parse_legacy(text: str):
+	parts = [p.strip() for p in text.split("--")]
+	children = []
+	sort = ()
+	if len(parts) > 0 and parts[0]:
+		children.append(Term("Title", parts[0]))
+	if len(parts) > 1 and parts[1]:
+		children.append(Term("Author", parts[1]))
+	if len(parts) > 2 and parts[2]:
+		year_tokens = parts[2].split()
+		if len(year_tokens) > 1 and year_tokens[-1].lower() in ("asc", "des", "desc"):
+			sort = (Sort("Year", "asc" if year_tokens[-1].lower() == "asc" else "desc"),)
+			year_tokens = year_tokens[:-1]
+		m = re.match(r"(<=|>=|<|>|=)?\s*(\d{4})$", " ".join(year_tokens).strip())
+		if m:
+			op, year = m.groups()
+			children.append(Term("Year", year) if not op or op == "=" else Range("Year", ((RANGE_OPS[op], year),)))
+	return And(tuple(children)), sort
+
+
+# Compiler --------------------------------------------------------------
+
+def _compile_term(node: Term) -> dict:
+	if node.field in ("Year", "DOI", "ID"):
+		return {"term": {node.field: node.value}}
+	if node.phrase:
+		return {"match_phrase": {node.field: node.value}}
+	operator = "and" if node.field == "Journal" else "or"
+	return {"match": {node.field: {"query": node.value, "operator": operator}}}
+
+
+def _is_scored(node) -> bool:
+	if isinstance(node, Term):
+		return node.field in SCORED_FIELDS
+	if isinstance(node, (And, Or)):
+		return any(_is_scored(c) for c in node.children)
+	return False
+
+
+def _merge_text(children) -> list:
+	# Adjacent bare words ("monetary policy") become a single match.
+	out = []
+	for child in children:
+		prev = out[-1] if out else None
+		if (isinstance(child, Term) and isinstance(prev, Term) and not child.phrase and not prev.phrase
+				and child.field == prev.field and child.field in SCORED_FIELDS):
+			out[-1] = Term(prev.field, prev.value + " " + child.value)
+		else:
+			out.append(child)
+	return out
+
+
+def _compile_bool(node: And) -> dict:
+	must, filters, must_not = [], [], []
+	children = node.children if node.explicit else _merge_text(node.children)
+	for child in children:
+		if isinstance(child, Not):
+			must_not.append(_compile(child.child))
+		elif _is_scored(child):
+			must.append(_compile(child))
+		else:
+			filters.append(_compile(child))
+	clause = {}
+	if must:
+		clause["must"] = must
+	if filters:
+		clause["filter"] = filters
+	if must_not:
+		clause["must_not"] = must_not
+	return {"bool": clause} if clause else {"match_all": {}}
+
+
+def _compile(node) -> dict:
+	if isinstance(node, Term):
+		return _compile_term(node)
+	if isinstance(node, Range):
+		return {"range": {node.field: dict(node.bounds)}}
+	if isinstance(node, Not):
+		return {"bool": {"must_not": [_compile(node.child)]}}
+	if isinstance(node, Or):
+		return {"bool": {"should": [_compile(c) for c in node.children], "minimum_should_match": 1}}
+	return _compile_bool(node)
+
+
+def _compile_sort(sort: tuple) -> list:
+	if not sort:
+		return list(DEFAULT_SORT)
+	out = [{s.field: {"order": s.order, "unmapped_type": "keyword"}} for s in sort]
+	return out + list(DEFAULT_SORT)
+
+
+def compile_ast(node, sort: tuple = ()) -> dict:
+	if not isinstance(node, And):
+		node = And((node,))
+	return {"query": _compile_bool(node), "sort": _compile_sort(sort)}
+
+
+@lru_cache(maxsize=2048)
+def _compile_cached(text: str, author: str, abstract: str) -> str:
+	try:
+		node, sort = parse_legacy(text) if "--" in text else parse(text)
+	except QuerySyntaxError:
+		# Half-typed queries ("(title:x") still search as plain title text.
+		node, sort = And((Term(DEFAULT_FIELD, text),)), ()
+	explicit = isinstance(node, And) and node.explicit
+	children = list(node.children) if isinstance(node, And) else [node]
+	if author:
+		children.append(Term("Author", author))
+	if abstract:
+		children.append(Term("Abstract", abstract))
+	return json.dumps(compile_ast(And(tuple(children), explicit), sort))
+
+
+def compile_search(text: Optional[str], author: Optional[str] = None, abstract: Optional[str] = None) -> dict:
+	"""Compile the search box text (plus the separate author/abstract
+	parameters) into an ES body with "query" and "sort"."""
+	return json.loads(_compile_cached((text or "").strip(), (author or "").strip(), (abstract or "").strip()))
+
+
+if __name__ == "__main__":
+	import sys
+	import timeit
+
+	queries = sys.argv[1:] or [
+		"monetary policy",
+		"inflation targeting -- smith -- >=2005 desc",
+		'author:"john smith" year:2000..2010 -journal:finance sort:year:desc',
+		"(title:inflation OR abstract:deflation) AND NOT doi:10.1000/x journal:economics",
+		"labor markets minimum wages au:card yr:<1995",
+	]
+	rounds = 20000
+	for q in queries:
+		cold = timeit.timeit(lambda: compile_ast(*(parse_legacy(q) if "--" in q else parse(q))), number=rounds)
+		warm = timeit.timeit(lambda: compile_search(q), number=rounds)
+		print(f"{cold / rounds * 1e6:8.1f} us parse+compile  {warm / rounds * 1e6:6.1f} us cached  {q}")
+	print(json.dumps(compile_search(queries[-1]), indent=2))
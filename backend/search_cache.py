@@ -0,0 +1,187 @@
+"""
+In-process cache of Elasticsearch responses, with a TTL per endpoint and
+LRU eviction by entry count and size.
+
+Each API worker process has its own cache. invalidate() also writes a
+new random token to a marker file for the endpoint (or for everything)
+in SEARCH_CACHE_SHARED_DIR; every worker looks at that directory at most
+once per SEARCH_CACHE_SYNC_SECONDS and drops what was invalidated since.
+So an invalidation reaches all the workers that share the directory (all
+workers on one host, by default) within that interval. Workers on other
+hosts need the directory on a shared volume.
+"""
+
+import os
+import re
+import json
+import uuid
+import hashlib
+import time
+from collections import OrderedDict
+
+SEARCH_CACHE_MAX_ENTRIES = int(os.environ.get("SEARCH_CACHE_MAX_ENTRIES", "5000"))
+SEARCH_CACHE_MAX_BYTES = int(os.environ.get("SEARCH_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+SEARCH_CACHE_SHARED_DIR = os.environ.get("SEARCH_CACHE_SHARED_DIR", "search_cache_invalidations")
+SEARCH_CACHE_SYNC_SECONDS = float(os.environ.get("SEARCH_CACHE_SYNC_SECONDS", "1"))
+# Marker file name for "invalidate every endpoint".
+ALL_ENDPOINTS = "_all"
+ENDPOINT_RE = re.compile(r"^[A-Za-z][A-Za-z0-9_]*$")
+
+# Seconds a response stays valid, per endpoint. Metadata lookups change
+# only when the ingestion scripts run, which invalidate explicitly.
+CACHE_TTLS = {
+	"getPaper": 300,
+	"SearchbyContent": 300,
+	"getPaperById": 3600,
+	"sameAuthor": 3600,
+	"sameJournal": 3600,
+	"doiForId": 86400,
+	"idForDoi": 86400,
+}
+DEFAULT_TTL = 300
+
+
+def _normalize(value):
+	if isinstance(value, str):
+		return value.strip()
+	if isinstance(value, dict):
+		return {k: _normalize(v) for k, v in value.items()}
+	if isinstance(value, (list, tuple)):
+		return [_normalize(v) for v in value]
+	return value
+
+
+class SearchCache:
+	def __init__(self, max_entries: int = SEARCH_CACHE_MAX_ENTRIES, max_bytes: int = SEARCH_CACHE_MAX_BYTES,
+				 ttls: dict = None, shared_dir: str = SEARCH_CACHE_SHARED_DIR):
+		self.max_entries = max_entries
+		self.max_bytes = max_bytes
+		self.ttls = dict(CACHE_TTLS if ttls is None else ttls)
+		self.shared_dir = shared_dir
+		self._entries = OrderedDict()  # key -> (expires_at, payload)
+		self._bytes = 0
+		self.stats = {}
+		# Marker tokens as of the last sync; older invalidations predate
+		# anything in this cache.
+		self._markers = self._read_markers()
+		self._synced_at = time.monotonic()
+
+	def _count(self, endpoint: str, name: str):
+		counters = self.stats.setdefault(endpoint, {"hits": 0, "misses": 0, "evictions": 0})
+		counters[name] += 1
+
+	@staticmethod
+	def key(endpoint: str, **request) -> str:
+		raw = json.dumps(_normalize(request), sort_keys=True, separators=(",", ":"), default=str)
+		return endpoint + ":" + hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+	def get(self, endpoint: str, key: str):
+		self._sync()
+		entry = self._entries.get(key)
+		if entry is None:
+			self._count(endpoint, "misses")
+			return None
+		expires_at, payload = entry
+		if expires_at < time.monotonic():
+			self._drop(key)
+			self._count(endpoint, "misses")
+			return None
+		self._entries.move_to_end(key)
+		self._count(endpoint, "hits")
+		# Stored serialized so callers can mutate what they get back.
+		return json.loads(payload)
+
+	def put(self, endpoint: str, key: str, value):
+		payload = json.dumps(value, separators=(",", ":"))
+		if len(payload) > self.max_bytes:
+			return
+		self._drop(key)
+		self._entries[key] = (time.monotonic() + self.ttls.get(endpoint, DEFAULT_TTL), payload)
+		self._bytes += len(payload)
+		while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+			old_key, _ = next(iter(self._entries.items()))
+			self._drop(old_key)
+			self._count(old_key.split(":", 1)[0], "evictions")
+
+	def _drop(self, key: str):
+		entry = self._entries.pop(key, None)
+		if entry is not None:
+			self._bytes -= len(entry[1])
+
+	def invalidate(self, endpoint: str = None) -> int:
+		"""Drops the endpoint's entries (all entries if None) here, and in
+		the other workers at their next sync. Returns how many were
+		dropped in this process."""
+		if endpoint is not None and not ENDPOINT_RE.match(endpoint):
+			raise ValueError(f"Invalid endpoint name: {endpoint!r}")
+		dropped = self._clear(endpoint)
+		self._publish(endpoint or ALL_ENDPOINTS)
+		return dropped
+
+	def _clear(self, endpoint: str = None) -> int:
+		if endpoint is None:
+			dropped = len(self._entries)
+			self._entries.clear()
+			self._bytes = 0
+			return dropped
+		keys = [k for k in self._entries if k.startswith(endpoint + ":")]
+		for k in keys:
+			self._drop(k)
+		return len(keys)
+
+	def _read_markers(self) -> dict:
+		if not self.shared_dir:
+			return {}
+		markers = {}
+		try:
+			with os.scandir(self.shared_dir) as entries:
+				for e in entries:
+					# Skips the .tmp files of a write in progress.
+					if e.is_file() and (e.name == ALL_ENDPOINTS or ENDPOINT_RE.match(e.name)):
+						with open(e.path, encoding="utf-8") as f:
+							markers[e.name] = f.read()
+		except FileNotFoundError:
+			pass
+		return markers
+
+	def _publish(self, name: str):
+		if not self.shared_dir:
+			return
+		os.makedirs(self.shared_dir, exist_ok=True)
+		token = uuid.uuid4().hex
+		path = os.path.join(self.shared_dir, name)
+		tmp = f"{path}.{os.getpid()}.tmp"
+		with open(tmp, "w", encoding="utf-8") as f:
+			f.write(token)
+		os.replace(tmp, path)
+		self._markers[name] = token
+
+	def _sync(self):
+		now = time.monotonic()
+		if now - self._synced_at < SEARCH_CACHE_SYNC_SECONDS:
+			return
+		self._synced_at = now
+		markers = self._read_markers()
+		changed = [name for name, token in markers.items() if self._markers.get(name) != token]
+		self._markers = markers
+		for name in changed:
+			self._clear(None if name == ALL_ENDPOINTS else name)
+
+	def info(self) -> dict:
+		return {
+			"entries": len(self._entries),
+			"bytes": self._bytes,
+			"max_entries": self.max_entries,
+			"max_bytes": self.max_bytes,
+			"endpoints": self.stats,
+		}
+
+	async def search(self, es, endpoint: str, **request):
+		key = self.key(endpoint, **request)
+		cached = self.get(endpoint, key)
+		if cached is not None:
+			return cached
+		res = await es.search(**request)
+		body = getattr(res, "body", res)
+		self.put(endpoint, key, body)
+		return body
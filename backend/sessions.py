@@ -0,0 +1,87 @@
+"""
+Session-token authentication for the user app.
+
+Handlers take the caller's user id as a dependency:
+
+    @app.get("/notes")
+    def read_notes(user_id: int = Depends(current_user)):
+
+current_user reads the "token" query parameter and answers from an
+in-process token -> user_id cache, so the USERS lookup (served by
+idx_users_session_token) only runs on a miss. Login, logout and profile
+changes call forget_user / forget_token. Each worker process has its own
+cache, so a token revoked in one worker stays valid in the others for at
+most SESSION_CACHE_TTL seconds.
+"""
+
+import os
+import threading
+import time
+from typing import Optional
+
+from fastapi import HTTPException, Query
+
+from db import get_db
+
+SESSION_CACHE_TTL = float(os.environ.get("SESSION_CACHE_TTL", "60"))
+SESSION_CACHE_MAX_ENTRIES = int(os.environ.get("SESSION_CACHE_MAX_ENTRIES", "10000"))
+
+
+class SessionCache:
+	def __init__(self, ttl: float = SESSION_CACHE_TTL, max_entries: int = SESSION_CACHE_MAX_ENTRIES):
+		self.ttl = ttl
+		self.max_entries = max_entries
+		self._entries = {}  # token -> (expires_at, user_id)
+		self._lock = threading.Lock()
+
+	def get(self, token: str) -> Optional[int]:
+		entry = self._entries.get(token)
+		if entry is None:
+			return None
+		expires_at, user_id = entry
+		if expires_at < time.monotonic():
+			with self._lock:
+				self._entries.pop(token, None)
+			return None
+		return user_id
+
+	def put(self, token: str, user_id: int):
+		now = time.monotonic()
+		with self._lock:
+			if len(self._entries) >= self.max_entries:
+				self._entries = {t: e for t, e in self._entries.items() if e[0] >= now}
+				if len(self._entries) >= self.max_entries:
+					self._entries.pop(next(iter(self._entries)))
+			self._entries[token] = (now + self.ttl, user_id)
+
+	def forget_token(self, token: str):
+		with self._lock:
+			self._entries.pop(token, None)
+
+	def forget_user(self, user_id: int):
+		with self._lock:
+			self._entries = {t: e for t, e in self._entries.items() if e[1] != user_id}
+
+
+sessions = SessionCache()
+
+
+def auth_user(token: str) -> Optional[int]:
+	if not token:
+		return None
+	user_id = sessions.get(token)
+	if user_id is not None:
+		return user_id
+	with get_db() as db:
+		row = db.execute("SELECT user_id FROM USERS WHERE session_token=?", (token,)).fetchone()
+	if not row:
+		return None
+	sessions.put(token, row[0])
+	return row[0]
+
+
+def current_user(token: str = Query(...)) -> int:
+	user_id = auth_user(token)
+	if not user_id:
+		raise HTTPException(status_code=401, detail="Unauthorized")
+	return user_id
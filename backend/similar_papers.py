@@ -0,0 +1,143 @@
+"""
+Precomputed "similar papers" table.
+
+Neighbours of a paper are computed with more_like_this once and kept in a
+small SQLite file, so /getRecommendation_similarPaper is a primary-key
+lookup. The table is filled in bulk with
+
+	python similar_papers.py build [--k 20] [--batch 100] [--rebuild]
+
+and incrementally by the API, which stores every live result it computes
+for a paper that was not covered yet.
+"""
+
+import os
+import json
+import sqlite3
+import datetime
+import argparse
+import threading
+
+from cards import CARD_SOURCE, card
+
+SIMILAR_DB = os.environ.get("SIMILAR_DB", "similar.db")
+SIMILAR_K = 20
+# Rows older than this are recomputed on the next request.
+SIMILAR_MAX_AGE_DAYS = int(os.environ.get("SIMILAR_MAX_AGE_DAYS", "30"))
+
+_local = threading.local()
+
+
+def _connect() -> sqlite3.Connection:
+	# One connection per thread, reused across requests (as in id_map).
+	db = getattr(_local, "db", None)
+	if db is None or _local.pid != os.getpid():
+		db = sqlite3.connect(SIMILAR_DB, timeout=30)
+		db.execute("PRAGMA journal_mode=WAL")
+		db.execute("PRAGMA synchronous=NORMAL")
+		db.execute('''CREATE TABLE IF NOT EXISTS SIMILAR_PAPERS (
+			doi TEXT PRIMARY KEY,
+			neighbours TEXT,
+			computed_at TEXT
+		)''')
+		db.commit()
+		_local.db = db
+		_local.pid = os.getpid()
+	return db
+
+
+def lookup(doi: str):
+	with _connect() as db:
+		row = db.execute("SELECT neighbours, computed_at FROM SIMILAR_PAPERS WHERE doi=?", (doi,)).fetchone()
+	if not row:
+		return None
+	try:
+		computed_at = datetime.datetime.fromisoformat(row[1])
+		if datetime.datetime.now() - computed_at > datetime.timedelta(days=SIMILAR_MAX_AGE_DAYS):
+			return None
+		return json.loads(row[0])
+	except Exception:
+		return None
+
+
+def store_many(items):
+	now = datetime.datetime.now().isoformat()
+	with _connect() as db:
+		db.executemany(
+			"INSERT OR REPLACE INTO SIMILAR_PAPERS (doi, neighbours, computed_at) VALUES (?, ?, ?)",
+			[(doi, json.dumps(neighbours), now) for doi, neighbours in items]
+		)
+
+
+def store(doi: str, neighbours: list):
+	store_many([(doi, neighbours)])
+
+
+def neighbour(hit: dict) -> dict:
+	return card(hit.get("_source", {}))
+
+
+def mlt_body(index: str, doc_id: str = None, title: str = None, size: int = SIMILAR_K) -> dict:
+	if doc_id is not None:
+		mlt = {
+			"fields": ["paperContent"],
+			"like": [{"_index": index, "_id": doc_id}],
+			"minimum_should_match": "60%",
+		}
+	else:
+		mlt = {"fields": ["Title"], "like": title}
+	return {
+		"query": {"more_like_this": {**mlt, "min_term_freq": 1, "min_doc_freq": 1}},
+		"_source": CARD_SOURCE,
+		"size": size,
+	}
+
+
+def build(es, index: str, k: int, batch: int, rebuild: bool):
+	with _connect() as db:
+		done = set() if rebuild else {r[0] for r in db.execute("SELECT doi FROM SIMILAR_PAPERS")}
+
+	after = None
+	total = 0
+	while True:
+		body = {
+			"query": {"exists": {"field": "paperContent"}},
+			"_source": ["ID", "DOI"],
+			"sort": [{"ID": "asc"}],
+			"size": batch,
+		}
+		if after is not None:
+			body["search_after"] = after
+		hits = es.search(index=index, body=body)["hits"]["hits"]
+		if not hits:
+			break
+		after = hits[-1]["sort"]
+
+		todo = [h for h in hits if h["_source"].get("DOI") and h["_source"]["DOI"] not in done]
+		if todo:
+			searches = []
+			for h in todo:
+				searches.append({"index": index})
+				searches.append(mlt_body(index, doc_id=h["_id"], size=k))
+			responses = es.msearch(searches=searches)["responses"]
+			store_many([
+				(h["_source"]["DOI"], [neighbour(n) for n in res.get("hits", {}).get("hits", [])])
+				for h, res in zip(todo, responses)
+			])
+			total += len(todo)
+			print(f"{total} papers processed")
+	print(f"Done. {total} papers updated in {SIMILAR_DB}")
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Precompute similar papers")
+	parser.add_argument("command", choices=["build"])
+	parser.add_argument("--es", default=os.environ.get("ES_HOST", "http://localhost:9200"))
+	parser.add_argument("--index", default="papers")
+	parser.add_argument("--k", type=int, default=SIMILAR_K)
+	parser.add_argument("--batch", type=int, default=100)
+	parser.add_argument("--rebuild", action="store_true", help="recompute papers already in the table")
+	args = parser.parse_args()
+
+	from elasticsearch import Elasticsearch
+	build(Elasticsearch(args.es, request_timeout=600), args.index, args.k, args.batch, args.rebuild)
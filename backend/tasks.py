@@ -0,0 +1,231 @@
+"""
+Durable background tasks, stored in the TASKS table of app.db.
+
+Handlers enqueue follow-up work inside the transaction that makes the
+change, so the task exists exactly when the change is committed:
+
+	with get_db() as db:
+		db.execute("INSERT ...")
+		task_id = tasks.enqueue(db, "save_pdf", {"paper_id": paper_id}, user_id=user_id)
+	tasks.notify()
+
+and the request returns without waiting for it. notify() wakes the
+workers; call it once the transaction has committed, or they may look
+before the task is visible and sleep until the next poll. TASK_WORKERS
+loops per API process (started from main.py) claim queued tasks and run
+the handler registered for their kind:
+
+	@tasks.handler("save_pdf")
+	async def save_pdf_task(payload): ...
+
+A failing task is retried with exponential backoff up to its
+max_attempts; raise PermanentTaskError to fail it straight away. A
+claimed task that is not finished within TASK_LEASE_SECONDS (say, its
+process died) is picked up again by any worker. The workers' own
+database work runs in the threadpool, never on the event loop.
+
+Finished (done or failed) tasks are kept TASK_RETENTION_DAYS for
+get() to report on; an idle worker deletes older ones at most every
+TASK_PRUNE_SECONDS.
+"""
+
+import os
+import json
+import time
+import asyncio
+import datetime
+import traceback
+
+from fastapi.concurrency import run_in_threadpool
+
+from db import get_db
+
+TASK_WORKERS = int(os.environ.get("TASK_WORKERS", "2"))
+TASK_LEASE_SECONDS = int(os.environ.get("TASK_LEASE_SECONDS", "300"))
+TASK_POLL_SECONDS = float(os.environ.get("TASK_POLL_SECONDS", "1"))
+TASK_RETENTION_DAYS = int(os.environ.get("TASK_RETENTION_DAYS", "7"))
+TASK_PRUNE_SECONDS = float(os.environ.get("TASK_PRUNE_SECONDS", "3600"))
+DEFAULT_MAX_ATTEMPTS = 5
+BACKOFF_BASE_SECONDS = 5
+BACKOFF_MAX_SECONDS = 600
+
+_handlers = {}
+_loop = None
+_wakeup = None
+_next_prune = 0.0
+
+
+class PermanentTaskError(Exception):
+	"""Raised by a handler when retrying cannot help."""
+
+
+def create_table(db):
+	"""Migration step (see user.MIGRATIONS)."""
+	db.execute('''CREATE TABLE IF NOT EXISTS TASKS (
+		task_id INTEGER PRIMARY KEY AUTOINCREMENT,
+		kind TEXT NOT NULL,
+		payload TEXT,
+		user_id INTEGER,
+		status TEXT NOT NULL,
+		attempts INTEGER NOT NULL DEFAULT 0,
+		max_attempts INTEGER NOT NULL,
+		run_after TEXT NOT NULL,
+		locked_until TEXT,
+		result TEXT,
+		error TEXT,
+		created_at TEXT NOT NULL,
+		updated_at TEXT NOT NULL
+	)''')
+	db.execute("CREATE INDEX IF NOT EXISTS idx_tasks_status_run_after ON TASKS(status, run_after)")
+
+
+def handler(kind: str):
+	def register(fn):
+		_handlers[kind] = fn
+		return fn
+	return register
+
+
+def _now() -> datetime.datetime:
+	return datetime.datetime.now()
+
+
+def enqueue(db, kind: str, payload: dict, user_id: int = None, max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> int:
+	now = _now().isoformat()
+	cur = db.execute(
+		"""INSERT INTO TASKS (kind, payload, user_id, status, max_attempts, run_after, created_at, updated_at)
+		VALUES (?, ?, ?, 'queued', ?, ?, ?, ?)""",
+		(kind, json.dumps(payload), user_id, max_attempts, now, now, now)
+	)
+	return cur.lastrowid
+
+
+def notify():
+	"""Wakes the workers; call after committing the enqueue."""
+	if _loop is not None:
+		# May be called from a threadpool thread (sync endpoints).
+		_loop.call_soon_threadsafe(_wakeup.set)
+
+
+def get(task_id: int, user_id: int = None):
+	with get_db() as db:
+		row = db.execute(
+			"""SELECT task_id, kind, status, attempts, max_attempts, run_after, result, error, created_at, updated_at
+			FROM TASKS WHERE task_id=? AND (? IS NULL OR user_id=?)""",
+			(task_id, user_id, user_id)
+		).fetchone()
+	if not row:
+		return None
+	keys = ("task_id", "kind", "status", "attempts", "max_attempts", "run_after", "result", "error", "created_at", "updated_at")
+	task = dict(zip(keys, row))
+	task["result"] = json.loads(task["result"]) if task["result"] else None
+	return task
+
+
+def _claim():
+	now = _now()
+	with get_db() as db:
+		return db.execute(
+			"""UPDATE TASKS SET status='running', attempts=attempts+1, locked_until=?, updated_at=?
+			WHERE task_id = (
+				SELECT task_id FROM TASKS
+				WHERE (status='queued' AND run_after<=?) OR (status='running' AND locked_until<?)
+				ORDER BY task_id LIMIT 1
+			)
+			RETURNING task_id, kind, payload, attempts, max_attempts""",
+			(
+				(now + datetime.timedelta(seconds=TASK_LEASE_SECONDS)).isoformat(),
+				now.isoformat(), now.isoformat(), now.isoformat()
+			)
+		).fetchone()
+
+
+def _finish(task_id: int, result):
+	with get_db() as db:
+		db.execute(
+			"UPDATE TASKS SET status='done', result=?, error=NULL, locked_until=NULL, updated_at=? WHERE task_id=?",
+			(json.dumps(result), _now().isoformat(), task_id)
+		)
+
+
+def _fail(task_id: int, attempts: int, max_attempts: int, error: str, permanent: bool):
+	now = _now()
+	with get_db() as db:
+		if permanent or attempts >= max_attempts:
+			db.execute(
+				"UPDATE TASKS SET status='failed', error=?, locked_until=NULL, updated_at=? WHERE task_id=?",
+				(error, now.isoformat(), task_id)
+			)
+			return
+		delay = min(BACKOFF_BASE_SECONDS * 2 ** (attempts - 1), BACKOFF_MAX_SECONDS)
+		db.execute(
+			"UPDATE TASKS SET status='queued', error=?, run_after=?, locked_until=NULL, updated_at=? WHERE task_id=?",
+			(error, (now + datetime.timedelta(seconds=delay)).isoformat(), now.isoformat(), task_id)
+		)
+
+
+def _prune():
+	cutoff = (_now() - datetime.timedelta(days=TASK_RETENTION_DAYS)).isoformat()
+	with get_db() as db:
+		db.execute("DELETE FROM TASKS WHERE status IN ('done', 'failed') AND updated_at<?", (cutoff,))
+
+
+async def _maybe_prune():
+	global _next_prune
+	# Checked and set without an await in between, so one worker per
+	# interval does it.
+	if time.monotonic() < _next_prune:
+		return
+	_next_prune = time.monotonic() + TASK_PRUNE_SECONDS
+	try:
+		await run_in_threadpool(_prune)
+	except Exception:
+		traceback.print_exc()
+
+
+async def _run(task_id: int, kind: str, payload: str, attempts: int, max_attempts: int):
+	fn = _handlers.get(kind)
+	if fn is None:
+		error = f"No handler for task kind '{kind}'"
+		await run_in_threadpool(_fail, task_id, attempts, max_attempts, error, permanent=True)
+		return
+	args = json.loads(payload) if payload else {}
+	try:
+		if asyncio.iscoroutinefunction(fn):
+			result = await fn(args)
+		else:
+			result = await run_in_threadpool(fn, args)
+	except PermanentTaskError as e:
+		await run_in_threadpool(_fail, task_id, attempts, max_attempts, str(e), permanent=True)
+	except Exception as e:
+		traceback.print_exc()
+		await run_in_threadpool(_fail, task_id, attempts, max_attempts, f"{type(e).__name__}: {e}", permanent=False)
+	else:
+		await run_in_threadpool(_finish, task_id, result)
+
+
+async def _worker():
+	while True:
+		# Cleared before looking, so a notify() that lands while _claim is
+		# running still wakes the wait below.
+		_wakeup.clear()
+		try:
+			task = await run_in_threadpool(_claim)
+		except Exception:
+			traceback.print_exc()
+			task = None
+		if task is None:
+			await _maybe_prune()
+			try:
+				await asyncio.wait_for(_wakeup.wait(), TASK_POLL_SECONDS)
+			except asyncio.TimeoutError:
+				pass
+			continue
+		await _run(*task)
+
+
+def start_workers(count: int = TASK_WORKERS) -> list:
+	global _loop, _wakeup
+	_loop = asyncio.get_running_loop()
+	_wakeup = asyncio.Event()
+	return [asyncio.create_task(_worker()) for _ in range(count)]
@@ -0,0 +1,65 @@
+"""
+Runs the backend against the in-memory FakeNode (fake_es.py).
+
+Everything the app writes (app.db, id_map.db, downloads/, text_cache/, ...)
+goes to a temporary directory, which is also the working directory, since
+several paths in the app are relative to it. This has to happen before the
+app modules are imported, because they read their settings at import time.
+"""
+
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix="paperion-tests-")
+
+PAPERS = [
+	{"ID": "1", "DOI": "10.1000/alpha", "Title": "Monetary policy and inflation", "Author": "Smith, J.",
+	 "Year": "2001", "Journal": "Journal of Money", "Abstract": "We study inflation targeting.",
+	 "paperContent": "Inflation targeting and central bank credibility."},
+	{"ID": "2", "DOI": "10.1000/beta", "Title": "Inflation expectations", "Author": "Smith, J.",
+	 "Year": "2005", "Journal": "Journal of Money", "Abstract": "",
+	 "paperContent": "Survey evidence on inflation expectations of households."},
+	{"ID": "3", "DOI": "10.1000/gamma", "Title": "Labor markets and wages", "Author": "Lee, K.",
+	 "Year": "2010", "Journal": "Labor Review", "Abstract": "Wage rigidity in recessions."},
+	{"ID": "4", "DOI": "10.1000/delta", "Title": "Trade and inflation", "Author": "Park, M.",
+	 "Year": "2015", "Journal": "Trade Quarterly", "Abstract": "Import prices pass through to inflation."},
+]
+
+os.chdir(WORKDIR)
+os.makedirs("downloads", exist_ok=True)
+with open("papers.json", "w", encoding="utf-8") as f:
+	json.dump(PAPERS, f)
+
+os.environ.update({
+	"ES_FAKE_DATA": os.path.join(WORKDIR, "papers.json"),
+	"APP_DB": os.path.join(WORKDIR, "app.db"),
+	"ID_MAP_DB": os.path.join(WORKDIR, "id_map.db"),
+	"SIMILAR_DB": os.path.join(WORKDIR, "similar.db"),
+	"COLD_START_FILE": os.path.join(WORKDIR, "cold_start.json"),
+	"TEXT_CACHE_DIR": os.path.join(WORKDIR, "text_cache"),
+	"FERNET_KEY": "vxXbqX3h2d8Z1cJt7nW0mO5sQyq8Yw8bq2Ahm3v6fXc=",
+	# Queued tasks (PDF downloads) would go to the network; tests run them by hand.
+	"TASK_WORKERS": "0",
+})
+sys.path.insert(0, BACKEND)
+
+
+@pytest.fixture(scope="session")
+def client():
+	from fastapi.testclient import TestClient
+	import main
+
+	with TestClient(main.app) as c:
+		yield c
+
+
+@pytest.fixture(scope="session")
+def token(client):
+	client.post("/user/register", json={"username": "reader", "email": "reader@example.com", "password": "pw"})
+	res = client.post("/user/login", json={"username": "reader", "password": "pw"})
+	return res.json()["token"]
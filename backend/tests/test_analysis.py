@@ -0,0 +1,213 @@
+"""/user/analyze_paper with a stubbed OpenAI client."""
+
+import json
+import datetime
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import analysis
+import user
+from db import get_db
+
+ANSWER = {
+	"summary": {field: f"{field} text" for field in analysis.SUMMARY_FIELDS},
+	"quotes": [{"quote": "Credibility matters.", "why_important": "Core claim."}],
+}
+NOTES = {"notes": {"method": "survey"}, "quotes": []}
+
+
+class StubClient:
+	"""Stands in for OpenAI(); records every prompt it is sent."""
+
+	def __init__(self, fail_parts=(), gate=None):
+		self.responses = self
+		self.prompts = []
+		self.streamed = 0
+		self.fail_parts = set(fail_parts)
+		self.gate = gate
+		self.entered = threading.Event()
+		self._lock = threading.Lock()
+
+	def create(self, model, input, temperature, stream=False):
+		with self._lock:
+			self.prompts.append(input)
+			self.streamed += stream
+		self.entered.set()
+		if self.gate is not None:
+			self.gate.wait(5)
+		if "Below is part" in input:
+			part = int(input.split("Below is part ")[1].split(" ")[0])
+			if part in self.fail_parts:
+				self.fail_parts.discard(part)
+				raise RuntimeError(f"part {part} timed out")
+			output = json.dumps(NOTES)
+		else:
+			output = json.dumps(ANSWER)
+		if stream:
+			return iter(
+				SimpleNamespace(type="response.output_text.delta", delta=output[i:i + 7])
+				for i in range(0, len(output), 7)
+			)
+		return SimpleNamespace(output_text=output)
+
+	def chunk_calls(self):
+		return [p for p in self.prompts if "Below is part" in p]
+
+	def final_calls(self):
+		return [p for p in self.prompts if "Below is part" not in p]
+
+
+@pytest.fixture
+def stub(client, monkeypatch):
+	"""A StubClient behind user.openai_client; paper texts come from .texts."""
+	texts = {}
+
+	async def paper_text(doi):
+		return texts[doi]
+
+	monkeypatch.setattr(analysis, "_paper_text", paper_text)
+	monkeypatch.setattr(analysis, "POLL_INTERVAL", 0.02)
+	holder = SimpleNamespace(client=StubClient(), texts=texts)
+	user.app.dependency_overrides[user.openai_client] = lambda: holder.client
+	yield holder
+	user.app.dependency_overrides.pop(user.openai_client, None)
+
+
+def _analyze(client, doi):
+	return client.post("/user/analyze_paper", params={"pdf": doi.replace("/", "_") + ".pdf"})
+
+
+def test_concurrent_requests_share_one_llm_call(client, stub, monkeypatch):
+	stub.texts["10.1000/flight"] = "Short paper."
+	stub.client = StubClient(gate=threading.Event())
+	claims = []
+	claim = analysis._claim
+	monkeypatch.setattr(analysis, "_claim", lambda doi: claims.append(doi) or claim(doi))
+	responses = []
+	threads = [
+		threading.Thread(target=lambda: responses.append(_analyze(client, "10.1000/flight")))
+		for _ in range(5)
+	]
+	for t in threads:
+		t.start()
+	assert stub.client.entered.wait(5)
+	time.sleep(0.2)
+	stub.client.gate.set()
+	for t in threads:
+		t.join(10)
+
+	assert [r.status_code for r in responses] == [200] * 5
+	assert all(r.json() == ANSWER for r in responses)
+	assert len(stub.client.prompts) == 1
+	# The followers joined the in-process flight instead of polling the claim.
+	assert claims == ["10.1000/flight"]
+	# Served from ANALYSIS_CACHE from now on.
+	assert _analyze(client, "10.1000/flight").json() == ANSWER
+	assert len(stub.client.prompts) == 1
+
+
+def _claim_as_other_worker(doi, claimed_at):
+	with get_db() as db:
+		db.execute(
+			"INSERT INTO ANALYSIS_CACHE (doi, status, claimed_at) VALUES (?, 'pending', ?)",
+			(doi, claimed_at.isoformat())
+		)
+
+
+def test_pending_claim_of_another_worker_is_waited_for(client, stub):
+	doi = "10.1000/claimed"
+	stub.texts[doi] = "Short paper."
+	_claim_as_other_worker(doi, datetime.datetime.now())
+	responses = []
+	waiter = threading.Thread(target=lambda: responses.append(_analyze(client, doi)))
+	waiter.start()
+	time.sleep(0.2)
+	assert not responses
+	analysis._store(doi, ANSWER)  # the other worker finishes
+	waiter.join(5)
+
+	assert responses[0].json() == ANSWER
+	assert stub.client.prompts == []
+
+
+def test_stale_pending_claim_is_taken_over(client, stub):
+	doi = "10.1000/abandoned"
+	stub.texts[doi] = "Short paper."
+	_claim_as_other_worker(doi, datetime.datetime.now() - datetime.timedelta(seconds=analysis.PENDING_TIMEOUT + 60))
+
+	assert _analyze(client, doi).json() == ANSWER
+	assert len(stub.client.prompts) == 1
+
+
+def _long_paper(sections=3, word="word"):
+	# Each section is over half a chunk, so each becomes a chunk of its own.
+	# Chunk results are cached by content, so tests use different words.
+	body = f"{word} " * (analysis.CHUNK_CHARS // (2 * len(word) + 2))
+	return "\n".join(f"{i}. Section {i}\n{body}" for i in range(1, sections + 1))
+
+
+def _chunk_rows(doi):
+	with get_db() as db:
+		return db.execute("SELECT COUNT(*) FROM ANALYSIS_CHUNKS WHERE doi=?", (doi,)).fetchone()[0]
+
+
+def test_failed_chunk_is_retried_and_the_others_reused(client, stub):
+	doi = "10.1000/long"
+	stub.texts[doi] = _long_paper()
+	assert len(analysis.split_text(stub.texts[doi])) == 3
+	stub.client = StubClient(fail_parts={2})
+
+	assert _analyze(client, doi).status_code == 500
+	assert len(stub.client.chunk_calls()) == 3
+	assert stub.client.final_calls() == []
+	assert _chunk_rows(doi) == 2
+
+	first = len(stub.client.prompts)
+	assert _analyze(client, doi).json() == ANSWER
+	retried = stub.client.prompts[first:]
+	assert len(retried) == 2
+	assert "Below is part 2 of 3" in retried[0]
+	# The reduce call merges the notes of all three parts.
+	assert retried[1].count('"method": "survey"') == 3
+	# Which are dropped once the final analysis is cached.
+	assert _chunk_rows(doi) == 0
+
+
+def _events(client, doi):
+	res = client.get("/user/analyze_paper/stream", params={"pdf": doi.replace("/", "_") + ".pdf"})
+	assert res.headers["content-type"].startswith("text/event-stream")
+	events = []
+	for block in res.text.strip().split("\n\n"):
+		lines = dict(line.split(": ", 1) for line in block.split("\n"))
+		events.append((lines["event"], json.loads(lines["data"])))
+	return events
+
+
+def test_stream_announces_fields_live_and_replays_them_from_cache(client, stub):
+	doi = "10.1000/stream"
+	stub.texts[doi] = "Short paper."
+	summaries = [("summary", {"field": f, "value": v}) for f, v in ANSWER["summary"].items()]
+	quote = ("quote", {"index": 0, **ANSWER["quotes"][0]})
+
+	live = _events(client, doi)
+	# Announced from the streamed answer as each field closed, in order.
+	assert live == summaries + [quote, ("done", ANSWER)]
+	assert len(stub.client.prompts) == 1
+	assert stub.client.streamed == 1
+
+	replayed = _events(client, doi)
+	assert replayed == summaries + [quote, ("done", ANSWER)]
+	assert len(stub.client.prompts) == 1
+
+
+def test_stream_reports_failures_as_an_error_event(client, stub):
+	doi = "10.1000/stream-fail"
+	stub.texts[doi] = _long_paper(word="term")
+	stub.client = StubClient(fail_parts={1})
+
+	events = _events(client, doi)
+	assert events[0][0] == "progress"
+	assert events[-1] == ("error", {"status": 500, "detail": "OpenAI API call failed: part 1 timed out"})
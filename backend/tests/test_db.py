@@ -0,0 +1,20 @@
+import pytest
+
+from db import get_db
+
+
+def test_nested_get_db_is_refused(client):
+	with get_db() as db:
+		with pytest.raises(RuntimeError):
+			with get_db():
+				pass
+		# The outer block still owns the connection.
+		assert db.execute("SELECT 1").fetchone() == (1,)
+
+
+def test_connection_is_released_after_an_error(client):
+	with pytest.raises(ValueError):
+		with get_db():
+			raise ValueError
+	with get_db() as db:
+		assert db.execute("SELECT 1").fetchone() == (1,)
@@ -0,0 +1,27 @@
+import asyncio
+
+from elasticsearch import AsyncElasticsearch
+
+from fake_es import FakeNode
+
+
+def _mget(**kwargs):
+	async def run():
+		es = AsyncElasticsearch("http://fake:9200", node_class=FakeNode)
+		try:
+			return await es.mget(index="papers", ids=["1", "3", "missing"], **kwargs)
+		finally:
+			await es.close()
+
+	return asyncio.run(run())["docs"]
+
+
+def test_mget_honours_source(client):
+	docs = _mget(source=["Title", "Year"])
+	assert [d["found"] for d in docs] == [True, True, False]
+	assert docs[0]["_source"] == {"Title": "Monetary policy and inflation", "Year": "2001"}
+	assert docs[1]["_source"] == {"Title": "Labor markets and wages", "Year": "2010"}
+
+	assert all("_source" not in d for d in _mget(source=False))
+	assert "paperContent" not in _mget(source_excludes=["paperContent"])[0]["_source"]
+	assert "paperContent" in _mget()[0]["_source"]
@@ -0,0 +1,111 @@
+"""Golden cases: search box text -> compiled ES body."""
+
+import pytest
+
+from query_compiler import QuerySyntaxError, compile_search, parse
+
+SCORE = {"_score": "desc"}
+
+
+def title(text, operator="or"):
+	return {"match": {"Title": {"query": text, "operator": operator}}}
+
+
+def match(field, text, operator="or"):
+	return {"match": {field: {"query": text, "operator": operator}}}
+
+
+def body(sort=None, **clauses):
+	return {"query": {"bool": clauses}, "sort": (sort or []) + [SCORE]}
+
+
+GOLDEN = [
+	# Bare words, merged into one title match.
+	("monetary policy", body(must=[title("monetary policy")])),
+	("", {"query": {"match_all": {}}, "sort": [SCORE]}),
+
+	# Lower-case operator words are ordinary search terms.
+	("Money is not neutral", body(must=[title("Money is not neutral")])),
+	("why not inflation", body(must=[title("why not inflation")])),
+	("supply and demand or prices", body(must=[title("supply and demand or prices")])),
+
+	# Upper-case operators.
+	("inflation NOT deflation", body(must=[title("inflation")], must_not=[title("deflation")])),
+	("inflation -deflation", body(must=[title("inflation")], must_not=[title("deflation")])),
+	# An explicit AND requires both words; they are not merged into one match.
+	("inflation AND wages", body(must=[title("inflation"), title("wages")])),
+	("inflation wages AND prices", body(must=[title("inflation"), title("wages"), title("prices")])),
+	("inflation && wages", body(must=[title("inflation"), title("wages")])),
+	("inflation OR deflation", body(must=[
+		{"bool": {"should": [title("inflation"), title("deflation")], "minimum_should_match": 1}},
+	])),
+	("(title:inflation OR abstract:deflation) AND NOT doi:10.1000/x journal:economics", body(
+		must=[{"bool": {"should": [title("inflation"), match("Abstract", "deflation")], "minimum_should_match": 1}}],
+		filter=[match("Journal", "economics", "and")],
+		must_not=[{"term": {"DOI": "10.1000/x"}}],
+	)),
+
+	# Quotes.
+	('"central bank"', body(must=[{"match_phrase": {"Title": "central bank"}}])),
+	('author:"john smith"', body(must=[{"match_phrase": {"Author": "john smith"}}])),
+	('-journal:"finance review"', body(must_not=[{"match_phrase": {"Journal": "finance review"}}])),
+
+	# Field prefixes, aliases and filters.
+	("au:card", body(must=[match("Author", "card")])),
+	("abs:wages", body(must=[match("Abstract", "wages")])),
+	("jo:econometrica", body(filter=[match("Journal", "econometrica", "and")])),
+	("doi:10.1000/abc", body(filter=[{"term": {"DOI": "10.1000/abc"}}])),
+	("id:42", body(filter=[{"term": {"ID": "42"}}])),
+	("year:2001", body(filter=[{"term": {"Year": "2001"}}])),
+	("yr:<1995", body(filter=[{"range": {"Year": {"lt": "1995"}}}])),
+	("year:>=2000", body(filter=[{"range": {"Year": {"gte": "2000"}}}])),
+	("year:2000..2010", body(filter=[{"range": {"Year": {"gte": "2000", "lte": "2010"}}}])),
+	("unknown:field", body(must=[title("unknown:field")])),
+
+	# Sorting.
+	("inflation sort:year:desc", body(
+		must=[title("inflation")],
+		sort=[{"Year": {"order": "desc", "unmapped_type": "keyword"}}],
+	)),
+	("inflation sort:-id", body(
+		must=[title("inflation")],
+		sort=[{"ID": {"order": "desc", "unmapped_type": "keyword"}}],
+	)),
+
+	# The original "title -- author -- year [order]" form.
+	("inflation targeting -- smith -- >=2005 desc", body(
+		must=[title("inflation targeting"), match("Author", "smith")],
+		filter=[{"range": {"Year": {"gte": "2005"}}}],
+		sort=[{"Year": {"order": "desc", "unmapped_type": "keyword"}}],
+	)),
+	("-- smith --", body(must=[match("Author", "smith")])),
+
+	# Malformed input falls back to a plain title search of the whole text.
+	("(title:inflation", body(must=[title("(title:inflation")])),
+	("inflation OR", body(must=[title("inflation OR")])),
+	("year:abc", body(must=[title("year:abc")])),
+	("year:19x0..2000", body(must=[title("year:19x0..2000")])),
+	("id:abc", body(must=[title("id:abc")])),
+	("wages sort:title", body(must=[title("wages sort:title")])),
+	("wages sort:year:sideways", body(must=[title("wages sort:year:sideways")])),
+	("author:", body(must=[title("author:")])),
+]
+
+
+@pytest.mark.parametrize("text,expected", GOLDEN, ids=[g[0] or "<empty>" for g in GOLDEN])
+def test_golden(text, expected):
+	assert compile_search(text) == expected
+
+
+def test_author_and_abstract_parameters_are_added():
+	assert compile_search("inflation", author="smith", abstract="wages") == body(
+		must=[title("inflation"), match("Author", "smith"), match("Abstract", "wages")]
+	)
+
+
+@pytest.mark.parametrize("text", [
+	"(a", "a)", "a OR", "NOT", "year:abc", "year:>x", "id:1.5", "sort:title", "sort:journal", "title:",
+])
+def test_parse_rejects(text):
+	with pytest.raises(QuerySyntaxError):
+		parse(text)
@@ -0,0 +1,45 @@
+import pytest
+
+import search_cache
+from search_cache import SearchCache
+
+
+def _fill(cache):
+	cache.put("getPaper", "getPaper:a", {"hits": 1})
+	cache.put("sameAuthor", "sameAuthor:b", {"hits": 2})
+
+
+def test_invalidation_reaches_other_workers(tmp_path, monkeypatch):
+	monkeypatch.setattr(search_cache, "SEARCH_CACHE_SYNC_SECONDS", 0)
+	here, there = SearchCache(shared_dir=str(tmp_path)), SearchCache(shared_dir=str(tmp_path))
+	_fill(here)
+	_fill(there)
+
+	assert here.invalidate("getPaper") == 1
+	assert there.get("getPaper", "getPaper:a") is None
+	assert there.get("sameAuthor", "sameAuthor:b") == {"hits": 2}
+
+	# A second invalidation of the same endpoint is seen too.
+	_fill(there)
+	here.invalidate("getPaper")
+	assert there.get("getPaper", "getPaper:a") is None
+
+	here.invalidate()
+	assert there.get("sameAuthor", "sameAuthor:b") is None
+	# The invalidating worker does not drop what it cached afterwards.
+	_fill(here)
+	assert here.get("getPaper", "getPaper:a") == {"hits": 1}
+
+
+def test_invalidations_before_start_are_ignored(tmp_path, monkeypatch):
+	monkeypatch.setattr(search_cache, "SEARCH_CACHE_SYNC_SECONDS", 0)
+	SearchCache(shared_dir=str(tmp_path)).invalidate()
+	late = SearchCache(shared_dir=str(tmp_path))
+	_fill(late)
+	assert late.get("getPaper", "getPaper:a") == {"hits": 1}
+
+
+def test_endpoint_names_are_checked(tmp_path):
+	# The name becomes a file name in the shared directory.
+	with pytest.raises(ValueError):
+		SearchCache(shared_dir=str(tmp_path)).invalidate("../x")
@@ -0,0 +1,149 @@
+"""End-to-end calls through the FastAPI app against FakeNode."""
+
+import json
+
+
+def test_get_paper_returns_cards(client):
+	res = client.get("/getPaper", params={"title": "inflation"})
+	assert res.status_code == 200
+	hits = res.json()
+	assert {h["_source"]["ID"] for h in hits} == {"1", "2", "4"}
+	for h in hits:
+		assert "paperContent" not in h["_source"]
+		assert "snippet" in h["_source"]
+
+
+def test_get_paper_cursor_pages_through_all_hits(client):
+	seen = []
+	res = client.get("/getPaper", params={"title": "inflation", "page_size": 2}).json()
+	seen += [h["_source"]["ID"] for h in res["hits"]]
+	while res["next_cursor"]:
+		res = client.get("/getPaper", params={"cursor": res["next_cursor"]}).json()
+		seen += [h["_source"]["ID"] for h in res["hits"]]
+	assert sorted(seen) == ["1", "2", "4"]
+
+
+def test_get_paper_by_id_and_missing(client):
+	assert client.get("/getPaperById", params={"id": "3"}).json()["_source"]["DOI"] == "10.1000/gamma"
+	assert client.get("/getPaperById", params={"id": "nope"}).status_code == 404
+
+
+def test_same_author_and_content_search(client):
+	same = client.get("/getRecommendation_sameAuthor", params={"doi": "10.1000/alpha"}).json()
+	assert {h["_source"]["ID"] for h in same} >= {"1", "2"}
+	res = client.get("/SearchbyContent", params={"query": "inflation expectations"})
+	assert res.status_code == 200
+	assert res.json()
+
+
+def test_similar_papers(client):
+	res = client.get("/getRecommendation_similarPaper", params={"doi": "10.1000/alpha"})
+	assert res.status_code == 200
+	# The second call is served from the neighbour table.
+	assert client.get("/getRecommendation_similarPaper", params={"doi": "10.1000/alpha"}).json() == res.json()
+
+
+def test_collections_and_recommendations(client, token):
+	client.post("/user/collections", params={"token": token},
+				json={"title": "macro", "description": "", "papers_id": ["1"]})
+	collection_id = client.get("/user/collections", params={"token": token}).json()[0][0]
+	res = client.put(f"/user/collections/{collection_id}/add_paper", params={"token": token, "paper_id": "2"})
+	assert res.json()["papers_id"] == ["1", "2"]
+	assert res.json()["download"]["status"] == "queued"
+
+	recs = client.get("/recommendations/from_collections", params={"token": token})
+	assert recs.status_code == 200
+	assert not {r["ID"] for r in recs.json()} & {"1", "2"}
+
+
+def test_requests_need_a_session(client):
+	assert client.get("/user/collections", params={"token": "bogus"}).status_code == 401
+
+
+def test_card_snippet_comes_from_the_abstract(client):
+	hits = client.get("/getPaper", params={"title": "inflation expectations"}).json()
+	by_id = {h["_source"]["ID"]: h for h in hits}
+	assert by_id["1"]["_source"]["snippet"] == "We study inflation targeting."
+	# No abstract: the body is not highlighted into a snippet.
+	assert by_id["2"]["_source"]["snippet"] == ""
+	assert all("highlight" not in h for h in hits)
+
+
+def test_tampered_cursor_is_rejected(client):
+	import base64
+	import json
+
+	cursor = client.get("/getPaper", params={"title": "inflation", "page_size": 1}).json()["next_cursor"]
+	payload, signature = cursor.rsplit(".", 1)
+	state = json.loads(base64.urlsafe_b64decode(payload))
+	state["body"] = {"query": {"match_all": {}}}
+	state["fields"] = "full"
+	forged = base64.urlsafe_b64encode(json.dumps(state).encode()).decode()
+	assert client.get("/getPaper", params={"cursor": f"{forged}.{signature}"}).status_code == 400
+	assert client.get("/getPaper", params={"cursor": forged}).status_code == 400
+	assert client.get("/getPaper", params={"cursor": cursor}).status_code == 200
+
+
+def test_highlights_and_notes(client, token):
+	auth = {"token": token}
+	res = client.post("/user/highlight", params=auth,
+					  json={"page": 2, "sentence": "Credibility matters.", "pdf": "downloads/10.1000_alpha.pdf", "note": "key"})
+	assert res.json()["paper_id"] == "1"
+	assert client.get("/user/highlight", params={**auth, "pdf": "10.1000_alpha.pdf"}).json() == [
+		{"page": 2, "sentence": "Credibility matters.", "note": "key"}
+	]
+
+	client.post("/user/notes", params=auth, json={"paper_id": "10.1000/gamma", "citation": "Lee", "description": "read"})
+	notes = client.get("/user/notes", params=auth).json()
+	assert {(n["paper_id"], n["doi"]) for n in notes} >= {("1", "10.1000/alpha"), ("3", "10.1000/gamma")}
+	assert len(client.get("/user/notes", params={**auth, "limit": 1}).json()) == 1
+
+
+def test_editing_a_note_keeps_highlights_in_step(client, token):
+	auth = {"token": token}
+	client.post("/user/notes", params=auth, json={"paper_id": "4", "citation": "Trade", "description": "plain"})
+	note_id = max(n["note_id"] for n in client.get("/user/notes", params=auth).json())
+	highlights = lambda: client.get("/user/highlight", params={**auth, "pdf": "10.1000_delta.pdf"}).json()
+
+	meta = '{"pdf": "10.1000_delta", "page": 3, "note": "pass-through"}'
+	client.put(f"/user/notes/{note_id}", params=auth, json={"paper_id": "4", "citation": "Import prices", "description": meta})
+	assert highlights() == [{"page": 3, "sentence": "Import prices", "note": "pass-through"}]
+
+	client.put(f"/user/notes/{note_id}", params=auth, json={"paper_id": "4", "citation": "Trade", "description": "plain again"})
+	assert highlights() == []
+
+
+def test_bulk_edit_replays_by_idempotency_key(client, token):
+	auth = {"token": token}
+	client.post("/user/collections", params=auth, json={"title": "bulk", "description": "", "papers_id": []})
+	collection_id = max(c[0] for c in client.get("/user/collections", params=auth).json())
+	edit = {"idempotency_key": "k1", "operations": [{"op": "add", "collection_id": collection_id, "paper_ids": ["3", "4"]}]}
+
+	first = client.post("/user/collections/bulk_edit", params=auth, json=edit)
+	assert first.json()["collections"][str(collection_id)] == ["3", "4"]
+	assert client.post("/user/collections/bulk_edit", params=auth, json=edit).json() == first.json()
+
+	edit["operations"][0]["paper_ids"] = ["1"]
+	assert client.post("/user/collections/bulk_edit", params=auth, json=edit).status_code == 422
+	row = [c for c in client.get("/user/collections", params=auth).json() if c[0] == collection_id][0]
+	assert json.loads(row[4]) == ["3", "4"]
+
+
+def test_paper_bodies_stay_out_of_the_search_cache(client):
+	import main
+
+	assert "paperContent" in client.get("/getPaperById", params={"id": "1"}).json()["_source"]
+	assert client.get("/apa_citation", params={"paper_id": "1"}).status_code == 200
+	cached = [payload for _, payload in main.search_cache._entries.values()]
+	assert cached
+	assert not any("paperContent" in str(payload) for payload in cached)
+
+
+def test_card_producers_agree(client):
+	from cards import CARD_FIELDS
+
+	keys = set(CARD_FIELDS) | {"snippet"}
+	cards = [h["_source"] for h in client.get("/getPaper", params={"title": "inflation"}).json()]
+	cards += client.get("/getRecommendation_similarPaper", params={"doi": "10.1000/beta"}).json()
+	assert cards
+	assert all(set(c) == keys for c in cards)
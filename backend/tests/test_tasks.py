@@ -0,0 +1,84 @@
+import asyncio
+import datetime
+
+from fastapi.concurrency import run_in_threadpool
+
+import tasks
+from db import get_db
+
+
+@tasks.handler("test_echo")
+async def _echo(payload):
+	if payload.get("fail"):
+		raise tasks.PermanentTaskError("told to fail")
+	return payload
+
+
+def _enqueue(payload):
+	with get_db() as db:
+		task_id = tasks.enqueue(db, "test_echo", payload)
+	tasks.notify()
+	return task_id
+
+
+async def _run_until_settled(payload):
+	workers = tasks.start_workers(1)
+	try:
+		task_id = await run_in_threadpool(_enqueue, payload)
+		for _ in range(100):
+			task = await run_in_threadpool(tasks.get, task_id)
+			if task["status"] in ("done", "failed"):
+				return task
+			await asyncio.sleep(0.05)
+		return task
+	finally:
+		for worker in workers:
+			worker.cancel()
+
+
+def _isolate(monkeypatch):
+	# A long poll, so only notify() can wake the worker in time; and the
+	# app's loop is put back afterwards.
+	monkeypatch.setattr(tasks, "TASK_POLL_SECONDS", 60)
+	monkeypatch.setattr(tasks, "_loop", tasks._loop)
+	monkeypatch.setattr(tasks, "_wakeup", tasks._wakeup)
+
+
+def test_notified_task_runs_without_waiting_for_the_poll(client, monkeypatch):
+	_isolate(monkeypatch)
+	task = asyncio.run(_run_until_settled({"n": 1}))
+	assert task["status"] == "done"
+	assert task["result"] == {"n": 1}
+
+
+def test_permanent_error_fails_the_task_at_once(client, monkeypatch):
+	_isolate(monkeypatch)
+	task = asyncio.run(_run_until_settled({"fail": True}))
+	assert task["status"] == "failed"
+	assert task["attempts"] == 1
+	assert task["error"] == "told to fail"
+
+
+def test_idle_worker_prunes_old_finished_tasks(client, monkeypatch):
+	_isolate(monkeypatch)
+	monkeypatch.setattr(tasks, "_next_prune", 0.0)
+	old = (datetime.datetime.now() - datetime.timedelta(days=tasks.TASK_RETENTION_DAYS + 1)).isoformat()
+	with get_db() as db:
+		ids = {status: tasks.enqueue(db, "test_echo", {}) for status in ("done", "failed", "queued")}
+		for status, task_id in ids.items():
+			# The queued one is not due, so the worker stays idle.
+			db.execute(
+				"UPDATE TASKS SET status=?, updated_at=?, run_after='9999' WHERE task_id=?",
+				(status, old, task_id)
+			)
+
+	async def idle_once():
+		worker = tasks.start_workers(1)[0]
+		await asyncio.sleep(0.2)
+		worker.cancel()
+
+	asyncio.run(idle_once())
+	assert tasks.get(ids["done"]) is None
+	assert tasks.get(ids["failed"]) is None
+	# Unfinished tasks are kept however old.
+	assert tasks.get(ids["queued"])["status"] == "queued"
@@ -0,0 +1,16 @@
+import text_cache
+
+
+def test_text_round_trips_with_carriage_returns(tmp_path, monkeypatch):
+	monkeypatch.setattr(text_cache, "TEXT_CACHE_DIR", str(tmp_path / "cache"))
+	pdf = tmp_path / "paper.pdf"
+	pdf.write_bytes(b"%PDF-1.4 fake")
+	text = "Page one\r\nline\rend\n" + "Page two\r\n"
+	offsets = [0, 19]
+
+	text_cache.put("10.1000/x", str(pdf), text, offsets)
+
+	assert text_cache.get("10.1000/x", str(pdf)) == (text, offsets)
+	# Without the local PDF the DOI entry is trusted as is.
+	assert text_cache.get("10.1000/x") == (text, offsets)
+	assert text_cache.get("10.1000/other", str(pdf)) == (text, offsets)
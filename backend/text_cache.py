@@ -0,0 +1,115 @@
+"""
+On-disk cache of text extracted from downloaded PDFs.
+
+Texts are stored under the SHA-256 of the PDF they came from, so a given
+file is extracted once, and a small per-DOI entry points at the PDF last
+extracted for that DOI. The pages file holds the offset in the text where
+each page starts:
+
+	TEXT_CACHE_DIR/by_hash/ab/abcd....txt
+	TEXT_CACHE_DIR/by_hash/ab/abcd....pages.json    [0, 2710, ...]
+	TEXT_CACHE_DIR/by_doi/10.1000_xyz.json    {"sha256", "size", "mtime"}
+
+The DOI entry also records the PDF's size and mtime. If the file in
+downloads/ has changed since (a newer copy was fetched), it is hashed
+again and looked up under the new hash. Entries are written to a
+temporary name and renamed into place, so concurrent workers never read a
+partial file. Files are written and read with newline="", so a cached
+text keeps every \r and its length still matches the page offsets.
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+from typing import Optional
+
+TEXT_CACHE_DIR = os.environ.get("TEXT_CACHE_DIR", "text_cache")
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def _doi_entry_path(doi: str) -> str:
+	return os.path.join(TEXT_CACHE_DIR, "by_doi", f"{doi.replace('/', '_')}.json")
+
+
+def _text_path(sha256: str) -> str:
+	return os.path.join(TEXT_CACHE_DIR, "by_hash", sha256[:2], f"{sha256}.txt")
+
+
+def _pages_path(sha256: str) -> str:
+	return os.path.join(TEXT_CACHE_DIR, "by_hash", sha256[:2], f"{sha256}.pages.json")
+
+
+def _write_atomic(path: str, data: str):
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+	try:
+		with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+			f.write(data)
+		os.replace(tmp, path)
+	except BaseException:
+		os.unlink(tmp)
+		raise
+
+
+def _read(path: str) -> Optional[str]:
+	try:
+		with open(path, encoding="utf-8", newline="") as f:
+			return f.read()
+	except FileNotFoundError:
+		return None
+
+
+def pdf_sha256(pdf_path: str) -> str:
+	h = hashlib.sha256()
+	with open(pdf_path, "rb") as f:
+		for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+			h.update(block)
+	return h.hexdigest()
+
+
+def _stat(pdf_path: str) -> tuple:
+	st = os.stat(pdf_path)
+	return st.st_size, st.st_mtime_ns
+
+
+def _store_entry(doi: str, sha256: str, pdf_path: str):
+	size, mtime = _stat(pdf_path)
+	_write_atomic(_doi_entry_path(doi), json.dumps({"sha256": sha256, "size": size, "mtime": mtime}))
+
+
+def _load(sha256: str) -> Optional[tuple]:
+	text = _read(_text_path(sha256))
+	pages = _read(_pages_path(sha256))
+	if text is None or pages is None:
+		return None
+	return text, json.loads(pages)
+
+
+def get(doi: str, pdf_path: str = None) -> Optional[tuple]:
+	"""Cached (text, page_offsets) for doi, or None.
+
+	Pass the local PDF, if there is one, to check the entry against it.
+	"""
+	raw = _read(_doi_entry_path(doi))
+	entry = json.loads(raw) if raw else None
+	pdf_exists = bool(pdf_path) and os.path.exists(pdf_path)
+	if entry and (not pdf_exists or (entry.get("size"), entry.get("mtime")) == _stat(pdf_path)):
+		cached = _load(entry["sha256"])
+		if cached is not None:
+			return cached
+	if not pdf_exists:
+		return None
+	sha256 = pdf_sha256(pdf_path)
+	cached = _load(sha256)
+	if cached is not None:
+		_store_entry(doi, sha256, pdf_path)
+	return cached
+
+
+def put(doi: str, pdf_path: str, text: str, page_offsets: list):
+	sha256 = pdf_sha256(pdf_path)
+	# The pages file goes last; _load only trusts a text that has one.
+	_write_atomic(_text_path(sha256), text)
+	_write_atomic(_pages_path(sha256), json.dumps(page_offsets))
+	_store_entry(doi, sha256, pdf_path)
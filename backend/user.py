@@ -1,24 +1,27 @@
 from fastapi import FastAPI, Depends, HTTPException
 from pydantic import BaseModel
-import sqlite3
 import uuid
 import hashlib
 import datetime
 import json
 from fastapi import Query
-import requests
 import os
 import traceback
 from cryptography.fernet import Fernet
 from pathlib import Path
 from dotenv import set_key, load_dotenv
-from typing import Any, Dict
+from typing import Any, List, Literal, Optional
 from openai import OpenAI
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from paper_repository import paper_repo
+from db import get_db, migrate
+import analysis
+import tasks
+from sessions import sessions, current_user
 
 load_dotenv()
 app = FastAPI()
-DB_NAME = 'app.db'
 
 env_path = Path(".env")
 FERNET_KEY = os.environ.get("FERNET_KEY")
@@ -31,15 +34,6 @@ if not FERNET_KEY:
 
 fernet = Fernet(FERNET_KEY.encode())
 	
-def get_db():
-	return sqlite3.connect(DB_NAME)
-
-def auth_user(token: str):
-	with get_db() as db:
-		cur = db.execute("SELECT user_id FROM USERS WHERE session_token=?", (token,))
-		row = cur.fetchone()
-		return row[0] if row else None
-
 class UserRegistration(BaseModel):
 	username: str
 	email: str
@@ -54,6 +48,15 @@ class CollectionData(BaseModel):
 	description: str
 	papers_id: list
 
+class CollectionEdit(BaseModel):
+	op: Literal["add", "remove", "reorder"]
+	collection_id: int
+	paper_ids: List[str]
+
+class CollectionBulkEdit(BaseModel):
+	operations: List[CollectionEdit]
+	idempotency_key: Optional[str] = None
+
 class NoteData(BaseModel):
 	paper_id: str
 	citation: str
@@ -77,8 +80,137 @@ class FavParamIn(BaseModel):
 	value: str
 
 	
-@app.post("/init_db")
-def init_db():
+def _json_list(raw) -> list:
+	try:
+		value = json.loads(raw) if raw else []
+	except Exception:
+		return []
+	return value if isinstance(value, list) else []
+
+
+def _create_collection_papers(db):
+	# Collection membership used to live in COLLECTIONS.papers_id as a JSON
+	# array. The column is left in place but is no longer read or written.
+	db.execute('''CREATE TABLE IF NOT EXISTS COLLECTION_PAPERS (
+		collection_id INTEGER NOT NULL,
+		paper_id TEXT NOT NULL,
+		added_at TEXT NOT NULL,
+		PRIMARY KEY(collection_id, paper_id),
+		FOREIGN KEY(collection_id) REFERENCES COLLECTIONS(collection_id)
+	)''')
+	db.execute("CREATE INDEX IF NOT EXISTS idx_collection_papers_paper ON COLLECTION_PAPERS(paper_id)")
+	db.execute("CREATE INDEX IF NOT EXISTS idx_collections_user ON COLLECTIONS(user_id)")
+	now = datetime.datetime.now().isoformat()
+	for collection_id, raw in db.execute("SELECT collection_id, papers_id FROM COLLECTIONS").fetchall():
+		db.executemany(
+			"INSERT OR IGNORE INTO COLLECTION_PAPERS (collection_id, paper_id, added_at) VALUES (?, ?, ?)",
+			[(collection_id, str(pid), now) for pid in _json_list(raw)]
+		)
+
+
+def _highlight_meta(description):
+	# Highlights are NOTE rows whose description is {"page", "pdf"[, "note"]}.
+	try:
+		meta = json.loads(description or "{}")
+	except Exception:
+		return None
+	if not isinstance(meta, dict) or not meta.get("pdf"):
+		return None
+	try:
+		page = int(meta.get("page", 1))
+	except (TypeError, ValueError):
+		page = 1
+	return {"pdf": str(meta["pdf"]), "page": page, "note": meta.get("note", "")}
+
+
+def _create_highlights(db):
+	# The NOTE row stays the record of a highlight, since /notes lists and
+	# edits highlights too; HIGHLIGHTS mirrors the fields the reader
+	# queries by so it never has to scan and decode a user's notes.
+	db.execute('''CREATE TABLE IF NOT EXISTS HIGHLIGHTS (
+		note_id INTEGER PRIMARY KEY,
+		user_id INTEGER NOT NULL,
+		pdf_stem TEXT NOT NULL,
+		page INTEGER NOT NULL,
+		sentence TEXT,
+		note TEXT,
+		FOREIGN KEY(note_id) REFERENCES NOTE(note_id)
+	)''')
+	db.execute("CREATE INDEX IF NOT EXISTS idx_highlights_user_pdf_page ON HIGHLIGHTS(user_id, pdf_stem, page)")
+	rows = db.execute("SELECT note_id, user_id, citation, description FROM NOTE").fetchall()
+	for note_id, user_id, citation, description in rows:
+		meta = _highlight_meta(description)
+		if meta:
+			db.execute(
+				"INSERT OR REPLACE INTO HIGHLIGHTS (note_id, user_id, pdf_stem, page, sentence, note) VALUES (?, ?, ?, ?, ?, ?)",
+				(note_id, user_id, meta["pdf"], meta["page"], citation, meta["note"])
+			)
+
+
+def _create_saved_papers(db):
+	# Saved papers used to live in USERS.saved_papers as a JSON array. The
+	# column is left in place but is no longer read or written.
+	db.execute('''CREATE TABLE IF NOT EXISTS SAVED_PAPERS (
+		id INTEGER PRIMARY KEY AUTOINCREMENT,
+		user_id INTEGER NOT NULL,
+		doi TEXT NOT NULL,
+		saved_at TEXT NOT NULL,
+		UNIQUE(user_id, doi),
+		FOREIGN KEY(user_id) REFERENCES USERS(user_id)
+	)''')
+	# Index entries end in the rowid, so this also serves ORDER BY id.
+	db.execute("CREATE INDEX IF NOT EXISTS idx_saved_papers_user ON SAVED_PAPERS(user_id)")
+	now = datetime.datetime.now().isoformat()
+	for user_id, raw in db.execute("SELECT user_id, saved_papers FROM USERS").fetchall():
+		db.executemany(
+			"INSERT OR IGNORE INTO SAVED_PAPERS (user_id, doi, saved_at) VALUES (?, ?, ?)",
+			[(user_id, str(doi), now) for doi in _json_list(raw)]
+		)
+
+
+def _add_collection_positions(db):
+	# Papers are listed by position rather than added_at so they can be
+	# reordered; existing rows keep the order they had.
+	db.execute("ALTER TABLE COLLECTION_PAPERS ADD COLUMN position INTEGER")
+	db.execute('''UPDATE COLLECTION_PAPERS SET position = r.pos
+		FROM (
+			SELECT rowid AS rid, row_number() OVER (
+				PARTITION BY collection_id ORDER BY added_at, rowid
+			) AS pos
+			FROM COLLECTION_PAPERS
+		) AS r
+		WHERE COLLECTION_PAPERS.rowid = r.rid''')
+	db.execute("CREATE INDEX IF NOT EXISTS idx_collection_papers_position ON COLLECTION_PAPERS(collection_id, position)")
+
+
+# Changes on top of the tables created in ensure_schema, applied once each
+# in order (see db.migrate). Only ever append to this list.
+MIGRATIONS = [
+	"CREATE INDEX IF NOT EXISTS idx_users_session_token ON USERS(session_token)",
+	_create_collection_papers,
+	_create_highlights,
+	"ALTER TABLE ANALYSIS_CACHE ADD COLUMN status TEXT",
+	"ALTER TABLE ANALYSIS_CACHE ADD COLUMN claimed_at TEXT",
+	'''CREATE TABLE IF NOT EXISTS ANALYSIS_CHUNKS (
+		chunk_key TEXT PRIMARY KEY,
+		doi TEXT,
+		result TEXT,
+		created_at TEXT
+	)''',
+	_create_saved_papers,
+	tasks.create_table,
+	_add_collection_positions,
+	'''CREATE TABLE IF NOT EXISTS COLLECTION_EDITS (
+		user_id INTEGER NOT NULL,
+		idempotency_key TEXT NOT NULL,
+		response TEXT NOT NULL,
+		created_at TEXT NOT NULL,
+		PRIMARY KEY(user_id, idempotency_key)
+	)''',
+	"ALTER TABLE COLLECTION_EDITS ADD COLUMN request_hash TEXT",
+]
+
+def ensure_schema():
 	with get_db() as db:
 		db.execute('''CREATE TABLE IF NOT EXISTS USERS (
 				user_id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -124,6 +256,12 @@ def init_db():
 			field_4 TEXT,
 			FOREIGN KEY(user_id) REFERENCES USERS(user_id)
 		)''')
+	with get_db() as db:
+		migrate(db, MIGRATIONS)
+
+@app.post("/init_db")
+def init_db():
+	ensure_schema()
 	return {"message": "Database initialized."}
 
 @app.post("/register")
@@ -132,8 +270,8 @@ def register_user(user: UserRegistration):
 	with get_db() as db:
 		try:
 			db.execute(
-				"INSERT INTO USERS (username, email, password, saved_papers) VALUES (?, ?, ?, ?)", 
-				(user.username, encrypted_email, hashlib.sha256(user.password.encode()).hexdigest(), json.dumps([]))
+				"INSERT INTO USERS (username, email, password) VALUES (?, ?, ?)", 
+				(user.username, encrypted_email, hashlib.sha256(user.password.encode()).hexdigest())
 			)
 			return {"message": "User registered successfully"}
 		except:
@@ -149,6 +287,7 @@ def login_user(credentials: LoginCredentials):
 		)
 		row = cur.fetchone()
 		if row:
+			sessions.forget_user(row[0])
 			token = str(uuid.uuid4())
 			db.execute(
 				"UPDATE USERS SET session_token=?, last_logged_in=? WHERE user_id=?", 
@@ -161,191 +300,289 @@ def login_user(credentials: LoginCredentials):
 def logout_user(token: str):
 	with get_db() as db:
 		db.execute("UPDATE USERS SET session_token=NULL WHERE session_token=?", (token,))
-		return {"message": "User logged out"}
+	sessions.forget_token(token)
+	return {"message": "User logged out"}
+
+def _owns_collection(db, collection_id: int, user_id: int) -> bool:
+	row = db.execute(
+		"SELECT 1 FROM COLLECTIONS WHERE collection_id=? AND user_id=?",
+		(collection_id, user_id)
+	).fetchone()
+	return row is not None
+
+
+def _collection_paper_ids(db, collection_id: int) -> list:
+	cur = db.execute(
+		"SELECT paper_id FROM COLLECTION_PAPERS WHERE collection_id=? ORDER BY position",
+		(collection_id,)
+	)
+	return [r[0] for r in cur.fetchall()]
+
+
+def _add_collection_papers(db, collection_id: int, paper_ids) -> int:
+	# New papers go to the end, in the order given.
+	now = datetime.datetime.now().isoformat()
+	cur = db.executemany(
+		"""INSERT OR IGNORE INTO COLLECTION_PAPERS (collection_id, paper_id, added_at, position)
+		SELECT ?, ?, ?, COALESCE(MAX(position), 0) + 1 FROM COLLECTION_PAPERS WHERE collection_id=?""",
+		[(collection_id, str(pid), now, collection_id) for pid in paper_ids]
+	)
+	return cur.rowcount
+
+
+def user_paper_ids(db, user_id: int) -> list:
+	"""Every paper in any of the user's collections, oldest first."""
+	cur = db.execute(
+		"""SELECT p.paper_id FROM COLLECTION_PAPERS p
+		JOIN COLLECTIONS c ON c.collection_id = p.collection_id
+		WHERE c.user_id=?
+		GROUP BY p.paper_id
+		ORDER BY MIN(p.added_at), MIN(p.rowid)""",
+		(user_id,)
+	)
+	return [r[0] for r in cur.fetchall()]
+
 
 @app.post("/collections")
-def create_collection(collection: CollectionData, token: str = Query(...)):
-	user_id = auth_user(token)
-	if not user_id:
-		raise HTTPException(status_code=401, detail="Unauthorized")
+def create_collection(collection: CollectionData, user_id: int = Depends(current_user)):
 	with get_db() as db:
-		db.execute(
-			"INSERT INTO COLLECTIONS (user_id, title, description, papers_id) VALUES (?, ?, ?, ?)",
-			(user_id, collection.title, collection.description, json.dumps(collection.papers_id))
+		cur = db.execute(
+			"INSERT INTO COLLECTIONS (user_id, title, description) VALUES (?, ?, ?)",
+			(user_id, collection.title, collection.description)
 		)
+		_add_collection_papers(db, cur.lastrowid, dict.fromkeys(map(str, collection.papers_id)))
 	return {"message": "Collection created"}
 
 
 @app.get("/collections")
-def read_collections(token: str = Query(...)):
-	user_id = auth_user(token)
-	if not user_id:
-		raise HTTPException(status_code=401, detail="Unauthorized")
+def read_collections(user_id: int = Depends(current_user)):
+	# Rows keep the old COLLECTIONS layout, with papers_id as a JSON array
+	# string in the last column, which is what the frontend parses.
 	with get_db() as db:
-		cur = db.execute("SELECT * FROM COLLECTIONS WHERE user_id=?", (user_id,))
+		cur = db.execute(
+			"""SELECT c.collection_id, c.user_id, c.title, c.description,
+				(SELECT json_group_array(paper_id) FROM (
+					SELECT paper_id FROM COLLECTION_PAPERS p
+					WHERE p.collection_id = c.collection_id
+					ORDER BY p.position
+				))
+			FROM COLLECTIONS c WHERE c.user_id=?""",
+			(user_id,)
+		)
 		return cur.fetchall()
 
 
 
 @app.put("/collections/{collection_id}")
-def update_collection(collection_id: int, collection: CollectionData, token: str = Query(...)):
-	user_id = auth_user(token)
-	if not user_id:
-		raise HTTPException(status_code=401, detail="Unauthorized")
+def update_collection(collection_id: int, collection: CollectionData, user_id: int = Depends(current_user)):
+	paper_ids = list(dict.fromkeys(map(str, collection.papers_id)))
 	with get_db() as db:
-		db.execute(
-			"UPDATE COLLECTIONS SET title=?, description=?, papers_id=? WHERE collection_id=? AND user_id=?",
-			(collection.title, collection.description, json.dumps(collection.papers_id), collection_id, user_id)
+		cur = db.execute(
+			"UPDATE COLLECTIONS SET title=?, description=? WHERE collection_id=? AND user_id=?",
+			(collection.title, collection.description, collection_id, user_id)
 		)
+		if cur.rowcount:
+			# papers_id replaces the membership; papers already present keep
+			# their added_at.
+			db.execute(
+				"DELETE FROM COLLECTION_PAPERS WHERE collection_id=? AND paper_id NOT IN (SELECT value FROM json_each(?))",
+				(collection_id, json.dumps(paper_ids))
+			)
+			_add_collection_papers(db, collection_id, paper_ids)
 	return {"message": "Collection updated"}
 
 
 @app.delete("/collections/{collection_id}")
-def delete_collection(collection_id: int, token: str = Query(...)):
-	user_id = auth_user(token)
-	if not user_id:
-		raise HTTPException(status_code=401, detail="Unauthorized")
+def delete_collection(collection_id: int, user_id: int = Depends(current_user)):
 	with get_db() as db:
-		db.execute(
+		cur = db.execute(
 			"DELETE FROM COLLECTIONS WHERE collection_id=? AND user_id=?",
 			(collection_id, user_id)
 		)
+		if cur.rowcount:
+			db.execute("DELETE FROM COLLECTION_PAPERS WHERE collection_id=?", (collection_id,))
 	return {"message": "Collection deleted"}
 
 
-def _resolve_doi_from_id(paper_id: str):
+async def _resolve_doi_from_id(paper_id: str):
 	try:
-		pid = (paper_id or "").strip()
-		if not pid:
-			return None
-		# If it's already a DOI, return it directly
-		if pid.startswith("10.") and "/" in pid:
-			return pid
-		# Otherwise, treat it as an internal ID and resolve via ES
-		resp = requests.get(
-			"http://backend:8000/getPaperById",
-			params={"id": pid},
-			timeout=10
-		)
-		if resp.status_code != 200:
-			return None
-		data = resp.json() or {}
-		src = data.get("_source") or {}
-		doi = src.get("DOI") or src.get("Doi") or src.get("doi")
-		return doi.strip() if isinstance(doi, str) and doi.strip() else None
+		return await paper_repo.doi_for_id(paper_id)
 	except Exception:
 		return None
 
 		
+@tasks.handler("save_pdf")
+async def save_pdf_task(payload: dict):
+	paper_id = payload["paper_id"]
+	doi = await _resolve_doi_from_id(paper_id)
+	if not doi:
+		raise tasks.PermanentTaskError(f"DOI not found for paper_id {paper_id}")
+	try:
+		return await run_in_threadpool(paper_repo.save_pdf, doi)
+	except HTTPException as e:
+		if e.status_code == 404:
+			raise tasks.PermanentTaskError(e.detail)
+		raise
+
+
 # add at the top with other imports	
+
+
 @app.put("/collections/{collection_id}/add_paper")
 def add_paper_to_collection(
 	collection_id: int,
 	paper_id: str,
-	token: str = Query(...)
+	user_id: int = Depends(current_user)
 ):
-	user_id = auth_user(token)
-	if not user_id:
-		raise HTTPException(status_code=401, detail="Unauthorized")
+	download = None
+	paper_id = str(paper_id)
+	with get_db() as db:
+		if not _owns_collection(db, collection_id, user_id):
+			raise HTTPException(status_code=404, detail="Collection not found")
+		added = _add_collection_papers(db, collection_id, [paper_id]) > 0
+		papers = _collection_paper_ids(db, collection_id)
+		# The PDF is fetched in the background once this commits; poll
+		# GET /tasks/{task_id} for the outcome.
+		if added:
+			task_id = tasks.enqueue(db, "save_pdf", {"paper_id": paper_id}, user_id=user_id)
+			download = {"task_id": task_id, "status": "queued"}
+	if download:
+		tasks.notify()
+
+	return {
+		"message": "Paper added to collection",
+		"papers_id": papers,
+		"download": download
+	}
 
+
+@app.put("/collections/{collection_id}/remove_paper")
+def remove_paper_from_collection(collection_id: int, paper_id: str, user_id: int = Depends(current_user)):
 	with get_db() as db:
-		cur = db.execute(
-			"SELECT papers_id FROM COLLECTIONS WHERE collection_id=? AND user_id=?",
-			(collection_id, user_id)
-		)
-		row = cur.fetchone()
-		if not row:
+		if not _owns_collection(db, collection_id, user_id):
 			raise HTTPException(status_code=404, detail="Collection not found")
+		db.execute(
+			"DELETE FROM COLLECTION_PAPERS WHERE collection_id=? AND paper_id=?",
+			(collection_id, str(paper_id))
+		)
+		papers = _collection_paper_ids(db, collection_id)
+		return {"message": "Paper removed from collection", "papers_id": papers}
 
-		try:
-			papers = json.loads(row[0]) if row[0] else []
-			if not isinstance(papers, list):
-				papers = []
-		except Exception:
-			papers = []
 
-		download = None
-		paper_id = str(paper_id)
+MAX_BULK_PAPERS = 5000
+# Responses are kept this long for replaying a retried idempotency_key.
+IDEMPOTENCY_TTL = datetime.timedelta(days=1)
 
-		if paper_id not in papers:
-			papers.append(paper_id)
-			db.execute(
-				"UPDATE COLLECTIONS SET papers_id=? WHERE collection_id=? AND user_id=?",
-				(json.dumps(papers), collection_id, user_id)
-			)
 
-			doi = _resolve_doi_from_id(paper_id)
-			if doi:
-				try:
-					r = requests.get(
-						"http://backend:8000/save_paper",
-						params={"doi": doi},
-						timeout=30
-					)
-					download = (
-						r.json()
-						if r.status_code == 200
-						else {"error": r.text, "status": r.status_code}
-					)
-				except Exception as e:
-					download = {"error": str(e)}
-			else:
-				download = {
-					"error": "DOI not found for paper_id",
-					"paper_id": paper_id
-				}
-
-		return {
-			"message": "Paper added to collection",
-			"papers_id": papers,
-			"download": download
-		}
+def _reorder_collection(db, collection_id: int, paper_ids: list):
+	# The given papers move to the front in that order; the rest keep
+	# their relative order behind them. Unknown IDs are ignored.
+	current = _collection_paper_ids(db, collection_id)
+	present = set(current)
+	front = [pid for pid in dict.fromkeys(paper_ids) if pid in present]
+	moved = set(front)
+	order = front + [pid for pid in current if pid not in moved]
+	db.executemany(
+		"UPDATE COLLECTION_PAPERS SET position=? WHERE collection_id=? AND paper_id=?",
+		[(i, collection_id, pid) for i, pid in enumerate(order, 1)]
+	)
 
 
-@app.put("/collections/{collection_id}/remove_paper")
-def remove_paper_from_collection(collection_id: int, paper_id: str, token: str = Query(...)):
-	user_id = auth_user(token)
-	if not user_id:
-		raise HTTPException(status_code=401, detail="Unauthorized")
+@app.post("/collections/bulk_edit")
+def bulk_edit_collections(edit: CollectionBulkEdit, user_id: int = Depends(current_user)):
+	"""Apply add/remove/reorder operations, in order, in one transaction.
+
+	Adding a paper that is already there and removing one that is not are
+	no-ops, so a retried request lands on the same membership. Pass an
+	idempotency_key to have a retry return the first response unchanged
+	instead of being applied again; reusing a key with different
+	operations is a 422.
+	"""
+	if sum(len(op.paper_ids) for op in edit.operations) > MAX_BULK_PAPERS:
+		raise HTTPException(status_code=413, detail=f"At most {MAX_BULK_PAPERS} paper ids per request")
+
+	now = datetime.datetime.now()
+	request_hash = hashlib.sha256(
+		json.dumps([op.model_dump() for op in edit.operations], sort_keys=True).encode()
+	).hexdigest()
 	with get_db() as db:
-		cur = db.execute("SELECT papers_id FROM COLLECTIONS WHERE collection_id=? AND user_id=?", (collection_id, user_id))
-		row = cur.fetchone()
-		if not row:
-			raise HTTPException(status_code=404, detail="Collection not found")
-		try:
-			papers = json.loads(row[0]) if row[0] else []
-			if not isinstance(papers, list):
-				papers = []
-		except Exception:
-			papers = []
-		paper_id = str(paper_id)
-		if paper_id in papers:
-			papers.remove(paper_id)
-			db.execute("UPDATE COLLECTIONS SET papers_id=? WHERE collection_id=? AND user_id=?", (json.dumps(papers), collection_id, user_id))
-		return {"message": "Paper removed from collection", "papers_id": papers}
+		# Take the write lock before looking the key up, so two requests
+		# with the same key cannot both miss and both apply.
+		db.execute("BEGIN IMMEDIATE")
+		if edit.idempotency_key:
+			row = db.execute(
+				"SELECT response, request_hash FROM COLLECTION_EDITS WHERE user_id=? AND idempotency_key=? AND created_at>=?",
+				(user_id, edit.idempotency_key, (now - IDEMPOTENCY_TTL).isoformat())
+			).fetchone()
+			if row:
+				if row[1] is not None and row[1] != request_hash:
+					raise HTTPException(status_code=422, detail="idempotency_key was already used for different operations")
+				return json.loads(row[0])
+
+		collection_ids = list(dict.fromkeys(op.collection_id for op in edit.operations))
+		owned = {
+			r[0] for r in db.execute(
+				"SELECT collection_id FROM COLLECTIONS WHERE user_id=? AND collection_id IN (SELECT value FROM json_each(?))",
+				(user_id, json.dumps(collection_ids))
+			).fetchall()
+		}
+		missing = [cid for cid in collection_ids if cid not in owned]
+		if missing:
+			raise HTTPException(status_code=404, detail=f"Collection not found: {missing}")
+
+		added = {}
+		for op in edit.operations:
+			paper_ids = list(dict.fromkeys(map(str, op.paper_ids)))
+			if op.op == "add":
+				before = set(_collection_paper_ids(db, op.collection_id))
+				_add_collection_papers(db, op.collection_id, paper_ids)
+				added.update((pid, None) for pid in paper_ids if pid not in before)
+			elif op.op == "remove":
+				db.execute(
+					"DELETE FROM COLLECTION_PAPERS WHERE collection_id=? AND paper_id IN (SELECT value FROM json_each(?))",
+					(op.collection_id, json.dumps(paper_ids))
+				)
+			else:
+				_reorder_collection(db, op.collection_id, paper_ids)
+
+		collections = {str(cid): _collection_paper_ids(db, cid) for cid in collection_ids}
+		kept = {pid for papers in collections.values() for pid in papers}
+		# Same follow-up as add_paper: fetch the PDFs in the background.
+		downloads = {
+			pid: tasks.enqueue(db, "save_pdf", {"paper_id": pid}, user_id=user_id)
+			for pid in added if pid in kept
+		}
+		response = {
+			"message": "Collections updated",
+			"collections": collections,
+			"downloads": downloads
+		}
+		if edit.idempotency_key:
+			db.execute(
+				"DELETE FROM COLLECTION_EDITS WHERE created_at<?",
+				((now - IDEMPOTENCY_TTL).isoformat(),)
+			)
+			db.execute(
+				"INSERT INTO COLLECTION_EDITS (user_id, idempotency_key, request_hash, response, created_at) VALUES (?, ?, ?, ?, ?)",
+				(user_id, edit.idempotency_key, request_hash, json.dumps(response), now.isoformat())
+			)
+	if downloads:
+		tasks.notify()
+	return response
 
 
-def _resolve_id_from_doi(doi: str):
+async def _resolve_id_from_doi(doi: str):
 	try:
-		r = requests.get("http://backend:8000/getPaper", params={"doi": doi}, timeout=10)
-		if r.ok:
-			hits = r.json() or []
-			if hits:
-				return str(hits[0].get("_source", {}).get("ID") or "")
+		return await paper_repo.id_for_doi(doi)
 	except Exception:
-		pass
-	return ""
+		return ""
 
 @app.post("/highlight")
-def save_highlight(payload: HighlightIn, token: str = Query(...)):
-	user_id = auth_user(token)
-	if not user_id:
-		raise HTTPException(status_code=401, detail="Unauthorized")
-
+async def save_highlight(payload: HighlightIn, user_id: int = Depends(current_user)):
 	stem = os.path.splitext(os.path.basename(payload.pdf))[0]
 	doi = stem.replace("_", "/")
 	
-	paper_id = _resolve_id_from_doi(doi)
+	paper_id = await _resolve_id_from_doi(doi)
 	if not paper_id:
 		raise HTTPException(status_code=400, detail="Could not resolve ID from DOI")
 	
@@ -353,152 +590,149 @@ def save_highlight(payload: HighlightIn, token: str = Query(...)):
 	if payload.note:
 		meta["note"] = payload.note
 
+	await run_in_threadpool(_insert_highlight, user_id, paper_id, payload.sentence, meta)
+	return {"message": "Highlight saved", "paper_id": paper_id}
+
+
+def _insert_highlight(user_id: int, paper_id: str, sentence: str, meta: dict):
 	with get_db() as db:
-		db.execute(
+		cur = db.execute(
 			"INSERT INTO NOTE (user_id, paper_id, citation, description) VALUES (?, ?, ?, ?)",
-			(user_id, paper_id, payload.sentence, json.dumps(meta))
+			(user_id, paper_id, sentence, json.dumps(meta))
+		)
+		db.execute(
+			"INSERT INTO HIGHLIGHTS (note_id, user_id, pdf_stem, page, sentence, note) VALUES (?, ?, ?, ?, ?, ?)",
+			(cur.lastrowid, user_id, meta["pdf"], meta["page"], sentence, meta.get("note", ""))
 		)
-	return {"message": "Highlight saved", "paper_id": paper_id}
 
 
 @app.get("/highlight")
-def list_highlight(pdf: str = Query(...), token: str = Query(...)):
-	user_id = auth_user(token)
-	if not user_id:
-		raise HTTPException(status_code=401, detail="Unauthorized")
-
+def list_highlight(pdf: str = Query(...), user_id: int = Depends(current_user)):
 	target = os.path.splitext(os.path.basename(pdf))[0]  # stem
-	out = []
 	with get_db() as db:
-		cur = db.execute("SELECT citation, description FROM NOTE WHERE user_id=?", (user_id,))
-		for citation, description in cur.fetchall():
-			try:
-				meta = json.loads(description or "{}")
-			except Exception:
-				continue
-			if isinstance(meta, dict) and meta.get("pdf") == target:
-				out.append({
-					"page": int(meta.get("page", 1)),
-					"sentence": citation,
-					"note": meta.get("note", "")
-				})
-
-	return out
+		cur = db.execute(
+			"SELECT page, sentence, note FROM HIGHLIGHTS WHERE user_id=? AND pdf_stem=? ORDER BY page, note_id",
+			(user_id, target)
+		)
+		return [
+			{"page": page, "sentence": sentence, "note": note or ""}
+			for page, sentence, note in cur.fetchall()
+		]
 
 @app.post("/highlight/delete")
-def delete_highlight(payload: HighlightDeleteIn, token: str = Query(...)):
-	user_id = auth_user(token)
-	if not user_id:
-		raise HTTPException(status_code=401, detail="Unauthorized")
-
+def delete_highlight(payload: HighlightDeleteIn, user_id: int = Depends(current_user)):
 	stem = os.path.splitext(os.path.basename(payload.pdf))[0]
 	page = int(payload.page)
 
-	to_delete = []
 	with get_db() as db:
-		cur = db.execute("SELECT note_id, citation, description FROM NOTE WHERE user_id=?", (user_id,))
-		for note_id, citation, description in cur.fetchall():
-			if citation != payload.sentence:
-				continue
-			try:
-				meta = json.loads(description or "{}")
-			except Exception:
-				continue
-			if isinstance(meta, dict) and meta.get("pdf") == stem and int(meta.get("page", 0)) == page:
-				to_delete.append(note_id)
-
-		for nid in to_delete:
-			db.execute("DELETE FROM NOTE WHERE note_id=? AND user_id=?", (nid, user_id))
+		cur = db.execute(
+			"SELECT note_id FROM HIGHLIGHTS WHERE user_id=? AND pdf_stem=? AND page=? AND sentence=?",
+			(user_id, stem, page, payload.sentence)
+		)
+		to_delete = [(r[0], user_id) for r in cur.fetchall()]
+		db.executemany("DELETE FROM HIGHLIGHTS WHERE note_id=? AND user_id=?", to_delete)
+		db.executemany("DELETE FROM NOTE WHERE note_id=? AND user_id=?", to_delete)
 
 	return {"deleted": len(to_delete)}
 	
 @app.post("/notes")
-def create_note(token: str, note: NoteData):
-	user_id = auth_user(token)
-	if not user_id:
-		raise HTTPException(status_code=401, detail="Unauthorized")
+async def create_note(note: NoteData, user_id: int = Depends(current_user)):
+	pid = note.paper_id
+	if pid.startswith("10."):  # it's a DOI
+		resolved_id = await _resolve_id_from_doi(pid)
+		if not resolved_id:
+			raise HTTPException(status_code=400, detail="Could not resolve ID from DOI")
+		pid = resolved_id
+	await run_in_threadpool(_insert_note, user_id, pid, note.citation, note.description)
+	return {"message": "Note created"}
+
+
+def _insert_note(user_id: int, paper_id: str, citation: str, description: str):
 	with get_db() as db:
-		pid = note.paper_id
-		if pid.startswith("10."):  # it's a DOI
-			resolved_id = _resolve_id_from_doi(pid)
-			if not resolved_id:
-				raise HTTPException(status_code=400, detail="Could not resolve ID from DOI")
-			pid = resolved_id
 		db.execute(
 			"INSERT INTO NOTE (user_id, paper_id, citation, description) VALUES (?, ?, ?, ?)", 
-			(user_id, pid, note.citation, note.description)
+			(user_id, paper_id, citation, description)
 		)
-		return {"message": "Note created"}
 
-@app.get("/notes")
-def read_notes(token: str):
-	user_id = auth_user(token)
-	if not user_id:
-		raise HTTPException(status_code=401, detail="Unauthorized")
+MAX_NOTES_PAGE = 500
+
+def _fetch_all(sql: str, params) -> list:
 	with get_db() as db:
-		cur = db.execute(
-			"SELECT note_id, user_id, paper_id, citation, description FROM NOTE WHERE user_id=?",
-			(user_id,)
-		)
-		notes = []
-		for row in cur.fetchall():
-			paper_id = row[2]
-			doi = _resolve_doi_from_id(paper_id)
-			notes.append({
-				"note_id": row[0],
-				"user_id": row[1],
-				"paper_id": paper_id,
-				"doi": doi,
-				"citation": row[3],
-				"description": row[4]
-			})
-		return notes
+		return db.execute(sql, params).fetchall()
+
+
+@app.get("/notes")
+async def read_notes(
+	limit: Optional[int] = Query(None, ge=1, le=MAX_NOTES_PAGE),
+	after: Optional[int] = None,
+	user_id: int = Depends(current_user)
+):
+	# Without limit the whole list is returned, as before. With limit, pass
+	# the last note_id seen as `after` to get the next page.
+	sql = "SELECT note_id, user_id, paper_id, citation, description FROM NOTE WHERE user_id=?"
+	params = [user_id]
+	if after is not None:
+		sql += " AND note_id>?"
+		params.append(after)
+	sql += " ORDER BY note_id"
+	if limit is not None:
+		sql += " LIMIT ?"
+		params.append(limit)
+	rows = await run_in_threadpool(_fetch_all, sql, params)
+
+	try:
+		dois = await paper_repo.dois_for_ids(row[2] for row in rows)
+	except Exception:
+		dois = {}
+	return [
+		{
+			"note_id": row[0],
+			"user_id": row[1],
+			"paper_id": row[2],
+			"doi": dois.get(str(row[2]).strip()) if row[2] else None,
+			"citation": row[3],
+			"description": row[4]
+		}
+		for row in rows
+	]
 
 
 @app.get("/collections/papers")
-def get_user_collection_papers(token: str):
-	user_id = auth_user(token)
-	if not user_id:
-		raise HTTPException(status_code=401, detail="Unauthorized")
+def get_user_collection_papers(user_id: int = Depends(current_user)):
 	with get_db() as db:
-		cur = db.execute("SELECT papers_id FROM COLLECTIONS WHERE user_id=?", (user_id,))
-		all_papers = set()
-		for row in cur.fetchall():
-			try:
-				papers_list = json.loads(row[0]) if row[0] else []
-				for paper_id in papers_list:
-					all_papers.add(paper_id)
-			except Exception:
-				continue
-		return list(all_papers)
+		return user_paper_ids(db, user_id)
 
 
 @app.put("/notes/{note_id}")
-def update_note(token: str, note_id: int, note: NoteData):
-	user_id = auth_user(token)
-	if not user_id:
-		raise HTTPException(status_code=401, detail="Unauthorized")
+def update_note(note_id: int, note: NoteData, user_id: int = Depends(current_user)):
 	with get_db() as db:
-		db.execute("UPDATE NOTE SET citation=?, description=? WHERE note_id=? AND user_id=?", 
+		cur = db.execute("UPDATE NOTE SET citation=?, description=? WHERE note_id=? AND user_id=?", 
 				   (note.citation, note.description, note_id, user_id))
+		if cur.rowcount == 0:
+			# Not the caller's note; leave any HIGHLIGHTS row alone too.
+			return {"message": "Note updated"}
+		# HIGHLIGHTS follows the new description: a note edited into a
+		# highlight gains a row, and one that no longer is loses it.
+		meta = _highlight_meta(note.description)
+		if meta:
+			db.execute(
+				"INSERT OR REPLACE INTO HIGHLIGHTS (note_id, user_id, pdf_stem, page, sentence, note) VALUES (?, ?, ?, ?, ?, ?)",
+				(note_id, user_id, meta["pdf"], meta["page"], note.citation, meta["note"])
+			)
+		else:
+			db.execute("DELETE FROM HIGHLIGHTS WHERE note_id=? AND user_id=?", (note_id, user_id))
 		return {"message": "Note updated"}
 
 @app.delete("/notes/{note_id}")
-def delete_note(token: str, note_id: int):
-	user_id = auth_user(token)
-	if not user_id:
-		raise HTTPException(status_code=401, detail="Unauthorized")
+def delete_note(note_id: int, user_id: int = Depends(current_user)):
 	with get_db() as db:
+		db.execute("DELETE FROM HIGHLIGHTS WHERE note_id=? AND user_id=?", (note_id, user_id))
 		db.execute("DELETE FROM NOTE WHERE note_id=? AND user_id=?", 
 				   (note_id, user_id))
 		return {"message": "Note deleted"}
 
 @app.put("/profile")
-def update_user_profile(token: str, username: str = None, email: str = None, password: str = None):
-	user_id = auth_user(token)
-	if not user_id:
-		raise HTTPException(status_code=401, detail="Unauthorized")
-
+def update_user_profile(username: str = None, email: str = None, password: str = None, user_id: int = Depends(current_user)):
 	with get_db() as db:
 		if username:
 			db.execute("UPDATE USERS SET username=? WHERE user_id=?", (username, user_id))
@@ -507,18 +741,15 @@ def update_user_profile(token: str, username: str = None, email: str = None, pas
 			db.execute("UPDATE USERS SET email=? WHERE user_id=?", (encrypted_email, user_id))
 		if password:
 			db.execute("UPDATE USERS SET password=? WHERE user_id=?", (hashlib.sha256(password.encode()).hexdigest(), user_id))
+	sessions.forget_user(user_id)
 
 	return {"message": "Profile updated"}
 
 
 
 @app.get("/profile")
-def get_user_profile(token: str):
+def get_user_profile(user_id: int = Depends(current_user)):
 	try:
-		user_id = auth_user(token)
-		if not user_id:
-			raise HTTPException(status_code=401, detail="Unauthorized")
-
 		with get_db() as db:
 			cur = db.execute(
 				"SELECT username, email, last_logged_in FROM USERS WHERE user_id=?",
@@ -550,19 +781,19 @@ def get_user_profile(token: str):
 
 
 @app.delete("/reset_profile")
-def reset_user_profile(token: str):
-	user_id = auth_user(token)
-	if not user_id:
-		raise HTTPException(status_code=401, detail="Unauthorized")
+def reset_user_profile(user_id: int = Depends(current_user)):
 	try:
 		with get_db() as db:
-			db.execute("DELETE FROM COLLECTIONS WHERE user_id=?", (user_id,))
-			db.execute("DELETE FROM NOTE WHERE user_id=?", (user_id,))
 			db.execute(
-				"UPDATE USERS SET saved_papers=? WHERE user_id=?",
-				(json.dumps([]), user_id)
+				"DELETE FROM COLLECTION_PAPERS WHERE collection_id IN (SELECT collection_id FROM COLLECTIONS WHERE user_id=?)",
+				(user_id,)
 			)
+			db.execute("DELETE FROM COLLECTIONS WHERE user_id=?", (user_id,))
+			db.execute("DELETE FROM HIGHLIGHTS WHERE user_id=?", (user_id,))
+			db.execute("DELETE FROM NOTE WHERE user_id=?", (user_id,))
+			db.execute("DELETE FROM SAVED_PAPERS WHERE user_id=?", (user_id,))
 			# db.execute("DELETE FROM USERAPI WHERE user_id=?", (user_id,))
+		sessions.forget_user(user_id)
 		return {"message": "Profile content reset successfully"}
 	except Exception as e:
 		print("Reset profile error:\n", traceback.format_exc())  # full stack trace
@@ -574,41 +805,50 @@ def reset_user_profile(token: str):
 
 
 
+MAX_SAVED_PAGE = 500
+
 @app.put("/save_paper")
-def save_paper_to_user(token: str, doi: str):
-	user_id = auth_user(token)
-	if not user_id:
-		raise HTTPException(status_code=401, detail="Unauthorized")
+def save_paper_to_user(doi: str, user_id: int = Depends(current_user)):
 	with get_db() as db:
-		cur = db.execute("SELECT saved_papers FROM USERS WHERE user_id=?", (user_id,))
-		row = cur.fetchone()
-		papers = json.loads(row[0]) if row[0] else []
-		if doi not in papers:
-			papers.append(doi)
-			db.execute("UPDATE USERS SET saved_papers=? WHERE user_id=?", (json.dumps(papers), user_id))
+		db.execute(
+			"INSERT OR IGNORE INTO SAVED_PAPERS (user_id, doi, saved_at) VALUES (?, ?, ?)",
+			(user_id, doi, datetime.datetime.now().isoformat())
+		)
 		return {"message": "Paper saved"}
 
 
 @app.put("/remove_paper")
-def remove_saved_paper(token: str, doi: str):
-	user_id = auth_user(token)
-	if not user_id:
-		raise HTTPException(status_code=401, detail="Unauthorized")
+def remove_saved_paper(doi: str, user_id: int = Depends(current_user)):
 	with get_db() as db:
-		cur = db.execute("SELECT saved_papers FROM USERS WHERE user_id=?", (user_id,))
-		row = cur.fetchone()
-		papers = json.loads(row[0]) if row[0] else []
-		if doi in papers:
-			papers.remove(doi)
-			db.execute("UPDATE USERS SET saved_papers=? WHERE user_id=?", (json.dumps(papers), user_id))
+		db.execute("DELETE FROM SAVED_PAPERS WHERE user_id=? AND doi=?", (user_id, doi))
 		return {"message": "Paper removed"}
 
 
+@app.get("/saved_papers")
+def list_saved_papers(
+	limit: int = Query(100, ge=1, le=MAX_SAVED_PAGE),
+	after: Optional[int] = None,
+	user_id: int = Depends(current_user)
+):
+	# Oldest first; pass the last id seen as `after` for the next page.
+	with get_db() as db:
+		cur = db.execute(
+			"SELECT id, doi, saved_at FROM SAVED_PAPERS WHERE user_id=? AND id>? ORDER BY id LIMIT ?",
+			(user_id, after or 0, limit)
+		)
+		return [{"id": row[0], "doi": row[1], "saved_at": row[2]} for row in cur.fetchall()]
+
+
+@app.get("/tasks/{task_id}")
+def get_task_status(task_id: int, user_id: int = Depends(current_user)):
+	task = tasks.get(task_id, user_id=user_id)
+	if task is None:
+		raise HTTPException(status_code=404, detail="Task not found")
+	return task
+
+
 @app.put("/update_openai_key")
-def update_openai_key(token: str, data: APIKeyUpdate):
-	user_id = auth_user(token)
-	if not user_id:
-		raise HTTPException(status_code=401, detail="Unauthorized")
+def update_openai_key(data: APIKeyUpdate, user_id: int = Depends(current_user)):
 	try:
 		if not data.openai_key:
 			raise HTTPException(status_code=400, detail="OpenAI key is required")
@@ -629,10 +869,7 @@ def update_openai_key(token: str, data: APIKeyUpdate):
 
 
 @app.get("/openai_key")
-def get_current_user_openai_key(token: str):
-	user_id = auth_user(token)
-	if not user_id:
-		raise HTTPException(status_code=401, detail="Unauthorized")
+def get_current_user_openai_key(user_id: int = Depends(current_user)):
 	try:
 		with get_db() as db:
 			cur = db.execute("SELECT openai_key FROM USERAPI WHERE user_id=?", (user_id,))
@@ -668,96 +905,47 @@ def update_user_api(user_id: int, data: APIKeyUpdate):
 
 # OPENAI QUERY
 
-def fetch_paper_text_by_id(pid: str):
-	resp = requests.get(
-		"http://backend:8000/get_text_by_paper_id",
-		params={"paper_id": pid},
-		timeout=10
-	)
-	resp.raise_for_status()
-	return resp.json()
-
-@app.post("/analyze_paper")
-def analyze_paper(pdf: str = Query(...), token: str = Query(...)) -> Any:
+def openai_client(user_id: int = Depends(current_user)):
+	"""The caller's OpenAI client; override this dependency to stub it."""
 	try:
-		key_payload = get_current_user_openai_key(token)
+		key_payload = get_current_user_openai_key(user_id=user_id)
 		openai_key = (key_payload or {}).get("openai_key")
-		if not openai_key:
-			raise HTTPException(status_code=400, detail="No OpenAI key found for user")
 	except HTTPException:
 		raise
 	except Exception as e:
 		raise HTTPException(status_code=500, detail=f"Failed to get OpenAI key: {str(e)}")
+	if not openai_key:
+		raise HTTPException(status_code=400, detail="No OpenAI key found for user")
+	return OpenAI(api_key=openai_key)
 
+@app.post("/analyze_paper")
+async def analyze_paper(pdf: str = Query(...), client: Any = Depends(openai_client)) -> Any:
 	try:
 		stem = os.path.splitext(os.path.basename(pdf))[0]
 		doi = stem.replace("_", "/")
-		paper_id = _resolve_id_from_doi(doi) or doi
 	except Exception as e:
 		raise HTTPException(status_code=400, detail=f"Invalid PDF filename for DOI: {str(e)}")
 
-	# Check cache first
-	with get_db() as db:
-		cur = db.execute("SELECT ai_response FROM ANALYSIS_CACHE WHERE doi=?", (doi,))
-		row = cur.fetchone()
-		if row:
-			try:
-				return JSONResponse(content=json.loads(row[0]))
-			except Exception:
-				pass
-
-	try:
-		paper_data = fetch_paper_text_by_id(paper_id)
-		paper_text = paper_data.get("text", "")
-		if not paper_text.strip():
-			raise HTTPException(status_code=404, detail="Paper text not found")
-	except HTTPException:
-		raise
-	except Exception as e:
-		raise HTTPException(status_code=500, detail=f"Failed to get paper text: {str(e)}")
+	return JSONResponse(content=await analysis.analyze(doi, client))
 
-	try:
-		client = OpenAI(api_key=openai_key)
-		prompt = f"""
-		You are an academic research assistant. Analyze the following paper text and return ONLY valid JSON with the structure:
-		{{
-		  "summary": {{
-			"research_problem": "...",
-			"method": "...",
-			"data_collection": "...",
-			"data_analysis": "...",
-			"methodological_choices": "..."
-		  }},
-		  "quotes": [
-			{{"quote": "...", "why_important": "..."}}
-		  ]
-		}}
-		
-		Paper text:
-		\"\"\"{paper_text}\"\"\"
-		"""
-		response = client.responses.create(model="gpt-4.1", input=prompt, temperature=0)
-		parsed = json.loads(response.output_text.strip())
-
-		# Save to cache
-		with get_db() as db:
-			db.execute(
-				"INSERT OR REPLACE INTO ANALYSIS_CACHE (doi, ai_response) VALUES (?, ?)",
-				(doi, json.dumps(parsed))
-			)
+@app.get("/analyze_paper/stream")
+async def analyze_paper_stream(pdf: str = Query(...), client: Any = Depends(openai_client)):
+	"""Server-Sent Events version of /analyze_paper (see analysis.analysis_events)."""
+	stem = os.path.splitext(os.path.basename(pdf))[0]
+	doi = stem.replace("_", "/")
 
-		return JSONResponse(content=parsed)
+	async def events():
+		async for event, data in analysis.analysis_events(doi, client):
+			yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
-	except json.JSONDecodeError:
-		raise HTTPException(status_code=500, detail="Model did not return valid JSON")
-	except Exception as e:
-		raise HTTPException(status_code=500, detail=f"OpenAI API call failed: {str(e)}")
+	return StreamingResponse(
+		events(),
+		media_type="text/event-stream",
+		headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+	)
 
 @app.post("/fav_params/set_field1")
-def set_field1(data: FavParamIn, token: str = Query(...)):
-	user_id = auth_user(token)
-	if not user_id:
-		raise HTTPException(status_code=401, detail="Unauthorized")
+def set_field1(data: FavParamIn, user_id: int = Depends(current_user)):
 	with get_db() as db:
 		db.execute("""
 			INSERT INTO user_fav_params (user_id, field_1) VALUES (?, ?)
@@ -767,10 +955,7 @@ def set_field1(data: FavParamIn, token: str = Query(...)):
 
 
 @app.get("/fav_params/field1")
-def get_field1(token: str = Query(...)):
-	user_id = auth_user(token)
-	if not user_id:
-		raise HTTPException(status_code=401, detail="Unauthorized")
+def get_field1(user_id: int = Depends(current_user)):
 	with get_db() as db:
 		cur = db.execute("SELECT field_1 FROM user_fav_params WHERE user_id=?", (user_id,))
 		row = cur.fetchone()
@@ -242,7 +242,7 @@ export default function HomePage() {
                         {p.Author || "Unknown"}
                       </div>
                       <div className="font-4003 text-[14px]">
-                        {p.Abstract || p.paperContent || "Not available."}
+                        {p.Abstract || p.snippet || p.paperContent || "Not available."}
                       </div>
                     </div>
                   </div>
@@ -297,7 +297,7 @@ export default function HomePage() {
                     {paper._source?.Author || "Unknown"}
                   </div>
                   <div className="font-4003 text-[14px]">
-                    {paper._source?.paperContent || "Not available."}
+                    {paper._source?.snippet || paper._source?.paperContent || "Not available."}
                   </div>
                 </div>
               </div>
@@ -320,7 +320,7 @@ export default function PaperPage() {
                           {p.Author || "Unknown"}
                         </div>
                         <div className="font-4003 text-[14px]">
-                          {p.paperContent || "Not available."}
+                          {p.snippet || p.paperContent || "Not available."}
                         </div>
                       </div>
                     </div>
@@ -1,37 +1,302 @@
-import sys
+"""
+Convert a tree of PDFs to .txt (plus a .pages.json offsets sidecar).
+
+    python convertPDF.py <src_dir> <dst_dir> [--workers N] [--batch 32]
+                         [--timeout 120] [--manifest PATH] [--retry-failed]
+
+src_dir is walked recursively and the layout is mirrored under dst_dir.
+Every PDF seen is recorded in a SQLite manifest (default
+<dst_dir>/convert_manifest.db) with its size, mtime and SHA-256, so a rerun
+skips files whose size and mtime are unchanged. A file whose stat changed
+but whose hash did not (touched, copied back) is not converted again
+either. Files that failed or hit --timeout are also skipped on later runs
+unless --retry-failed is given.
+
+Workers get batches of --batch files over a pipe, and report each file
+before and after converting it. A worker stuck on one file past --timeout
+(or one that crashes inside MuPDF) is killed and replaced. That file is
+recorded as timeout/failed, and the rest of its batch is handed out again.
+Results are committed to the manifest every COMMIT_EVERY files, so a crash
+loses at most that much progress. Outputs are written under a temporary
+name and renamed into place.
+"""
+
 import os
-import concurrent.futures
-import fitz
+import sys
+import json
 import time
+import sqlite3
+import hashlib
+import argparse
+import collections
+import multiprocessing
+from multiprocessing.connection import wait
+
+import fitz
+
+DEFAULT_BATCH = 32
+DEFAULT_TIMEOUT = 120
+COMMIT_EVERY = 500
+LOG_INTERVAL_SECONDS = 10
+
 
-def convert_pdf_to_txt(args):
-    pdf_path, txt_path = args
+def pages_path(txt_path):
+    # Sidecar with the offset in the .txt where each page starts, e.g.
+    # [0, 2710, 5388]; insertContentToES.py indexes it as pageOffsets.
+    return os.path.splitext(txt_path)[0] + '.pages.json'
+
+
+def _write_atomic(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    # newline="" writes the text as extracted: the page offsets count
+    # characters of page.get_text(), \r and \r\n included.
+    with open(tmp, 'w', encoding='utf-8', newline='') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def convert_pdf_to_txt(job):
+    """Returns (rel, status, sha256, pages, error); runs in a worker."""
+    rel, pdf_path, txt_path, known_sha = job
+    sha = None
     try:
-        doc = fitz.open(pdf_path)
-        with open(txt_path, 'w', encoding='utf-8') as f:
+        with open(pdf_path, 'rb') as f:
+            data = f.read()
+        sha = hashlib.sha256(data).hexdigest()
+        if sha == known_sha and os.path.exists(txt_path) and os.path.exists(pages_path(txt_path)):
+            return rel, "unchanged", sha, None, None
+
+        texts = []
+        offsets = []
+        pos = 0
+        with fitz.open(stream=data, filetype="pdf") as doc:
             for page in doc:
-                f.write(page.get_text())
-        return 1
-    except Exception:
-        return 0
+                text = page.get_text()
+                offsets.append(pos)
+                pos += len(text)
+                texts.append(text)
+        os.makedirs(os.path.dirname(txt_path), exist_ok=True)
+        _write_atomic(txt_path, "".join(texts))
+        _write_atomic(pages_path(txt_path), json.dumps(offsets))
+        return rel, "done", sha, len(offsets), None
+    except Exception as e:
+        return rel, "failed", sha, None, f"{type(e).__name__}: {e}"
+
+
+def _worker(conn):
+    while True:
+        batch = conn.recv()
+        if batch is None:
+            return
+        for job in batch:
+            conn.send(("start", job[0]))
+            conn.send(("result", convert_pdf_to_txt(job)))
+
+
+class Manifest:
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute('''CREATE TABLE IF NOT EXISTS FILES (
+            rel_path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            sha256 TEXT,
+            status TEXT NOT NULL,
+            pages INTEGER,
+            error TEXT,
+            converted_at TEXT NOT NULL
+        ) WITHOUT ROWID''')
+        self.db.commit()
+        self.uncommitted = 0
+
+    def lookup(self, rel):
+        return self.db.execute(
+            "SELECT size, mtime_ns, sha256, status FROM FILES WHERE rel_path=?", (rel,)
+        ).fetchone()
+
+    def record(self, rel, size, mtime_ns, sha, status, pages=None, error=None):
+        self.db.execute(
+            "INSERT OR REPLACE INTO FILES (rel_path, size, mtime_ns, sha256, status, pages, error, converted_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (rel, size, mtime_ns, sha, status, pages, error, time.strftime("%Y-%m-%dT%H:%M:%S"))
+        )
+        self.uncommitted += 1
+        if self.uncommitted >= COMMIT_EVERY:
+            self.commit()
 
-def main(src_dir, dst_dir):
+    def commit(self):
+        self.db.commit()
+        self.uncommitted = 0
+
+
+def discover(src_dir):
+    """Yields (rel_path, abs_path, size, mtime_ns) for every PDF under src_dir."""
+    stack = [src_dir]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.lower().endswith('.pdf') and entry.is_file():
+                    st = entry.stat()
+                    yield os.path.relpath(entry.path, src_dir), entry.path, st.st_size, st.st_mtime_ns
+
+
+class _Slot:
+    """One worker process and the batch it is working through."""
+
+    def __init__(self, ctx):
+        self.conn, child = ctx.Pipe()
+        self.proc = ctx.Process(target=_worker, args=(child,), daemon=True)
+        self.proc.start()
+        child.close()
+        self.pending = collections.OrderedDict()  # rel -> job
+        self.current = None  # (rel, started_at)
+
+    def give(self, batch):
+        for job in batch:
+            self.pending[job[0]] = job
+        self.conn.send(batch)
+
+    def kill(self):
+        # The pipe stays open so messages sent before the kill can still
+        # be read.
+        self.proc.kill()
+        self.proc.join()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.proc.join(5)
+        if self.proc.is_alive():
+            self.proc.kill()
+
+
+def main(src_dir, dst_dir, workers=None, batch_size=DEFAULT_BATCH, timeout=DEFAULT_TIMEOUT,
+         manifest_path=None, retry_failed=False):
     os.makedirs(dst_dir, exist_ok=True)
-    pdf_files = [f for f in os.listdir(src_dir) if f.lower().endswith('.pdf')]
-    tasks = [(os.path.join(src_dir, f), os.path.join(dst_dir, os.path.splitext(f)[0] + '.txt')) for f in pdf_files]
+    manifest = Manifest(manifest_path or os.path.join(dst_dir, "convert_manifest.db"))
+    counts = collections.Counter()
+    stats = {}  # rel -> (size, mtime_ns), for files handed out and not yet recorded
+
+    def jobs():
+        # Lazy, so a 2M-file tree is never held in memory at once.
+        for rel, path, size, mtime_ns in discover(src_dir):
+            row = manifest.lookup(rel)
+            if row and (row[0], row[1]) == (size, mtime_ns) and (row[3] == "done" or not retry_failed):
+                counts["skipped"] += 1
+                continue
+            stats[rel] = (size, mtime_ns)
+            txt_path = os.path.join(dst_dir, os.path.splitext(rel)[0] + '.txt')
+            yield rel, path, txt_path, row[2] if row else None
 
-    counter = 0
+    new_jobs = jobs()
+    requeued = collections.deque()  # left over from killed workers
+
+    def next_batch():
+        batch = []
+        while requeued and len(batch) < batch_size:
+            batch.append(requeued.popleft())
+        if len(batch) < batch_size:
+            for job in new_jobs:
+                batch.append(job)
+                if len(batch) >= batch_size:
+                    break
+        return batch
+
+    def finish(rel, status, sha=None, pages=None, error=None):
+        size, mtime_ns = stats.pop(rel)
+        # "unchanged" means the same bytes were converted before.
+        manifest.record(rel, size, mtime_ns, sha, "done" if status == "unchanged" else status, pages, error)
+        counts[status] += 1
+
+    def drain(slot):
+        while slot.conn.poll():
+            try:
+                kind, value = slot.conn.recv()
+            except (EOFError, OSError):
+                return
+            if kind == "start":
+                slot.current = (value, time.monotonic())
+            else:
+                slot.pending.pop(value[0], None)
+                slot.current = None
+                finish(*value)
+
+    ctx = multiprocessing.get_context()
+    slots = [_Slot(ctx) for _ in range(workers or os.cpu_count() or 1)]
     start_time = time.time()
-    with concurrent.futures.ProcessPoolExecutor() as executor:
-        for result in executor.map(convert_pdf_to_txt, tasks):
-            counter += result
-            if counter % 500 == 0:
-                elapsed = time.time() - start_time
-                rate = counter / elapsed
-                print(f"{counter} PDFs processed ({rate:.2f} PDFs/sec)")
+    last_log = start_time
+    exhausted = False
+    try:
+        while True:
+            for slot in slots:
+                if not slot.pending and not exhausted:
+                    batch = next_batch()
+                    if batch:
+                        slot.give(batch)
+                    else:
+                        exhausted = not requeued
+            if exhausted and not any(s.pending for s in slots):
+                break
+
+            busy = {s.conn: s for s in slots if s.pending}
+            for conn in wait(list(busy), timeout=1):
+                drain(busy[conn])
+
+            now = time.monotonic()
+            for i, slot in enumerate(slots):
+                if not slot.pending:
+                    continue
+                timed_out = slot.current is not None and now - slot.current[1] > timeout
+                if not timed_out and slot.proc.is_alive():
+                    continue
+                slot.kill()
+                drain(slot)
+                if slot.current and slot.current[0] in slot.pending:
+                    rel = slot.current[0]
+                    slot.pending.pop(rel)
+                    if timed_out:
+                        finish(rel, "timeout", error=f"Killed after {timeout}s")
+                    else:
+                        finish(rel, "failed", error=f"Worker exited with code {slot.proc.exitcode}")
+                requeued.extend(slot.pending.values())
+                slot.conn.close()
+                exhausted = False
+                slots[i] = _Slot(ctx)
+
+            if time.time() - last_log >= LOG_INTERVAL_SECONDS:
+                last_log = time.time()
+                processed = sum(counts[k] for k in ("done", "unchanged", "failed", "timeout"))
+                rate = processed / (last_log - start_time)
+                print(f"{processed} PDFs processed ({rate:.2f} PDFs/sec) "
+                      f"done={counts['done']} unchanged={counts['unchanged']} "
+                      f"failed={counts['failed']} timeout={counts['timeout']} skipped={counts['skipped']}")
+    finally:
+        manifest.commit()
+        for slot in slots:
+            slot.stop()
+
+    elapsed = time.time() - start_time
+    print(f"Finished in {elapsed:.0f}s: done={counts['done']} unchanged={counts['unchanged']} "
+          f"failed={counts['failed']} timeout={counts['timeout']} skipped={counts['skipped']}")
+
 
 if __name__ == '__main__':
-    if len(sys.argv) != 3:
-        print("Usage: python script.py <src_dir> <dst_dir>")
+    parser = argparse.ArgumentParser(description="Convert PDFs to text, resuming from the manifest")
+    parser.add_argument("src_dir")
+    parser.add_argument("dst_dir")
+    parser.add_argument("--workers", type=int, default=None, help="default: number of CPUs")
+    parser.add_argument("--batch", type=int, default=DEFAULT_BATCH, help="PDFs per work unit")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT, help="seconds allowed per PDF")
+    parser.add_argument("--manifest", default=None, help="default: <dst_dir>/convert_manifest.db")
+    parser.add_argument("--retry-failed", action="store_true", help="retry files that failed or timed out")
+    args = parser.parse_args()
+    if not os.path.isdir(args.src_dir):
+        print(f"Not a directory: {args.src_dir}")
         sys.exit(1)
-    main(sys.argv[1], sys.argv[2])
+    main(args.src_dir, args.dst_dir, args.workers, args.batch, args.timeout, args.manifest, args.retry_failed)
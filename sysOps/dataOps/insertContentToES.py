@@ -1,10 +1,13 @@
 import os
 import json
 from elasticsearch import Elasticsearch, helpers
+from invalidate_cache import invalidate_api_cache
+import paper_id_map
 
 es = Elasticsearch("http://localhost:9200")
 index_name = "economic_papers"
 field_name = "paperContent"
+pages_field = "pageOffsets"
 
 # Add new searchable field
 es.indices.put_mapping(
@@ -12,6 +15,12 @@ es.indices.put_mapping(
     properties={
         field_name: {
             "type": "text"
+        },
+        # Start offset of each page in paperContent; only ever read back.
+        pages_field: {
+            "type": "integer",
+            "index": False,
+            "doc_values": False
         }
     }
 )
@@ -40,18 +49,28 @@ for path in txt_files:
     doi = rev_map.get(fname)
     if not doi:
         continue
-    with open(path, 'r', encoding='utf-8') as f:
+    # newline="" keeps any \r in the text, so pageOffsets still line up.
+    with open(path, 'r', encoding='utf-8', newline='') as f:
         content = f.read()
-    res = es.search(index=index_name, query={"term": {"DOI.keyword": doi}}, _source=["ID"], size=1)
-    hits = res.get("hits", {}).get("hits", [])
-    if not hits:
-        continue
-    doc_id = hits[0]["_source"]["ID"]
+    doc = {field_name: content}
+    # Sidecar written by convertPDF.py; older conversions have none.
+    pages = os.path.splitext(path)[0] + ".pages.json"
+    if os.path.exists(pages):
+        with open(pages, 'r', encoding='utf-8') as f:
+            doc[pages_field] = json.load(f)
+    doc_id = paper_id_map.id_for_doi(doi)
+    if not doc_id:
+        res = es.search(index=index_name, query={"term": {"DOI.keyword": doi}}, _source=["ID"], size=1)
+        hits = res.get("hits", {}).get("hits", [])
+        if not hits:
+            continue
+        doc_id = hits[0]["_source"]["ID"]
+        paper_id_map.store(doc_id, doi)
     batch.append({
         "_op_type": "update",
         "_index": index_name,
         "_id": doc_id,
-        "doc": {field_name: content}
+        "doc": doc
     })
     count += 1
     if count % 500 == 0:
@@ -62,3 +81,5 @@ for path in txt_files:
 if batch:
     helpers.bulk(es, batch, request_timeout=1200)
     print(f"{count} documents updated")
+
+invalidate_api_cache()
@@ -1,5 +1,6 @@
 import json
 from elasticsearch import Elasticsearch
+from invalidate_cache import invalidate_api_cache
 import time
 
 FILE_PATH = "../logs/economic_doi_abstracts_cleaned.json"
@@ -47,3 +48,5 @@ for batch in generate_batches(read_json_objects(FILE_PATH), BATCH_SIZE):
             }
         }, conflicts="proceed")
     print(f"Updated batch of {len(batch)} entries.")
+
+invalidate_api_cache()
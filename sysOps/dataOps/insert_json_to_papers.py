@@ -1,6 +1,8 @@
 import json
 import requests
 import os
+from invalidate_cache import invalidate_api_cache
+import paper_id_map
 
 FIELDS = [
     "ID", "DOI", "DOI2", "Title", "Author", "Year", "Month", "Day", "Volume", "Issue",
@@ -38,6 +40,7 @@ def ingest_to_elasticsearch_bulk(json_file):
         rows = json.load(f)
 
     bulk_payload = []
+    id_pairs = []
     count = 0
 
     for row_str in rows:
@@ -50,6 +53,7 @@ def ingest_to_elasticsearch_bulk(json_file):
         meta = { "index": { "_index": ES_INDEX, "_id": doc_id } }
         bulk_payload.append(json.dumps(meta))
         bulk_payload.append(json.dumps(doc))
+        id_pairs.append((doc_id, doc["DOI"]))
         count += 1
 
         if count % BULK_SIZE == 0:
@@ -57,16 +61,23 @@ def ingest_to_elasticsearch_bulk(json_file):
                                 headers={"Content-Type": "application/x-ndjson"})
             if res.status_code >= 300:
                 print("Bulk insert error:", res.text)
+            else:
+                paper_id_map.store_many(id_pairs)
             bulk_payload.clear()
+            id_pairs.clear()
 
     if bulk_payload:
         res = requests.post(f"{ES_URL}/_bulk", data='\n'.join(bulk_payload) + '\n',
                             headers={"Content-Type": "application/x-ndjson"})
         if res.status_code >= 300:
             print("Final bulk insert error:", res.text)
+        else:
+            paper_id_map.store_many(id_pairs)
 
 for i in range(33, 34):
     path = os.path.join(INPUT_DIR, f'part_{i}.json')
     if os.path.exists(path):
         print(f'Processing: {path}')
         ingest_to_elasticsearch_bulk(path)
+
+invalidate_api_cache()
@@ -0,0 +1,22 @@
+import os
+import requests
+
+# Where the Paperion API runs, and the admin token it was started with.
+# Whichever worker takes the call clears its own cache and marks the
+# invalidation in SEARCH_CACHE_SHARED_DIR; the other workers sharing that
+# directory drop their entries within SEARCH_CACHE_SYNC_SECONDS.
+API_URL = os.environ.get("PAPERION_API", "http://localhost:8000")
+ADMIN_TOKEN = os.environ.get("PAPERION_ADMIN_TOKEN")
+
+def invalidate_api_cache():
+    if not ADMIN_TOKEN:
+        print("PAPERION_ADMIN_TOKEN not set, API search cache left as is")
+        return
+    try:
+        res = requests.post(f"{API_URL}/cache/invalidate", params={"admin_token": ADMIN_TOKEN}, timeout=10)
+        print(f"API search cache invalidated: {res.json()}")
+    except Exception as e:
+        print(f"Could not invalidate API search cache: {e}")
+
+if __name__ == '__main__':
+    invalidate_api_cache()
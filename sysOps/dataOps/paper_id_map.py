@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The ID <-> DOI map lives with the API (backend/id_map.py); both sides
+# read and write the same file, ID_MAP_DB (default backend/id_map.db).
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "backend"))
+
+from id_map import normalize_doi, doi_for_id, dois_for_ids, id_for_doi, store, store_many  # noqa: E402
@@ -1,6 +1,7 @@
-import json
 from elasticsearch import Elasticsearch, helpers
 from elastic_transport import ConnectionTimeout
+from invalidate_cache import invalidate_api_cache
+import paper_id_map
 
 ES_URL = "http://localhost:9200"
 SRC_INDEX = "economic_papers"
@@ -9,6 +10,14 @@ BATCH_SIZE = 5000   # smaller chunk helps stability
 
 es = Elasticsearch(ES_URL)
 
+def ensure_mapping():
+	# Indices created before pageOffsets existed would otherwise map it
+	# dynamically as an indexed long with doc values.
+	es.indices.put_mapping(
+		index=DST_INDEX,
+		properties={"pageOffsets": {"type": "integer", "index": False, "doc_values": False}}
+	)
+
 def migrate():
 	resp = es.search(
 		index=SRC_INDEX,
@@ -37,18 +46,23 @@ def migrate():
 				paper_content = src_doc.get("paperContent")
 				if not paper_content:
 					continue
+				doc = {"paperContent": paper_content}
+				# Offsets only make sense next to the content they index.
+				if src_doc.get("pageOffsets"):
+					doc["pageOffsets"] = src_doc["pageOffsets"]
 
 				batch.append({
 					"_op_type": "update",
 					"_index": DST_INDEX,
 					"_id": pid,
-					"doc": {"paperContent": paper_content},
+					"doc": doc,
 					"doc_as_upsert": True,
 					"upsert": src_doc
 				})
 
 				if len(batch) >= BATCH_SIZE:
 					helpers.bulk(es, batch, request_timeout=600)
+					paper_id_map.store_many((b["_id"], b["upsert"].get("DOI")) for b in batch)
 					count += len(batch)
 					print(f"{count} docs processed")
 					batch = []
@@ -76,10 +90,13 @@ def migrate():
 
 	if batch:
 		helpers.bulk(es, batch, request_timeout=600)
+		paper_id_map.store_many((b["_id"], b["upsert"].get("DOI")) for b in batch)
 		count += len(batch)
 		print(f"{count} docs processed (final batch)")
 
 	print(f"Migration done. {count} docs updated/inserted.")
+	invalidate_api_cache()
 
 if __name__ == "__main__":
+	ensure_mapping()
 	migrate()